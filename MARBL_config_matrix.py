@@ -0,0 +1,174 @@
+import logging
+
+class MARBL_config_matrix_class(object):
+    """ This class resolves MARBL parameter values for every combination of a set of
+        grids and settings (e.g. grid in [CESM_x1, CESM_x3] and ciso_on in [.true.,
+        .false.]). All configurations share one read of the YAML file and a cache of
+        resolved values (see value_cache in MARBL_defaults_class), so a value that only
+        depends on things that are the same in several configurations (which is most
+        of them: scalar default_values do not depend on the configuration at all) is
+        computed once rather than once per configuration.
+
+        The interface matches MARBL_ensemble_class, with configurations as members;
+        get_differing_variable_names() lists the parm_dict keys whose values are not the
+        same in every configuration.
+    """
+
+    ###############
+    # CONSTRUCTOR #
+    ###############
+
+    def __init__(self, yaml_file, grids, settings=None, input_file=None, parms=None):
+        """ Class constructor: resolve every combination of grids (a list of grid
+            names) and settings (an ordered dictionary of variable name -> list of values
+            formatted as they would be in an input file). Values in input_file are
+            applied to every configuration (settings take precedence over them).
+
+            If parms is provided, it must be a dictionary returned by read_parms_file()
+            (or a MARBL_schema_class object) and yaml_file is ignored.
+        """
+
+        from itertools import product
+        from collections import OrderedDict
+        from MARBL_defaults import MARBL_defaults_class, read_parms_file, _parse_input_file, _get_override_aliases
+        from MARBL_schema import get_schema
+
+        logger = logging.getLogger(__name__)
+
+        if not grids:
+            logger.error("No grids to resolve configurations for")
+            _abort(1)
+        for var_name, values in (settings or dict()).items():
+            if not values:
+                logger.error("No values provided for %s" % var_name)
+                _abort(1)
+
+        if parms is None:
+            parms = read_parms_file(yaml_file)
+        schema = get_schema(parms)
+        if settings is None:
+            settings = OrderedDict()
+        base_overrides, base_sources = _parse_input_file(input_file)
+
+        self._configs = []
+        self._config_settings = OrderedDict()
+        self._parm_dicts = OrderedDict()
+        self._varnames = OrderedDict()
+        self._tracer_cnt = OrderedDict()
+        self._value_cache = dict()
+        self._resolved_var_cnt = 0
+        for grid in grids:
+            for values in product(*settings.values()):
+                config_settings = OrderedDict([("grid", grid)] + list(zip(settings.keys(), values)))
+                config = ", ".join(["%s=%s" % (var_name, value) for var_name, value in config_settings.items()])
+                overrides = dict(base_overrides)
+                for var_name, value in zip(settings.keys(), values):
+                    for old_name in _get_override_aliases(var_name):
+                        overrides.pop(old_name, None)
+                    overrides[var_name] = value
+                DefaultParms = MARBL_defaults_class(yaml_file, grid, overrides, parms=schema,
+                                                    input_sources=base_sources, value_cache=self._value_cache)
+                self._configs.append(config)
+                self._config_settings[config] = config_settings
+                self._parm_dicts[config] = DefaultParms.parm_dict
+                self._varnames[config] = DefaultParms.get_subcategory_index()
+                self._tracer_cnt[config] = DefaultParms.get_tracer_cnt()
+                self._resolved_var_cnt = self._resolved_var_cnt + len(DefaultParms.get_dependency_graph())
+
+        logger.debug("Resolved %d configurations: computed %d of %d YAML variables" %
+                     (len(self._configs), len(self._value_cache), self._resolved_var_cnt))
+
+    ################################################################################
+    #                             PUBLIC CLASS METHODS                             #
+    ################################################################################
+
+    def get_member_names(self):
+        """ Returns the list of configurations, named "grid=..., var=value, ..."; the
+            last setting varies fastest
+        """
+
+        return self._configs
+
+    ################################################################################
+
+    def get_config_settings(self, config):
+        """ Returns an ordered dictionary of the grid and settings for a configuration
+        """
+
+        return self._config_settings[config]
+
+    ################################################################################
+
+    def get_subcategory_names(self):
+        """ Returns a sorted list of subcategories; these do not depend on the
+            configuration.
+        """
+
+        return list(self._varnames[self._configs[0]].keys())
+
+    ################################################################################
+
+    def get_parm_dict(self, config):
+        """ Returns parm_dict for a specific configuration
+        """
+
+        return self._parm_dicts[config]
+
+    ################################################################################
+
+    def get_parm_dict_variable_names(self, config, subcategory):
+        """ Returns the sorted list of parm_dict keys for a specific configuration that
+            are in the provided subcategory
+        """
+
+        return self._varnames[config][subcategory]
+
+    ################################################################################
+
+    def get_tracer_cnt(self, config):
+        """ Return the number of tracers MARBL is running with for a specific configuration
+        """
+
+        return self._tracer_cnt[config]
+
+    ################################################################################
+
+    def get_differing_variable_names(self, subcategory):
+        """ Returns the sorted list of parm_dict keys in the provided subcategory whose
+            value differs between configurations (including keys that only exist in
+            some configurations, e.g. autotrophs(3)%... )
+        """
+
+        from MARBL_defaults import _sort, _natural_sort_key
+
+        varnames = set()
+        for config in self._configs:
+            varnames.update(self._varnames[config][subcategory])
+        differing = []
+        for varname in varnames:
+            values = set()
+            for config in self._configs:
+                values.add(self._parm_dicts[config].get(varname, None))
+                if len(values) > 1:
+                    differing.append(varname)
+                    break
+        return _sort(differing, sort_key=_natural_sort_key)
+
+    ################################################################################
+
+    def get_cache_stats(self):
+        """ Returns (number of YAML variables computed, number of YAML variables in all
+            configurations); the difference was copied from the value cache
+        """
+
+        return len(self._value_cache), self._resolved_var_cnt
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+def _abort(err_code=0):
+    """ This routine imports sys and calls exit
+    """
+    import sys
+    sys.exit(err_code)
@@ -1,4 +1,6 @@
 import logging
+import re
+from MARBL_expression import evaluate_real_expression
 
 class MARBL_defaults_class(object):
     """ This class contains methods to allow python to interact with the YAML file that
@@ -12,53 +14,87 @@ class MARBL_defaults_class(object):
     # CONSTRUCTOR #
     ###############
 
-    def __init__(self, yaml_file, grid, input_file):
+    def __init__(self, yaml_file, grid, input_file, parms=None, lazy=False, array_storage=False,
+                 input_sources=None, value_cache=None):
         """ Class constructor: set up a dictionary of config keywords for when multiple
             default values are provided, and then read the YAML file.
+
+            If parms is provided, it must be a dictionary returned by read_parms_file()
+            or a MARBL_schema_class object; the YAML file is not re-read and yaml_file is
+            ignored. The schema is never modified, so passing the same MARBL_schema_class
+            object to many MARBL_defaults_class objects (even in different threads) shares
+            a single copy of it.
+
+            input_file may also be an input_dict from iter_input_file_members(), in
+            which case input_sources (the matching "file:line" dictionary) is used in
+            error messages.
+
+            If lazy is True, parm_dict entries are not computed until they are accessed;
+            a variable is resolved (along with the variables it depends on) the first
+            time one of its keys is read. Call finalize() to check the input file for
+            variables that are not in the YAML.
+
+            If array_storage is True, arrays (and arrays of derived types) are stored one
+            column per component instead of one parm_dict key per element; parm_dict
+            still accepts keys like "grazing(2,1)%z_grz", but keys are only built when
+            iterating. Use this when PFT counts are large.
+
+            value_cache is an optional dictionary shared by objects built from the same
+            parms (see MARBL_config_matrix_class): the entries a YAML variable adds to
+            parm_dict are stored there, keyed by everything they depend on (the config
+            keywords that match its default_value keys, its overrides, and the values of
+            the variables it depends on), so other objects can reuse them instead of
+            recomputing them. It is not used with array_storage.
         """
 
-        logger = logging.getLogger(__name__)
+        from MARBL_schema import get_schema
 
-        # 1. List of configuration keywords to match in YAML if default_default is a dictionary
-        self._config_keyword = []
-        self._config_keyword.append("grid = " + grid)
+        # 1. Resolution state: list of configuration keywords to match in YAML if
+        #    default_value is a dictionary, and the overrides for the variable being resolved
+        self._context = _ResolutionContext(grid)
 
-        # 2. Read YAML file
-        try:
-            import yaml
-        except:
-            logger.error("Can not find PyYAML library")
-            _abort(1)
-        try:
-            with open(yaml_file) as parmsfile:
-                self._parms = yaml.safe_load(parmsfile)
-        except:
-            logger.error("Can not find %s" % yaml_file)
-            _abort(1)
+        # 2. Read YAML file and make sure it adheres to MARBL parameter file schema
+        if parms is None:
+            parms = read_parms_file(yaml_file)
+        self._schema = get_schema(parms)
+        self._parms = self._schema.parms
 
-        # 3 Make sure YAML file adheres to MARBL parameter file schema
-        if _invalid_parms_file(self._parms):
-            logger.error("%s is not a valid MARBL parameter file" % yaml_file)
-            _abort(1)
+        # 3. Read input file
+        #    (values are applied one YAML variable at a time, so _resolve_variable() and
+        #    update() keep track of which ones have been used; see finalize())
+        if isinstance(input_file, dict):
+            self._overrides = dict(input_file)
+            self._override_sources = dict(input_sources or {})
+        else:
+            self._overrides, self._override_sources = _parse_input_file(input_file)
+        self._unverified_overrides = set(self._overrides.keys())
+        self._unused_overrides = set()
 
-        # 4. Read input file
-        self._input_dict = _parse_input_file(input_file)
+        # 4. Determine which variables depend on the values of other variables
+        self._build_dependency_graph()
+        self._index_overrides()
 
         # 5. Use an ordered dictionary for keeping variable, value pairs
+        #    and index the keys by subcategory as they are added
         from collections import OrderedDict
-        self.parm_dict = OrderedDict()
-        for cat_name in self.get_category_names():
-            for var_name in self.get_variable_names(cat_name):
-                self._process_variable_value(cat_name, var_name)
+        self._lazy = lazy
+        self._array_storage = array_storage
+        self._value_cache = None if array_storage else value_cache
+        self._resolved_vars = set()
+        self._resolving_vars = set()
+        self._var_parm_names = dict()
+        self._init_subcategory_index()
+        if lazy or array_storage:
+            self.parm_dict = _ParmDict(self)
+        else:
+            self.parm_dict = OrderedDict()
+        if lazy:
+            return
+        self._resolve_all()
 
         # 6. Abort if not all values from input file were processed
         #    (That implies at least one variable from input file was not recognized)
-        if (self._input_dict):
-            message = "Did not fully parse input file:"
-            for varname in self._input_dict.keys():
-                message = message + "\n     * Variable %s not found in YAML" % varname
-            logger.error(message)
-            _abort(1)
+        self.finalize()
 
     ################################################################################
     #                             PUBLIC CLASS METHODS                             #
@@ -68,8 +104,7 @@ class MARBL_defaults_class(object):
         """ Return the number of tracers MARBL is running with.
         """
 
-        return (self._parms['_tracer_cnt']['default'] +
-                _add_increments(self._parms['_tracer_cnt']['increments'], self.parm_dict))
+        return _get_dim_size(self._schema.tracer_cnt, self.parm_dict)
 
     ################################################################################
 
@@ -106,23 +141,22 @@ class MARBL_defaults_class(object):
     def get_subcategory_names(self):
         """ Returns a sorted list of subcategories in a specific category.
             For now, the list is sorted naturally (so 10 appears after 9, not after 1).
+        """
+        return self._subcat_names
+
+    ################################################################################
+
+    def get_subcategory_index(self):
+        """ Returns an ordered dictionary mapping each subcategory (in the order of
+            get_subcategory_names()) to the sorted list of parm_dict keys in that
+            subcategory (i.e. get_parm_dict_variable_names(subcategory)).
 
-            Optional: only return variables in a specific subcategory
+            The index is built while parm_dict is populated; do not modify it.
         """
-        subcat_list = []
-        for cat_name in self._parms['_order']:
-            for var_name in _sort(self._parms[cat_name].keys()):
-                if isinstance(self._parms[cat_name][var_name]['datatype'], dict):
-                    for subvar_name in _sort(self._parms[cat_name][var_name]['datatype'].keys()):
-                        if subvar_name[0] != '_':
-                            this_subcat = self._parms[cat_name][var_name]['datatype'][subvar_name]['subcategory']
-                            if this_subcat not in subcat_list:
-                                subcat_list.append(this_subcat)
-                else:
-                    this_subcat = self._parms[cat_name][var_name]['subcategory']
-                    if this_subcat not in subcat_list:
-                        subcat_list.append(this_subcat)
-        return _sort(subcat_list, sort_key=_natural_sort_key)
+        if self._lazy:
+            self._resolve_all()
+        self._sort_subcategory_index()
+        return self._subcat_index
 
     ################################################################################
 
@@ -139,30 +173,421 @@ class MARBL_defaults_class(object):
             and subcategory, expanding variable names if they are arrays
             or derived types
         """
-        varlist = []
-        for cat_name in self._parms['_order']:
-            for var_name in _sort(self._parms[cat_name].keys()):
-                if isinstance(self._parms[cat_name][var_name]['datatype'], dict):
-                    for subvar_name in _sort(self._parms[cat_name][var_name]['datatype'].keys()):
-                        if subvar_name[0] != '_':
-                            this_var = self._parms[cat_name][var_name]['datatype'][subvar_name]
-                            if this_var['subcategory'] == subcategory:
-                                for parm_key in this_var['_list_of_parm_names']:
-                                    varlist.append(parm_key)
-                else:
-                    this_var = self._parms[cat_name][var_name]
-                    if this_var['subcategory'] == subcategory:
-                        for parm_key in this_var['_list_of_parm_names']:
-                            varlist.append(parm_key)
-        return _sort(varlist, sort_key=_natural_sort_key)
+        if self._lazy:
+            for var_name in self._var_category.keys():
+                if subcategory in self._var_subcats[var_name]:
+                    self._ensure_resolved(var_name)
+        if subcategory in self._unsorted_subcats:
+            self._sort_subcategory_index()
+        return self._subcat_index.get(subcategory, [])
+
+    ################################################################################
+
+    def get_dependency_graph(self):
+        """ Returns a dictionary mapping each YAML variable name to the sorted list of
+            YAML variables whose values (or array sizes) depend on it
+        """
+        dependency_graph = dict()
+        for var_name in self._var_category.keys():
+            dependency_graph[var_name] = _sort(self._dependents[var_name])
+        return dependency_graph
+
+    ################################################################################
+
+    def get_schema(self):
+        """ Returns the read-only MARBL_schema_class object the values were resolved
+            with (shared with any other object built from the same parms)
+        """
+
+        return self._schema
+
+    ################################################################################
+
+    def update(self, overrides):
+        """ Change values as if they had been in the input file, and recompute only the
+            parm_dict entries that are affected: the variables being changed, plus any
+            variables whose default value or array size depends on them (e.g. changing
+            autotroph_cnt adds or removes autotrophs(n)%... keys).
+
+            overrides is a dictionary of varname : value, where value is formatted as it
+            would be in the input file ("1.5", ".true.", "1, 2, 3" for arrays, etc).
+            A value of None removes an earlier override so the default is used again.
+
+            Overrides for array elements that no longer exist (e.g. autotrophs(3)%...
+            after autotroph_cnt is reduced to 2) are kept, and used again if the array
+            grows; all other overrides must match a key in the resulting parm_dict.
+            If the object is lazy, affected entries are recomputed when next accessed.
+        """
+
+        logger = logging.getLogger(__name__)
+
+        # 1. Parse new values the same way the input file is parsed, and determine
+        #    which YAML variables are being changed
+        new_overrides = dict()
+        removed_overrides = []
+        for varname, value in overrides.items():
+            if value is None:
+                removed_overrides.append(varname)
+                continue
+            try:
+                parsed_line = _tokenize_input_line("%s = %s" % (varname, value))
+            except ValueError as err:
+                logger.error("Can not update %s: %s" % (varname, err))
+                _abort(1)
+            _add_to_input_dict(new_overrides, parsed_line[0], parsed_line[1])
+        changed_vars = set()
+        unknown_vars = []
+        for varname in list(new_overrides.keys()) + removed_overrides:
+            base_var = _get_base_var_name(varname)
+            if base_var in self._var_category:
+                changed_vars.add(base_var)
+            else:
+                unknown_vars.append(varname)
+        if unknown_vars:
+            message = "Can not update parm_dict:"
+            for varname in unknown_vars:
+                message = message + "\n     * Variable %s not found in YAML" % varname
+            logger.error(message)
+            _abort(1)
+
+        # 2. Merge into the overrides from the input file
+        #    (foo = val is shorthand for foo(1) = val, so only keep one of them; setting
+        #    or removing all of foo also drops foo(2), foo(3), ... from earlier values)
+        for varname in overrides.keys():
+            for old_name in _get_element_overrides(varname, self._overrides):
+                self._overrides.pop(old_name, None)
+                self._override_sources.pop(old_name, None)
+                self._unverified_overrides.discard(old_name)
+        for varname in removed_overrides:
+            for old_name in _get_override_aliases(varname):
+                self._overrides.pop(old_name, None)
+                self._unverified_overrides.discard(old_name)
+        for varname, value in new_overrides.items():
+            for old_name in _get_override_aliases(varname):
+                self._overrides.pop(old_name, None)
+                self._override_sources.pop(old_name, None)
+                self._unverified_overrides.discard(old_name)
+            self._overrides[varname] = value
+            self._unverified_overrides.add(varname)
+        self._index_overrides()
+
+        # 3. Forget the changed variables and everything that depends on them
+        for var_name in self._get_affected_vars(changed_vars):
+            if var_name in self._resolved_vars:
+                self._clear_variable(var_name)
+        if self._lazy:
+            return
+
+        # 4. Re-resolve them, and put parm_dict back in processing order
+        #    (re-resolved keys were appended to the end; _ParmDict always iterates in
+        #    processing order)
+        self._resolve_all()
+        if not isinstance(self.parm_dict, _ParmDict):
+            from collections import OrderedDict
+            parm_dict = OrderedDict()
+            for var_name in self._var_category.keys():
+                for parm_key in self._var_parm_names[var_name]:
+                    parm_dict[parm_key] = self.parm_dict[parm_key]
+            self.parm_dict.clear()
+            self.parm_dict.update(parm_dict)
+
+        # 5. Abort if any of the new values were not used
+        self.finalize()
+
+    ################################################################################
+
+    def finalize(self):
+        """ Abort if any values from the input file (or update()) do not correspond to
+            a key in parm_dict. This is called by the constructor and update() unless
+            lazy=True; lazy objects resolve any variables that still have unchecked
+            values before checking.
+        """
+
+        logger = logging.getLogger(__name__)
+
+        for varname in list(self._unverified_overrides):
+            base_var = _get_base_var_name(varname)
+            if base_var in self._var_category:
+                self._ensure_resolved(base_var)
+            else:
+                self._unverified_overrides.discard(varname)
+                self._unused_overrides.add(varname)
+
+        if self._unused_overrides:
+            message = "Did not fully parse input file:"
+            for varname in self._overrides.keys():
+                if varname in self._unused_overrides:
+                    message = message + "\n     * Variable %s not found in YAML" % varname
+                    if varname in self._override_sources:
+                        message = message + " (%s)" % self._override_sources[varname]
+            logger.error(message)
+            _abort(1)
+
+    ################################################################################
+
+    def get_parm_dict_sources(self):
+        """ Returns a dictionary mapping each parm_dict key whose value came from the
+            input file (or update()) to the "file:line" it came from
+        """
+
+        return _get_parm_dict_sources(self._override_sources, self.parm_dict)
+
+    ################################################################################
+
+    def validate(self, validator=None):
+        """ Check every parm_dict value against the datatype, valid_values, valid_range
+            and constraints in the YAML file; returns a list of every violation (see
+            MARBL_validator_class.validate_parm_dict()). Pass a MARBL_validator_class
+            object to reuse one that has already been built from the same YAML file.
+        """
+
+        if validator is None:
+            from MARBL_validator import MARBL_validator_class
+            validator = MARBL_validator_class(self._parms)
+        return validator.validate_parm_dict(self.parm_dict, self.get_parm_dict_sources())
+
+    ################################################################################
+
+    def get_pft_tables(self):
+        """ Returns an ordered dictionary mapping each array of derived types (autotrophs,
+            zooplankton, grazing) to a MARBL_pft_table_class object that holds its values
+            one typed column per component (see MARBL_pft_tables.py)
+        """
+
+        from MARBL_pft_tables import get_pft_tables
+        return get_pft_tables(self)
 
     ################################################################################
     #                            PRIVATE CLASS METHODS                             #
     ################################################################################
 
-    # TODO: define _value_is_valid()
-    #       i.  datatype match?
-    #       ii. optional valid_value key check
+    def _init_subcategory_index(self):
+        """ Set up self._subcat_index with an empty list for every subcategory in the
+            YAML file (including components of derived types); _update_parm_dict()
+            appends to these lists and _sort_subcategory_index() sorts them.
+        """
+        from collections import OrderedDict
+
+        self._subcat_names = list(self._schema.subcategories)
+        self._subcat_index = OrderedDict()
+        for subcat_name in self._subcat_names:
+            self._subcat_index[subcat_name] = []
+        self._unsorted_subcats = set()
+        # With array_storage, keys for array variables are only added to the index
+        # when it is sorted (see _process_array_variable())
+        self._unindexed_arrays = dict()
+
+    ################################################################################
+
+    def _sort_subcategory_index(self):
+        """ Sort the parm_dict keys naturally in each subcategory that has had keys
+            added since it was last sorted
+        """
+        for subcat_name in self._unsorted_subcats:
+            for var_name in self._unindexed_arrays.pop(subcat_name, []):
+                self._subcat_index[subcat_name].extend(self.parm_dict._arrays[var_name].keys(subcat_name))
+            self._subcat_index[subcat_name] = _sort(self._subcat_index[subcat_name],
+                                                    sort_key=_natural_sort_key)
+        self._unsorted_subcats = set()
+
+    ################################################################################
+
+    def _build_dependency_graph(self):
+        """ Set up
+            * self._var_category: ordered dictionary of YAML variable -> category, in
+              the order variables are processed
+            * self._var_subcats: YAML variable -> set of subcategories of its entries
+            * self._dependents: YAML variable -> set of YAML variables that need to be
+              recomputed when its value changes
+            * self._dependencies: YAML variable -> set of YAML variables that need to be
+              computed before it
+
+            A variable depends on another if
+              i.   its array size (or the size of a component) refers to it, including
+                   increments (e.g. tracer count depends on ciso_on)
+              ii.  a key in its default_value dictionary refers to it (e.g. autotroph_cnt
+                   depends on PFT_defaults)
+              iii. it is a derived type listed in the other's _CESM2_PFT_keys
+        """
+        from collections import OrderedDict
+
+        logger = logging.getLogger(__name__)
+
+        self._var_category = OrderedDict()
+        self._var_subcats = dict()
+        self._dependents = dict()
+        self._dependencies = dict()
+        self.get_category_names()
+        for var_name, var_spec in self._schema.variables.items():
+            self._var_category[var_name] = var_spec.category
+            self._var_subcats[var_name] = var_spec.subcats
+            self._dependents[var_name] = set()
+            self._dependencies[var_name] = set()
+
+        processing_order = list(self._var_category.keys())
+        for var_name, var_spec in self._schema.variables.items():
+            for dep_name in var_spec.dependencies:
+                if dep_name == var_name or dep_name not in self._var_category:
+                    # Not a YAML variable (e.g. "grid" or a component of the same derived type)
+                    continue
+                if processing_order.index(dep_name) > processing_order.index(var_name):
+                    logger.error("%s depends on %s, which is processed after it" % (var_name, dep_name))
+                    _abort(1)
+                self._dependents[dep_name].add(var_name)
+                self._dependencies[var_name].add(dep_name)
+
+            for derived_type_name in var_spec.pft_dependents:
+                self._dependents[var_name].add(derived_type_name)
+                self._dependencies[derived_type_name].add(var_name)
+
+    ################################################################################
+
+    def _index_overrides(self):
+        """ Set up self._var_overrides: YAML variable -> list of override keys for it
+        """
+        self._var_overrides = dict()
+        for varname in self._overrides.keys():
+            self._var_overrides.setdefault(_get_base_var_name(varname), []).append(varname)
+
+    ################################################################################
+
+    def _resolve_all(self):
+        """ Make sure every YAML variable has been added to parm_dict
+        """
+        for var_name in self._var_category.keys():
+            self._ensure_resolved(var_name)
+        if not self._array_storage:
+            # (with array_storage, don't build keys for the index until they are needed)
+            self._sort_subcategory_index()
+
+    ################################################################################
+
+    def _ensure_resolved(self, var_name):
+        """ Add a YAML variable to parm_dict (after the variables it depends on) unless
+            it has already been added or is currently being added
+        """
+        if var_name in self._resolved_vars or var_name in self._resolving_vars:
+            return
+        self._resolving_vars.add(var_name)
+        for dep_name in self._dependencies[var_name]:
+            self._ensure_resolved(dep_name)
+        self._resolve_variable(var_name)
+        self._resolving_vars.discard(var_name)
+
+    ################################################################################
+
+    def _resolve_variable(self, var_name):
+        """ Add a YAML variable to parm_dict, using only the overrides for that variable;
+            record any of those overrides that are not used
+        """
+        context = self._context
+        context.start_variable(dict([(varname, self._overrides[varname])
+                                     for varname in self._var_overrides.get(var_name, [])]))
+
+        if self._value_cache is None:
+            self._process_variable_value(self._var_category[var_name], var_name)
+        else:
+            self._process_variable_value_cached(var_name)
+
+        for varname in self._var_overrides.get(var_name, []):
+            if varname in self._unverified_overrides:
+                self._unverified_overrides.discard(varname)
+                if varname not in context.used_overrides:
+                    self._unused_overrides.add(varname)
+        context.start_variable(dict())
+        self._resolved_vars.add(var_name)
+        self._unsorted_subcats.update(self._var_subcats[var_name])
+
+    ################################################################################
+
+    def _process_variable_value_cached(self, var_name):
+        """ Same as _process_variable_value(), but if self._value_cache already has the
+            entries for this variable (with the same dependencies), copy them into
+            parm_dict, the subcategory index and the list of config keywords instead of
+            computing them again
+        """
+        context = self._context
+        cache_key = self._get_value_cache_key(var_name)
+        try:
+            parm_items, subcat_keys, config_keywords, used_overrides = self._value_cache[cache_key]
+        except KeyError:
+            subcat_lens = [(subcat_name, len(self._subcat_index[subcat_name]))
+                           for subcat_name in self._var_subcats[var_name]]
+            keyword_cnt = len(context.config_keywords)
+            self._process_variable_value(self._var_category[var_name], var_name)
+            self._value_cache[cache_key] = (
+                tuple([(parm_key, self.parm_dict[parm_key]) for parm_key in self._var_parm_names[var_name]]),
+                tuple([(subcat_name, tuple(self._subcat_index[subcat_name][subcat_len:]))
+                       for subcat_name, subcat_len in subcat_lens]),
+                tuple(context.config_keywords[keyword_cnt:]),
+                tuple(context.used_overrides))
+            return
+
+        parm_names = []
+        self._var_parm_names[var_name] = parm_names
+        for parm_key, value in parm_items:
+            self.parm_dict[parm_key] = value
+            parm_names.append(parm_key)
+        for subcat_name, parm_keys in subcat_keys:
+            self._subcat_index[subcat_name].extend(parm_keys)
+        context.config_keywords.extend(config_keywords)
+        context.used_overrides.update(used_overrides)
+
+    ################################################################################
+
+    def _get_value_cache_key(self, var_name):
+        """ Everything the parm_dict entries of a YAML variable depend on: its overrides,
+            the config keywords that match keys in its default_value dictionaries (in
+            order, since the last match wins), and the values of the variables it depends
+            on (array sizes, default_value keys, and PFT_defaults for derived types)
+        """
+        default_keys = self._schema.variables[var_name].default_keys
+
+        dep_values = []
+        for dep_name in _sort(self._dependencies[var_name]):
+            dep_values.append((dep_name, tuple([self.parm_dict[parm_key]
+                                                for parm_key in self._var_parm_names[dep_name]])))
+        return (var_name,
+                tuple(sorted(self._context.input_dict.items())),
+                tuple([key for key in self._context.config_keywords if key in default_keys]),
+                tuple(dep_values))
+
+    ################################################################################
+
+    def _get_affected_vars(self, changed_vars):
+        """ Return the set of YAML variables in changed_vars and everything that depends
+            on them (directly or indirectly)
+        """
+        affected_vars = set()
+        to_check = list(changed_vars)
+        while to_check:
+            var_name = to_check.pop()
+            if var_name not in affected_vars:
+                affected_vars.add(var_name)
+                to_check.extend(self._dependents[var_name])
+        return affected_vars
+
+    ################################################################################
+
+    def _clear_variable(self, var_name):
+        """ Remove everything a YAML variable added to parm_dict, the subcategory index,
+            and the list of configuration keywords so it can be processed again
+        """
+        for parm_key in self._var_parm_names.pop(var_name):
+            del self.parm_dict[parm_key]
+        if isinstance(self.parm_dict, _ParmDict):
+            self.parm_dict._arrays.pop(var_name, None)
+        for subcat_name in self._var_subcats[var_name]:
+            self._subcat_index[subcat_name] = [parm_key for parm_key in self._subcat_index[subcat_name]
+                                               if _get_base_var_name(parm_key) != var_name]
+            if var_name in self._unindexed_arrays.get(subcat_name, []):
+                self._unindexed_arrays[subcat_name].remove(var_name)
+        config_prefix = "%s = " % var_name
+        self._context.config_keywords = [key for key in self._context.config_keywords
+                                         if not key.startswith(config_prefix)]
+        self._resolved_vars.discard(var_name)
+
+    ################################################################################
 
     def _process_variable_value(self, category_name, variable_name):
         """ For a given variable in a given category, call _update_parm_dict()
@@ -170,74 +595,594 @@ class MARBL_defaults_class(object):
 
             NOTE: At this time, the only derived types in the YAML file are also arrays
         """
-        this_var = self._parms[category_name][variable_name]
+        var_spec = self._schema.variables[variable_name]
+        parm_names = []
+        self._var_parm_names[variable_name] = parm_names
+
+        if self._array_storage and var_spec.array_storable:
+            self._process_array_variable(category_name, variable_name)
+            return
 
-        if not isinstance(this_var["datatype"], dict):
-            this_var['_list_of_parm_names'] = []
-            self._update_parm_dict(this_var, variable_name)
+        if var_spec.derived_type is None:
+            self._update_parm_dict(var_spec, variable_name, parm_names=parm_names)
             return
 
         # Process derived type!
-        append_to_keys = (('PFT_defaults = "CESM2"' in self._config_keyword) and
-                          (category_name == "PFT_derived_types"))
-        if append_to_keys:
-            PFT_keys = self._parms['general_parms']['PFT_defaults']['_CESM2_PFT_keys'][variable_name]
+        append_to_keys = (('PFT_defaults = "CESM2"' in self._context.config_keywords) and
+                          (var_spec.pft_keys is not None))
         # Is the derived type an array? If so, treat each entry separately
-        if ("_array_size" in this_var.keys()):
-            for n, elem_index in enumerate(_get_array_info(this_var["_array_size"], self.parm_dict)):
+        if var_spec.array_size is not None:
+            for n, elem_index in enumerate(_get_array_info(var_spec.array_size, self.parm_dict)):
                 # Append "(index)" to variable name
                 base_name = "%s%s%%" % (variable_name, elem_index)
 
+                # Add key for specific PFT (without changing the shared list of keywords)
+                config_keywords = None
                 if append_to_keys:
-                    # Add key for specific PFT
-                    self._config_keyword.append('%s = "%s"' % (variable_name, PFT_keys[n]))
-
-                for key in _sort_with_specific_suffix_first(this_var["datatype"].keys(),'_cnt'):
-                    if key[0] != '_':
-                        # Call _update_parm_dict() for each variable in derived type
-                        this_component = this_var["datatype"][key]
-                        try:
-                            this_component['_list_of_parm_names']
-                        except:
-                            this_component['_list_of_parm_names'] = []
-                        self._update_parm_dict(this_component, base_name+key, base_name)
+                    config_keywords = self._context.config_keywords + ['%s = "%s"' % (variable_name,
+                                                                                      var_spec.pft_keys[n])]
 
+                for this_component in var_spec.derived_type.components:
+                    # Call _update_parm_dict() for each variable in derived type
+                    self._update_parm_dict(this_component, base_name+this_component.name, base_name, parm_names,
+                                           config_keywords)
+
+    ################################################################################
+
+    def _process_array_variable(self, category_name, variable_name):
+        """ Version of _process_variable_value() for array_storage: values for an array
+            (or array of derived types) are stored in a _ParmArray with one column per
+            component. Default values only depend on the PFT key of each element, so they
+            are computed once per PFT key rather than once per element, and only elements
+            that appear in the input file are looked up by name.
+        """
+        var_spec = self._schema.variables[variable_name]
+        context = self._context
+
+        # 1. Shape of array, and components (or [None] if this is not a derived type)
+        if var_spec.derived_type is not None:
+            dims = _get_array_shape(var_spec.array_size, self.parm_dict)
+            components = [component.name for component in var_spec.derived_type.components]
+        else:
+            dims = _get_array_shape(var_spec.array_len, self.parm_dict)
+            components = [None]
+        parm_array = _ParmArray(variable_name, dims)
+
+        append_to_keys = (('PFT_defaults = "CESM2"' in context.config_keywords) and
+                          (var_spec.pft_keys is not None))
+
+        # 2. Which elements have values in the input file?
+        #    (foo = val is shorthand for foo(1) = val)
+        overrides = dict()
+        for varname in context.input_dict.keys():
+            parsed_key = _parse_parm_key(varname)
+            if parsed_key is None:
+                continue
+            index, component, sub_index = parsed_key[1:]
+            if index is None and component is None:
+                index = (1,)
+            elem = parm_array.get_flat_index(index)
+            if elem is not None and component in components:
+                overrides.setdefault((elem, component), set()).add(sub_index)
+
+        # 3. Fill in one column per component
+        for component in components:
+            if component is None:
+                this_component = var_spec
+                is_array = False
+            else:
+                this_component = var_spec.derived_type.component_index[component]
+                is_array = (this_component.array_size is not None)
+            default_values = dict()
+            column = []
+            for elem in range(parm_array.get_size()):
+                config_keywords = context.config_keywords
                 if append_to_keys:
-                    # Remove PFT-specific key
-                    del self._config_keyword[-1]
+                    config_keywords = config_keywords + ['%s = "%s"' % (variable_name, var_spec.pft_keys[elem])]
+                if config_keywords[-1] not in default_values:
+                    default_values[config_keywords[-1]] = _get_var_value(variable_name, this_component,
+                                                                         config_keywords)
+                default_value = default_values[config_keywords[-1]]
+
+                if is_array:
+                    # Component is an array: each element of the column is a list
+                    value = []
+                    for n in range(_get_component_dim_size(this_component.array_len.dims[0], parm_array, elem,
+                                                           self.parm_dict)):
+                        value.append(default_value[n] if isinstance(default_value, tuple) else default_value)
+                    for sub_index in overrides.get((elem, component), []):
+                        n = 1 if sub_index is None else sub_index
+                        if 1 <= n <= len(value):
+                            full_name = "%s%%%s(%d)" % (parm_array.get_key(elem), component, n)
+                            value[n-1] = _get_var_value(full_name, this_component, config_keywords, context)
+                elif component is None:
+                    value = default_value[elem] if isinstance(default_value, tuple) else default_value
+                    if (elem, None) in overrides:
+                        value = _get_var_value(parm_array.get_key(elem), this_component, config_keywords, context)
+                else:
+                    value = default_value
+                    if None in overrides.get((elem, component), []):
+                        full_name = "%s%%%s" % (parm_array.get_key(elem), component)
+                        value = _get_var_value(full_name, this_component, config_keywords, context)
+                column.append(value)
+            parm_array.add_column(component, column, this_component.datatype,
+                                  this_component.subcategory, is_array)
+
+        # 4. Store the array; keys are added to the subcategory index when it is sorted
+        self.parm_dict._arrays[variable_name] = parm_array
+        for subcat_name in self._var_subcats[variable_name]:
+            self._unindexed_arrays.setdefault(subcat_name, []).append(variable_name)
 
     ################################################################################
 
-    def _update_parm_dict(self, this_var, var_name, base_name=''):
+    def _update_parm_dict(self, var_spec, var_name, base_name='', parm_names=None, config_keywords=None):
         """ For a given variable in a given category, add to the self.parm_dict dictionary
             * For derived types, user passes in component as well as base_name ("variable_name%")
             * For arrays, multiple entries will be added to self.parm_dict
 
-            Also introduce a new key to the variable dictionary, '_list_of_parm_names', that
-            is populated with a list of all the keys added to self.parm_dict for this variable
-            (just varname for scalars, but multiple keys for arrays)
+            If parm_names is provided, keys are also appended to it (in the order they are
+            added to self.parm_dict). config_keywords defaults to the object's list of
+            config keywords (elements of PFT derived types add their PFT key to a copy).
         """
-        if ("_array_size" in this_var.keys()):
-            # Get length of array
-            try:
-                array_len = this_var["_array_len_to_print"]
-            except:
-                array_len = this_var["_array_size"]
-
+        context = self._context
+        if parm_names is None:
+            parm_names = []
+        if config_keywords is None:
+            config_keywords = context.config_keywords
+        if var_spec.array_size is not None:
             # For each element, get value from either input file or YAML
-            for n, elem_index in enumerate(_get_array_info(array_len, self.parm_dict, base_name)):
+            for n, elem_index in enumerate(_get_array_info(var_spec.array_len, self.parm_dict, base_name)):
                 full_name = var_name + elem_index
-                var_value = _get_var_value(full_name, this_var, self._config_keyword, self._input_dict)
-                if isinstance(var_value, list):
-                    self.parm_dict[full_name] = var_value[n]
-                else:
-                    self.parm_dict[full_name] = var_value
-                this_var['_list_of_parm_names'].append(full_name)
+                var_value = _get_var_value(full_name, var_spec, config_keywords, context)
+                if isinstance(var_value, tuple):
+                    var_value = var_value[n]
+                self.parm_dict[full_name] = var_value
+                self._subcat_index[var_spec.subcategory].append(full_name)
+                parm_names.append(full_name)
+                _append_to_config_keywords(full_name, var_spec, var_value, config_keywords)
 
         else:
             # get value from either input file or YAML
-            self.parm_dict[var_name] = _get_var_value(var_name, this_var, self._config_keyword, self._input_dict)
-            this_var['_list_of_parm_names'].append(var_name)
+            var_value = _get_var_value(var_name, var_spec, config_keywords, context)
+            self.parm_dict[var_name] = var_value
+            self._subcat_index[var_spec.subcategory].append(var_name)
+            parm_names.append(var_name)
+            _append_to_config_keywords(var_name, var_spec, var_value, config_keywords)
+
+################################################################################
+
+class _ResolutionContext(object):
+    """ Per-object resolution state (the schema itself is never modified):
+            config_keywords : keywords to match against default_value keys, e.g.
+                              "grid = CESM_x1" and 'PFT_defaults = "CESM2"'
+            input_dict      : input file values for the YAML variable being resolved
+            used_overrides  : keys of input_dict that have been used
+    """
+
+    __slots__ = ("config_keywords", "input_dict", "used_overrides")
+
+    def __init__(self, grid):
+        self.config_keywords = ["grid = " + grid]
+        self.input_dict = dict()
+        self.used_overrides = set()
+
+    def start_variable(self, input_dict):
+        """ Start resolving a new YAML variable with the given input file values
+        """
+        self.input_dict = input_dict
+        self.used_overrides = set()
+
+    def has_override(self, varname):
+        return varname in self.input_dict and varname not in self.used_overrides
+
+    def use_override(self, varname):
+        self.used_overrides.add(varname)
+        return self.input_dict[varname]
+
+################################################################################
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+class _ParmDict(MutableMapping):
+    """ parm_dict for MARBL_defaults_class objects created with lazy=True or
+        array_storage=True; it behaves like the usual ordered dictionary, but
+        * with lazy=True, reading a key resolves the YAML variable it belongs to (and
+          the variables it depends on) the first time it is accessed
+        * with array_storage=True, arrays are kept in _ParmArray objects and keys like
+          "autotrophs(2)%kFe" are only built when iterating
+        Iterating resolves everything, and keys are returned in the same order as the
+        ordered dictionary used otherwise. Array elements can be changed but not deleted.
+    """
+
+    def __init__(self, defaults_obj):
+        from collections import OrderedDict
+        self._defaults_obj = defaults_obj
+        self._data = OrderedDict()
+        self._arrays = dict()
+
+    def __getitem__(self, key):
+        if key in self._data:
+            return self._data[key]
+        base_var = _get_base_var_name(key)
+        if base_var in self._defaults_obj._var_category:
+            self._defaults_obj._ensure_resolved(base_var)
+            if key in self._data:
+                return self._data[key]
+            if base_var in self._arrays:
+                return self._arrays[base_var].get_value(key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._data:
+            base_var = _get_base_var_name(key)
+            if base_var in self._arrays and self._arrays[base_var].set_value(key, value):
+                return
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __iter__(self):
+        self._defaults_obj._resolve_all()
+        for var_name in self._defaults_obj._var_category.keys():
+            if var_name in self._arrays:
+                for parm_key in self._arrays[var_name].keys():
+                    yield parm_key
+            else:
+                for parm_key in self._defaults_obj._var_parm_names[var_name]:
+                    yield parm_key
+
+    def __len__(self):
+        self._defaults_obj._resolve_all()
+        parm_cnt = 0
+        for var_name in self._defaults_obj._var_category.keys():
+            if var_name in self._arrays:
+                parm_cnt = parm_cnt + self._arrays[var_name].get_key_cnt()
+            else:
+                parm_cnt = parm_cnt + len(self._defaults_obj._var_parm_names[var_name])
+        return parm_cnt
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, list(self.items()))
+
+    def get_parm_array(self, var_name):
+        """ _ParmArray holding var_name (None if it is not stored as one)
+        """
+        if var_name not in self._arrays and var_name in self._defaults_obj._var_category:
+            self._defaults_obj._ensure_resolved(var_name)
+        return self._arrays.get(var_name)
+
+################################################################################
+
+class _ParmArray(object):
+    """ Array-native storage for a YAML variable that is an array (or an array of
+        derived types): one column per component (a single column named None if the
+        variable is not a derived type), each with one entry per array element.
+        Components that are themselves arrays (e.g. grazing%auto_ind) store a list per
+        element. Integer columns are stored as array('l') when possible.
+
+        Elements are numbered in the order parm_dict keys were traditionally added,
+        i.e. (1,1), (1,2), ..., (2,1), ...
+    """
+
+    def __init__(self, var_name, dims):
+        from collections import OrderedDict
+        self._var_name = var_name
+        self._dims = dims
+        self._columns = OrderedDict()
+        self._subcategories = dict()
+        self._array_components = set()
+
+    def get_size(self):
+        """ Number of elements in the array
+        """
+        size = 1
+        for dim in self._dims:
+            size = size * dim
+        return size
+
+    def get_flat_index(self, index):
+        """ Convert a tuple of (1-based) indices to an element number, or return None if
+            index is not in the array
+        """
+        if index is None or len(index) != len(self._dims):
+            return None
+        elem = 0
+        for ind, dim in zip(index, self._dims):
+            if not 1 <= ind <= dim:
+                return None
+            elem = elem*dim + (ind-1)
+        return elem
+
+    def get_key(self, elem):
+        """ parm_dict key for an element number, e.g. "grazing(2,1)"
+        """
+        index = []
+        for dim in reversed(self._dims):
+            index.insert(0, str(elem % dim + 1))
+            elem = elem // dim
+        return "%s(%s)" % (self._var_name, ",".join(index))
+
+    def add_column(self, component, values, datatype, subcategory, is_array=False):
+        """ Store values (one per element) for a component
+        """
+        if is_array:
+            self._array_components.add(component)
+        elif datatype == "integer":
+            values = _compact_int_column(values)
+        self._columns[component] = values
+        self._subcategories[component] = subcategory
+
+    def get_column(self, component=None):
+        """ Values of a component (one per element)
+        """
+        return self._columns[component]
+
+    def keys(self, subcategory=None):
+        """ Generate parm_dict keys for every element (optionally only for components in
+            a specific subcategory)
+        """
+        components = [component for component in self._columns.keys()
+                      if subcategory is None or self._subcategories[component] == subcategory]
+        for elem in range(self.get_size()):
+            base_name = self.get_key(elem)
+            for component in components:
+                if component is None:
+                    yield base_name
+                elif component in self._array_components:
+                    for n in range(len(self._columns[component][elem])):
+                        yield "%s%%%s(%d)" % (base_name, component, n+1)
+                else:
+                    yield "%s%%%s" % (base_name, component)
+
+    def get_key_cnt(self):
+        """ Number of parm_dict keys in the array
+        """
+        key_cnt = 0
+        for component, column in self._columns.items():
+            if component in self._array_components:
+                for value in column:
+                    key_cnt = key_cnt + len(value)
+            else:
+                key_cnt = key_cnt + len(column)
+        return key_cnt
+
+    def _find(self, key):
+        """ Return (component, element number, sub-index or None) for a parm_dict key,
+            or None if the key is not in the array
+        """
+        parsed_key = _parse_parm_key(key)
+        if parsed_key is None or parsed_key[0] != self._var_name:
+            return None
+        index, component, sub_index = parsed_key[1:]
+        elem = self.get_flat_index(index)
+        if elem is None or component not in self._columns:
+            return None
+        if component in self._array_components:
+            if sub_index is None or not 1 <= sub_index <= len(self._columns[component][elem]):
+                return None
+        elif sub_index is not None:
+            return None
+        return component, elem, sub_index
+
+    def get_value(self, key):
+        """ Value for a parm_dict key (KeyError if key is not in the array)
+        """
+        location = self._find(key)
+        if location is None:
+            raise KeyError(key)
+        component, elem, sub_index = location
+        if sub_index is None:
+            return self._columns[component][elem]
+        return self._columns[component][elem][sub_index-1]
+
+    def set_value(self, key, value):
+        """ Change the value for a parm_dict key; returns False if key is not in the array
+        """
+        location = self._find(key)
+        if location is None:
+            return False
+        component, elem, sub_index = location
+        if sub_index is not None:
+            self._columns[component][elem][sub_index-1] = value
+            return True
+        try:
+            self._columns[component][elem] = value
+        except (TypeError, OverflowError):
+            # Typed column can not hold value
+            self._columns[component] = list(self._columns[component])
+            self._columns[component][elem] = value
+        return True
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def read_parms_file(yaml_file, use_cache=True):
+    """ Read a YAML file and make sure it conforms to MARBL parameter file standards.
+        Returns the dictionary pulled from YAML; this can be passed to the
+        MARBL_defaults_class constructor to avoid re-reading the file.
+
+        Parsing and validating the YAML is slow, so the validated dictionary is also
+        pickled to a cache file next to the YAML file (see _get_schema_cache_file()).
+        The cache is only used if it was made from a YAML file with the same contents
+        by the same _SCHEMA_CACHE_VERSION; set use_cache=False to ignore it.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        with open(yaml_file, "rb") as parmsfile:
+            yaml_contents = parmsfile.read()
+    except:
+        logger.error("Can not find %s" % yaml_file)
+        _abort(1)
+
+    if use_cache:
+        import hashlib
+        yaml_hash = hashlib.sha256(yaml_contents).hexdigest()
+        cache_file = _get_schema_cache_file(yaml_file)
+        parms = _read_schema_cache(cache_file, yaml_hash)
+        if parms is not None:
+            logger.debug("Using cached schema %s" % cache_file)
+            return parms
+        logger.debug("Schema cache %s is missing or out of date" % cache_file)
+
+    try:
+        import yaml
+    except:
+        logger.error("Can not find PyYAML library")
+        _abort(1)
+    try:
+        parms = yaml.safe_load(yaml_contents)
+    except:
+        logger.error("Can not parse %s" % yaml_file)
+        _abort(1)
+
+    if _invalid_parms_file(parms):
+        logger.error("%s is not a valid MARBL parameter file" % yaml_file)
+        _abort(1)
+
+    if use_cache:
+        _write_schema_cache(cache_file, yaml_hash, parms)
+
+    return parms
+
+################################################################################
+
+def iter_input_file_members(input_file, yield_errors=False):
+    """ Read an input file one line at a time; ignore blank lines and non-quoted
+        Fortran comments, and turn lines of the form
+              variable = value
+        into input_dict['variable'] = value (see _tokenize_input_line()).
+
+        An input file may contain several ensemble members, each starting with a line
+              !! member [name]
+        This is a generator that yields (name, input_dict, input_sources) for each
+        member as soon as it has been read, where input_sources maps each key in
+        input_dict to "file:line"; files without member markers are a single member
+        named None. Every line that can not be parsed is reported with its file and
+        line number as it is read, and then the run aborts once the whole file has
+        been read. With yield_errors=True nothing aborts: a member with errors (or a
+        file that can not be opened, named None) is yielded as (name, None, None)
+        as soon as it has been read, and the remaining members are still read.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        fin = open(input_file, "r")
+    except (IOError, OSError):
+        logger.error("input_file '%s' was not found" % input_file)
+        if yield_errors:
+            yield None, None, None
+            return
+        _abort(1)
+
+    member_name = None
+    member_cnt = 0
+    input_dict = dict()
+    input_sources = dict()
+    member_error_cnt = 0
+    error_cnt = 0
+    with fin:
+        for line_num, line in enumerate(fin, 1):
+            member_marker = _MEMBER_MARKER_RE.match(line)
+            if member_marker:
+                if member_cnt > 0 or member_error_cnt > 0:
+                    if member_error_cnt == 0:
+                        yield member_name, input_dict, input_sources
+                    elif yield_errors:
+                        yield member_name, None, None
+                elif input_dict:
+                    logger.error("%s:%d: member marker found after values that are not in a member" %
+                                 (input_file, line_num))
+                    error_cnt = error_cnt + 1
+                    if yield_errors:
+                        yield None, None, None
+                error_cnt = error_cnt + member_error_cnt
+                member_error_cnt = 0
+                member_cnt = member_cnt + 1
+                member_name = member_marker.group(1) or str(member_cnt)
+                input_dict = dict()
+                input_sources = dict()
+                continue
+
+            try:
+                parsed_line = _tokenize_input_line(line)
+            except ValueError as err:
+                logger.error("%s:%d: %s" % (input_file, line_num, err))
+                member_error_cnt = member_error_cnt + 1
+                continue
+            if parsed_line is None:
+                continue
+            source = "%s:%d" % (input_file, line_num)
+            for key in _add_to_input_dict(input_dict, parsed_line[0], parsed_line[1]):
+                input_sources[key] = source
+
+    error_cnt = error_cnt + member_error_cnt
+    if member_error_cnt > 0:
+        if yield_errors:
+            yield member_name, None, None
+    else:
+        yield member_name, input_dict, input_sources
+    if error_cnt > 0 and not yield_errors:
+        logger.error("Could not parse input_file '%s' (%d errors)" % (input_file, error_cnt))
+        _abort(1)
+
+################################################################################
+
+def clear_schema_cache(yaml_file):
+    """ Remove the cached schema for yaml_file (if it exists)
+    """
+    import os
+
+    logger = logging.getLogger(__name__)
+    cache_file = _get_schema_cache_file(yaml_file)
+    if os.path.isfile(cache_file):
+        os.remove(cache_file)
+        logger.debug("Removed schema cache %s" % cache_file)
+
+################################################################################
+
+def print_parm_dict(fout, subcat_names, get_variable_names, parm_dict):
+    """ Write "varname = value" for every variable, sorted by subcategory
+        (get_variable_names(subcat_name) returns the variables to write for subcat_name)
+    """
+    for subcat_name in subcat_names:
+        fout.write("! %s\n" % subcat_name.split('. ')[1])
+        for varname in get_variable_names(subcat_name):
+            fout.write("%s = %s\n" % (varname, parm_dict[varname]))
+        if subcat_name != subcat_names[-1]:
+            fout.write("\n")
+
+################################################################################
+
+def get_subcategory_list(parms):
+    """ Return the naturally-sorted list of subcategories in parms (as returned by
+        read_parms_file()), including those of derived type components; this is the
+        order get_subcategory_names() uses, and gen_code.py numbers subcategories by
+        their position in this list.
+    """
+
+    subcat_list = []
+    for cat_name in parms['_order']:
+        for var_name in parms[cat_name].keys():
+            if isinstance(parms[cat_name][var_name]['datatype'], dict):
+                for subvar_name in parms[cat_name][var_name]['datatype'].keys():
+                    if subvar_name[0] != '_':
+                        this_subcat = parms[cat_name][var_name]['datatype'][subvar_name]['subcategory']
+                        if this_subcat not in subcat_list:
+                            subcat_list.append(this_subcat)
+            else:
+                this_subcat = parms[cat_name][var_name]['subcategory']
+                if this_subcat not in subcat_list:
+                    subcat_list.append(this_subcat)
+
+    return _sort(subcat_list, sort_key=_natural_sort_key)
 
 ################################################################################
 #                            PRIVATE MODULE METHODS                            #
@@ -251,6 +1196,66 @@ def _abort(err_code=0):
 
 ################################################################################
 
+# Increment this whenever the format of the cached schema changes (or the
+# validation in _invalid_parms_file() does) to invalidate existing caches
+_SCHEMA_CACHE_VERSION = 1
+
+def _get_schema_cache_file(yaml_file):
+    """ The schema cache for dir/parameters.yaml is dir/.parameters.yaml.cache
+    """
+    import os
+    yaml_dir, yaml_name = os.path.split(os.path.abspath(yaml_file))
+    return os.path.join(yaml_dir, ".%s.cache" % yaml_name)
+
+################################################################################
+
+def _read_schema_cache(cache_file, yaml_hash):
+    """ Return the cached dictionary if cache_file exists and matches both yaml_hash
+        and _SCHEMA_CACHE_VERSION; otherwise return None
+    """
+    import pickle
+
+    try:
+        with open(cache_file, "rb") as fin:
+            cache = pickle.load(fin)
+    except:
+        # Missing, unreadable, or corrupt cache files are all cache misses
+        return None
+
+    if not isinstance(cache, dict):
+        return None
+    if cache.get("version") != _SCHEMA_CACHE_VERSION or cache.get("hash") != yaml_hash:
+        return None
+    return cache["parms"]
+
+################################################################################
+
+def _write_schema_cache(cache_file, yaml_hash, parms):
+    """ Pickle parms to cache_file; write to a temporary file and rename it so other
+        processes never see a partially-written cache. Failing to write the cache
+        (e.g. read-only directory) is not an error.
+    """
+    import os
+    import pickle
+    import tempfile
+
+    logger = logging.getLogger(__name__)
+    cache = dict(version=_SCHEMA_CACHE_VERSION, hash=yaml_hash, parms=parms)
+    try:
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+    except:
+        logger.debug("Can not write schema cache %s" % cache_file)
+        return
+    try:
+        with os.fdopen(fd, "wb") as fout:
+            pickle.dump(cache, fout, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file, cache_file)
+    except:
+        logger.debug("Can not write schema cache %s" % cache_file)
+        os.remove(tmp_file)
+
+################################################################################
+
 def _invalid_parms_file(YAMLdict):
     """ Read a YAML file, make sure it conforms to MARBL parameter file standards
         1. _order is a top-level key
@@ -338,61 +1343,211 @@ def _valid_variable_dict(var_dict, var_name):
 
 ################################################################################
 
-def _get_var_value(varname, var_dict, provided_keys, input_dict):
+def _get_var_value(varname, var_spec, provided_keys, context=None):
     """ Return the correct default value for a variable in the MARBL YAML parameter
         file INPUTS:
-            * dictionary containing variable information (req: longname, datatype
-              and default_value keys)
+            * _VariableSpec for the variable (see MARBL_schema.py)
             * list of keys to try to match in default_value
-            * dictionary containing values from input file
+            * _ResolutionContext whose input_dict contains values from input file
+              (None to only look at the YAML); values that are used are added to
+              context.used_overrides
     """
     # Either get value from input file or from the YAML
-    if varname in input_dict.keys():
+    if context is not None and context.has_override(varname):
         # Ignore ' and " from strings
-        def_value = input_dict[varname].strip('"').strip("'")
-        # Remove from input file dictionary; if dictionary is not empty after processing
-        # all input file lines, then it included a bad variable in it
-        del input_dict[varname]
+        def_value = context.use_override(varname).strip('"').strip("'")
     # Note that if variable foo is an array, then foo = bar in the input file
     # should be treated as foo(1) = bar
-    elif varname[-3:] == "(1)" and varname[:-3] in input_dict.keys():
-        def_value = input_dict[varname[:-3]].strip('"').strip("'")
-        # Remove from input file dictionary; if dictionary is not empty after processing
-        # all input file lines, then it included a bad variable in it
-        del input_dict[varname[:-3]]
+    elif varname[-3:] == "(1)" and context is not None and context.has_override(varname[:-3]):
+        def_value = context.use_override(varname[:-3]).strip('"').strip("'")
     else:
-        # is default value a dictionary? If so, it depends on self._config_keyword
+        # is default value a dictionary? If so, it depends on the config keywords
         # Otherwise we're interested in default value
-        if isinstance(var_dict["default_value"], dict):
+        if var_spec.default_keys:
             # NOTE: _invalid_parms_file() has ensured that this dictionary has a "default" key
             use_key = "default"
             for key in provided_keys:
                 # return "default" entry in default_values dictionary unless one of the keys
                 # in provided_keys matches
-                if key in var_dict["default_value"].keys():
+                if key in var_spec.default_keys:
                     use_key = key
-            def_value = var_dict["default_value"][use_key]
+            def_value = var_spec.default_value[use_key]
         else:
-            def_value = var_dict["default_value"]
-
-    # call value validation check
-
-    # Append to config keywords if YAML wants it
+            def_value = var_spec.default_value
 
     # if variable is a string, put quotes around the default value
-    if var_dict["datatype"] == "string":
-        if "_append_to_config_keywords" in var_dict.keys():
-            if var_dict["_append_to_config_keywords"]:
-                provided_keys.append('%s = "%s"' % (varname, def_value))
-        return '"%s"' % def_value
-    if var_dict["datatype"] == "real" and isinstance(def_value, str):
-        return "%20.15e" % eval(def_value)
-    if var_dict["datatype"] == "integer" and isinstance(def_value, str):
-        return int(def_value)
+    if var_spec.datatype == "string":
+        return '"%s"' % (def_value,)
+    if var_spec.datatype == "real" and isinstance(def_value, str):
+        return "%20.15e" % evaluate_real_expression(def_value, varname)
+    if var_spec.datatype == "integer" and isinstance(def_value, str):
+        try:
+            return int(def_value)
+        except ValueError:
+            # Not an integer; keep the string so the validator can report it
+            return def_value
     return def_value
 
 ################################################################################
 
+def _append_to_config_keywords(varname, var_spec, var_value, config_keywords):
+    """ Add 'varname = "value"' to config_keywords if the YAML asks for it
+        (var_value already has quotes around it)
+    """
+    if var_spec.append_to_config_keywords and var_spec.datatype == "string":
+        config_keywords.append('%s = %s' % (varname, var_value))
+
+################################################################################
+
+def _get_var_dependencies(var_dict):
+    """ Return the set of names a YAML variable refers to in its array sizes and
+        default_value keys (including those of derived type components)
+    """
+    dependencies = set()
+
+    for size_key in ["_array_size", "_array_len_to_print"]:
+        if size_key in var_dict.keys():
+            dependencies.update(_get_size_dependencies(var_dict[size_key]))
+
+    if isinstance(var_dict["datatype"], dict):
+        for key in var_dict["datatype"].keys():
+            if key[0] != '_':
+                dependencies.update(_get_var_dependencies(var_dict["datatype"][key]))
+    elif isinstance(var_dict["default_value"], dict):
+        for key in var_dict["default_value"].keys():
+            if key != "default":
+                dependencies.add(key.split(" = ")[0])
+
+    return dependencies
+
+################################################################################
+
+def _get_size_dependencies(size_in):
+    """ Return the set of names an _array_size entry refers to; see _get_dim_size()
+        and _get_array_info() for the formats of size_in
+    """
+    if isinstance(size_in, list):
+        dependencies = set()
+        for dim_in in size_in:
+            dependencies.update(_get_size_dependencies(dim_in))
+        return dependencies
+
+    if isinstance(size_in, dict):
+        dependencies = _get_size_dependencies(size_in['default'])
+        if 'increments' in size_in.keys():
+            for key_check in size_in['increments'].keys():
+                dependencies.add(key_check.split(" = ")[0])
+        return dependencies
+
+    if isinstance(size_in, int):
+        return set()
+    return set([size_in])
+
+################################################################################
+
+# Patterns for parm_dict keys: variable name is everything before the first ( or %,
+# and keys look like var_name[(index)][%component[(sub_index)]]
+_BASE_VAR_NAME_RE = re.compile(r'[^(%]*')
+_ARRAY_INDEX_RE = re.compile(r'\(\d+\)$')
+_PARM_KEY_RE = re.compile(r'^([A-Za-z_]\w*)(?:\((\d+(?:,\d+)*)\))?(?:%([A-Za-z_]\w*)(?:\((\d+)\))?)?$')
+
+def _get_base_var_name(varname):
+    """ Return the YAML variable name for a parm_dict key, e.g.
+            autotrophs(2)%PCref_per_day -> autotrophs
+            parm_scalelen_z(1) -> parm_scalelen_z
+    """
+    return _BASE_VAR_NAME_RE.match(varname).group(0)
+
+################################################################################
+
+def _parse_parm_key(varname):
+    """ Split a parm_dict key into (variable name, index, component, sub-index), e.g.
+            autotrophs(2)%kFe -> ('autotrophs', (2,), 'kFe', None)
+            grazing(1,2)%auto_ind(3) -> ('grazing', (1,2), 'auto_ind', 3)
+            parm_scalelen_z(4) -> ('parm_scalelen_z', (4,), None, None)
+        Missing pieces are None; returns None if varname is not of this form
+    """
+    parsed_key = _PARM_KEY_RE.match(varname.strip())
+    if parsed_key is None:
+        return None
+    var_name, index, component, sub_index = parsed_key.groups()
+    if index is not None:
+        index = tuple([int(ind) for ind in index.split(',')])
+    if sub_index is not None:
+        sub_index = int(sub_index)
+    return var_name, index, component, sub_index
+
+################################################################################
+
+def _can_store_as_array(var_dict):
+    """ array_storage is only used for arrays (or arrays of derived types) whose
+        components are scalars or 1D arrays and do not add config keywords
+    """
+    if "_array_size" not in var_dict.keys():
+        return False
+    if not isinstance(var_dict["datatype"], dict):
+        return "_append_to_config_keywords" not in var_dict.keys()
+    for key in var_dict["datatype"].keys():
+        if key[0] != '_':
+            this_component = var_dict["datatype"][key]
+            if "_append_to_config_keywords" in this_component.keys():
+                return False
+            if isinstance(this_component.get("_array_size"), list):
+                return False
+    return True
+
+################################################################################
+
+def _compact_int_column(values):
+    """ Store a column of integers as array('l') (unless some entries are not integers)
+    """
+    from array import array
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, int):
+            return values
+    try:
+        return array('l', values)
+    except OverflowError:
+        return values
+
+################################################################################
+
+def _get_override_aliases(varname):
+    """ Input file keys that refer to the same parm_dict entry as varname
+        ("foo = val" is treated as "foo(1) = val" for arrays)
+    """
+    if varname.endswith("(1)"):
+        return [varname, varname[:-3]]
+    return [varname, varname + "(1)"]
+
+################################################################################
+
+def _get_element_overrides(varname, overrides):
+    """ Keys of overrides that set an element of varname ("foo(1)", "foo(2)", ...);
+        empty if varname is itself an element (e.g. "foo(2)")
+    """
+    if _ARRAY_INDEX_RE.search(varname):
+        return []
+    prefix = varname + "("
+    return [key for key in overrides.keys()
+            if key.startswith(prefix) and _ARRAY_INDEX_RE.match(key, len(varname))]
+
+################################################################################
+
+def _get_parm_dict_sources(override_sources, parm_dict):
+    """ Map parm_dict keys to the "file:line" of the override that set them
+        (override_sources is keyed by input file variable, so "foo" applies to "foo(1)")
+    """
+    sources = dict()
+    for varname, source in override_sources.items():
+        for parm_key in _get_override_aliases(varname):
+            if parm_key in parm_dict:
+                sources[parm_key] = source
+                break
+    return sources
+
+################################################################################
+
 def _sort(list_in, sort_key=None):
     """ Sort a list; default is alphabetical (case-insensitive), but that
         can be overridden with the sort_key argument
@@ -434,28 +1589,22 @@ def _natural_sort_key(string_):
 
 def _add_increments(increments, parm_dict):
     """ Some values need to be adjusted depending on values in parm_dict
+        (increments is a tuple of (variable name, value, change) from a _DimSpec)
     """
     change = 0
-    for key_check in increments.keys():
-        checklist = key_check.split(" = ")
-        if parm_dict[checklist[0]] == checklist[1]:
-            change = change + increments[key_check]
+    for var_name, value, increment in increments:
+        if parm_dict[var_name] == value:
+            change = change + increment
     return change
 
 ################################################################################
 
-def _get_dim_size(dim_in, parm_dict, dict_prefix=''):
-    """ If dim_in is an integer, it is the dimension size. Otherwise we need to
-        look up the dim_in key in parm_dict.
+def _get_dim_size(dim_spec, parm_dict, dict_prefix=''):
+    """ If dim_spec.size is an integer, it is the dimension size. Otherwise we need to
+        look up the dim_spec.size key in parm_dict.
     """
 
-    if isinstance(dim_in, dict):
-        dim_start = dim_in['default']
-        check_increment = ('increments' in dim_in.keys())
-    else:
-        dim_start = dim_in
-        check_increment = False
-
+    dim_start = dim_spec.size
     if isinstance(dim_start, int):
         # If dim_start is an integer, use it as dim_out
         dim_out = dim_start
@@ -466,102 +1615,165 @@ def _get_dim_size(dim_in, parm_dict, dict_prefix=''):
             dim_out = parm_dict[dict_prefix+dim_start]
         except:
             dim_out = parm_dict[dim_start]
+        if isinstance(dim_out, bool) or not isinstance(dim_out, int):
+            logger = logging.getLogger(__name__)
+            logger.error("Array size %s = %s is not an integer" % (dim_start, dim_out))
+            _abort(1)
 
-    if check_increment:
-        dim_out = dim_out + _add_increments(dim_in['increments'], parm_dict)
+    if dim_spec.increments:
+        dim_out = dim_out + _add_increments(dim_spec.increments, parm_dict)
 
     return dim_out
 ################################################################################
 
-def _get_array_info(array_size_in, parm_dict, dict_prefix=''):
+def _get_array_shape(shape_spec, parm_dict, dict_prefix=''):
+    """ Return a list of dimension sizes (one entry for 1D arrays, two for 2D arrays)
+        from an _ArrayShapeSpec; sizes that are not integers are looked up in parm_dict
+    """
+
+    logger = logging.getLogger(__name__)
+
+    # Error checking:
+    # This script only support 2D arrays for now
+    if len(shape_spec.dims) > 2:
+        logger.error("_get_array_shape() only supports 1D and 2D arrays")
+        _abort(1)
+    return [_get_dim_size(dim_spec, parm_dict, dict_prefix) for dim_spec in shape_spec.dims]
+
+################################################################################
+
+def _get_component_dim_size(dim_spec, parm_array, elem, parm_dict):
+    """ _get_dim_size() for a component of an element of a _ParmArray: dim_spec may refer
+        to another component of the same element (e.g. grazing%auto_ind_cnt)
+    """
+    try:
+        return parm_array.get_column(dim_spec.size)[elem]
+    except (KeyError, TypeError):
+        return _get_dim_size(dim_spec, parm_dict)
+
+################################################################################
+
+def _get_array_info(shape_spec, parm_dict, dict_prefix=''):
     """ Return a list of the proper formatting for array elements, e.g.
             ['(1)', '(2)'] for 1D array or
             ['(1,1)', '(2,1)'] for 2D array
-        If array_size_in is not an integer, check to see if it is in parm_dict
+        Sizes in shape_spec (an _ArrayShapeSpec) that are not integers are looked up in parm_dict
     """
 
-    logger = logging.getLogger(__name__)
-
     # List to be returned:
     str_index = []
 
     # How many dimensions?
-    if isinstance(array_size_in, list):
-        # Error checking:
-        # This script only support 2D arrays for now
-        # (and assumes array_size_in is not a list for 1D arrays)
-        if len(array_size_in) > 2:
-            logger.error("_get_array_info() only supports 1D and 2D arrays")
-            _abort(1)
-
-        for i in range(0, _get_dim_size(array_size_in[0], parm_dict, dict_prefix)):
-            for j in range(0, _get_dim_size(array_size_in[1], parm_dict, dict_prefix)):
+    # (sizes may be an integer or an entry in self.parm_dict)
+    dims = _get_array_shape(shape_spec, parm_dict, dict_prefix)
+    if len(dims) == 2:
+        for i in range(0, dims[0]):
+            for j in range(0, dims[1]):
                 str_index.append("(%d,%d)" % (i+1,j+1))
         return str_index
 
-    # How many elements? May be an integer or an entry in self.parm_dict
-    for i in range(0, _get_dim_size(array_size_in, parm_dict, dict_prefix)):
+    for i in range(0, dims[0]):
         str_index.append("(%d)" % (i+1))
     return str_index
 
 ################################################################################
 
-def _string_to_substring(str_in, separator):
-    """ Basically the python native split() function, but ignore separator that
-        is inside quotes. So (using separator = ',')
-            'abc, def, gh' -> ['abc', 'def', 'gh']
-        but
-            'abc,"def, gh"' -> ['abc', '"def, gh"']
-            "abc,'def, gh'" -> ['abc', '"def, gh"']
-
-        Note: unexpected results if str_in is missing a closing ' or "
+# Input file tokens: quoted strings, the separators ! (comment), = and , and runs of
+# everything else; a quote that does not match any of those is missing its partner
+_INPUT_TOKEN_RE = re.compile(r'"[^"]*"|\'[^\']*\'|[!=,]|[^"\'!=,]+|["\']')
+
+# Ensemble members in a single input file are separated by "!! member [name]" lines
+_MEMBER_MARKER_RE = re.compile(r'^\s*!!\s*member\b\s*(.*?)\s*$', re.IGNORECASE)
+
+def _tokenize_input_line(line):
+    """ Split a line of an input file into (variable name, list of values), ignoring
+        Fortran comments; return None for lines that are blank or only comments.
+        "!" and "," inside quotes are not treated as separators, so
+            foo = 'abc, def' ! comment -> ('foo', ["'abc, def'"])
+            foo = 10, 20               -> ('foo', ['10', '20'])
+        Raises ValueError (with a description of the problem) for lines that can
+        not be parsed.
     """
 
-    import re
-    re_separator = separator+"(?=(?:[^\"\']|[\"|\'][^\"\']*[\"|\'])*$)"
-    return re.split(re_separator, str_in)
+    if '"' not in line and "'" not in line:
+        # Fast path: no quotes, so separators can be found with str methods
+        line = line.split('!', 1)[0]
+        if not line.strip():
+            return None
+        if '=' not in line:
+            raise ValueError("expecting 'variable = value'")
+        var_name, value = line.split('=', 1)
+        values = value.split(',')
+    else:
+        var_name = None
+        values = ['']
+        for token in _INPUT_TOKEN_RE.findall(line):
+            if token == '!':
+                break
+            if token in ['"', "'"]:
+                raise ValueError("missing closing %s" % token)
+            if var_name is None:
+                if token == '=':
+                    var_name = values[0]
+                    values = ['']
+                elif token[0] in ['"', "'"]:
+                    raise ValueError("variable name can not contain quotes")
+                else:
+                    values[0] = values[0] + token
+            elif token == ',':
+                values.append('')
+            else:
+                values[-1] = values[-1] + token
+        if var_name is None:
+            if not values[0].strip():
+                return None
+            raise ValueError("expecting 'variable = value'")
+
+    var_name = var_name.strip()
+    if not var_name:
+        raise ValueError("missing variable name")
+    values = [value.strip() for value in values]
+    if '' in values:
+        raise ValueError("missing value for %s" % var_name)
+    return var_name, values
+
+################################################################################
+
+def _add_to_input_dict(input_dict, var_name, values):
+    """ Add "var_name = values" to input_dict; multiple values are treated as arrays,
+        so "var_name = 10, 20" -> input_dict['var_name(1)'] = '10' and
+        input_dict['var_name(2)'] = '20'. Returns list of keys added.
+    """
+    if len(values) > 1:
+        # Treat comma-delimited value as an array
+        keys = []
+        for n, value in enumerate(values):
+            key = "%s(%d)" % (var_name, n+1)
+            input_dict[key] = value
+            keys.append(key)
+        return keys
+
+    # Single value
+    input_dict[var_name] = values[0]
+    return [var_name]
 
 ################################################################################
 
 def _parse_input_file(input_file):
-    """ 1. Read an input file; ignore blank lines and non-quoted Fortran comments.
-        2. Turn lines of the form
-              variable = value
-           Into input_dict['variable'] = value
-        3. Return input_dict
+    """ Read an input file that contains a single set of values (see
+        iter_input_file_members()); return (input_dict, input_sources)
     """
-    input_dict = dict()
-    logger = logging.getLogger(__name__)
 
-    try:
-        f = open(input_file, "r")
-        for line in f:
-            # Ignore comments in input file!
-            line_loc = _string_to_substring(line, '!')[0]
+    logger = logging.getLogger(__name__)
 
-            # ignore empty lines
-            if len(line_loc.lstrip()) == 0:
-                continue
+    if input_file is None:
+        return dict(), dict()
 
-            line_list = line_loc.strip().split('=')
-            var_name = line_list[0].strip()
-            value = line_list[1].strip()
-            val_array = _string_to_substring(value, ',')
-            if len(val_array) > 1:
-                # Treat comma-delimited value as an array
-                for n, value in enumerate(val_array):
-                    suffix = "(%d)" % (n+1)
-                    input_dict[var_name+suffix] = value.strip()
-            else:
-                # Single value
-                input_dict[var_name] = value
-        f.close()
-    except TypeError:
-        # If inputfile == None then the open will result in TypeError
-        pass
-    except:
-        logger.error("input_file '%s' was not found" % input_file)
+    members = list(iter_input_file_members(input_file))
+    if len(members) > 1:
+        logger.error("input_file '%s' contains %d ensemble members; use MARBL_ensemble_class" %
+                     (input_file, len(members)))
         _abort(1)
-    return input_dict
+    return members[0][1], members[0][2]
 
 ################################################################################
@@ -0,0 +1,266 @@
+import logging
+
+class MARBL_ensemble_class(object):
+    """ This class resolves MARBL parameter values for many input files (ensemble
+        members) that all share a single YAML file. The YAML file is read and
+        validated once, and each member's parm_dict is computed in a process pool.
+        An input file may also hold several members separated by "!! member [name]"
+        lines (see iter_input_file_members() in MARBL_defaults.py); those members
+        are named "<input file>:<name>".
+
+        This file also contains several subroutines that are not part of the class but are
+        called by member functions in the class.
+    """
+
+    ###############
+    # CONSTRUCTOR #
+    ###############
+
+    def __init__(self, yaml_file, grid, input_files, nprocs=None, parms=None):
+        """ Class constructor: expand input_files (a directory, a glob pattern, or a
+            list of file names) into a list of files, read the YAML file, and then
+            resolve every member as it is read from the input files.
+
+            nprocs is the size of the process pool (default: one process per CPU);
+            nprocs = 1 resolves the members serially in this process.
+            If parms is provided, it must be a dictionary returned by read_parms_file()
+            and yaml_file is ignored.
+        """
+
+        from MARBL_defaults import read_parms_file
+        from collections import OrderedDict
+
+        logger = logging.getLogger(__name__)
+
+        # 1. List of input files
+        self._input_files = get_ensemble_input_files(input_files)
+
+        # 2. Read YAML file (once!)
+        if parms is None:
+            self._parms = read_parms_file(yaml_file)
+        else:
+            self._parms = parms
+
+        # 3. Resolve every member
+        self._members = []
+        self._parm_dicts = OrderedDict()
+        self._varnames = OrderedDict()
+        self._tracer_cnt = OrderedDict()
+        self._sources = OrderedDict()
+        failed_members = []
+        for member, result in _resolve_members(self._parms, grid, _iter_members(self._input_files),
+                                               nprocs):
+            self._members.append(member)
+            if result is None:
+                failed_members.append(member)
+                continue
+            (self._parm_dicts[member], self._varnames[member], self._tracer_cnt[member],
+             self._sources[member]) = result
+
+        # 4. Abort if any member could not be resolved
+        #    (the reason has already been logged by the process that resolved it)
+        if failed_members:
+            message = "Could not resolve %d ensemble member(s):" % len(failed_members)
+            for member in failed_members:
+                message = message + "\n     * %s" % member
+            logger.error(message)
+            _abort(1)
+
+    ################################################################################
+    #                             PUBLIC CLASS METHODS                             #
+    ################################################################################
+
+    def get_member_names(self):
+        """ Returns the list of members in the ensemble: input files in natural order,
+            with members from the same file in the order they appear in that file
+        """
+
+        return self._members
+
+    ################################################################################
+
+    def get_subcategory_names(self):
+        """ Returns a sorted list of subcategories; these do not depend on the
+            input file so they are the same for every member.
+        """
+
+        return list(self._varnames[self._members[0]].keys())
+
+    ################################################################################
+
+    def get_parm_dict(self, member):
+        """ Returns parm_dict for a specific member
+        """
+
+        return self._parm_dicts[member]
+
+    ################################################################################
+
+    def get_parm_dict_variable_names(self, member, subcategory):
+        """ Returns the sorted list of parm_dict keys for a specific member that are
+            in the provided subcategory (arrays and derived types are expanded, so
+            these depend on the member)
+        """
+
+        return self._varnames[member][subcategory]
+
+    ################################################################################
+
+    def get_tracer_cnt(self, member):
+        """ Return the number of tracers MARBL is running with for a specific member
+        """
+
+        return self._tracer_cnt[member]
+
+    ################################################################################
+
+    def validate(self, validator=None):
+        """ Check every member's parm_dict against the datatype, valid_values,
+            valid_range and constraints in the YAML file, one parm_dict key at a time
+            across all members; returns a list of every violation (see
+            MARBL_validator_class.validate_ensemble())
+        """
+
+        if validator is None:
+            from MARBL_validator import MARBL_validator_class
+            validator = MARBL_validator_class(self._parms)
+        return validator.validate_ensemble(self._parm_dicts, self._sources)
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def get_ensemble_input_files(input_files):
+    """ Return a naturally-sorted list of input files
+        * If input_files is a list, it is used as-is
+        * If input_files is a directory, every file in that directory is a member
+        * Otherwise input_files is treated as a glob pattern
+    """
+
+    import os
+    import glob
+    from MARBL_defaults import _sort, _natural_sort_key
+
+    logger = logging.getLogger(__name__)
+
+    if isinstance(input_files, list):
+        file_list = input_files
+    elif os.path.isdir(input_files):
+        file_list = [os.path.join(input_files, file_name) for file_name in os.listdir(input_files)]
+        file_list = [file_name for file_name in file_list if os.path.isfile(file_name)]
+    else:
+        file_list = glob.glob(input_files)
+
+    if not file_list:
+        logger.error("No ensemble input files found in '%s'" % input_files)
+        _abort(1)
+
+    return _sort(file_list, sort_key=_natural_sort_key)
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+def _abort(err_code=0):
+    """ This routine imports sys and calls exit
+    """
+    import sys
+    sys.exit(err_code)
+
+################################################################################
+
+# Worker processes keep the compiled schema and grid here; they are set once per
+# process by _init_ensemble_worker() rather than being sent with every member
+# (every member resolved by a worker shares the one read-only schema)
+_worker_schema = None
+_worker_grid = None
+
+def _init_ensemble_worker(parms, grid):
+    """ Pool initializer: compile the YAML dictionary and store it and the grid in the
+        worker process
+    """
+    from MARBL_schema import MARBL_schema_class
+    global _worker_schema, _worker_grid
+    _worker_schema = MARBL_schema_class(parms)
+    _worker_grid = grid
+
+################################################################################
+
+def _iter_members(input_files):
+    """ Generator that reads the input files one at a time and yields
+        (member name, input_dict, input_sources) for every member in them as soon as
+        it has been read; a member (or file) that can not be parsed yields
+        (member name, None, None) instead, since aborting inside the pool's task
+        feeder would hang the pool (the errors have already been logged)
+    """
+    from MARBL_defaults import iter_input_file_members
+
+    for input_file in input_files:
+        for member_name, input_dict, input_sources in iter_input_file_members(input_file, yield_errors=True):
+            if member_name is not None:
+                member_name = "%s:%s" % (input_file, member_name)
+            else:
+                member_name = input_file
+            yield member_name, input_dict, input_sources
+
+################################################################################
+
+def _resolve_member(member_info):
+    """ Resolve a single member from (member name, input_dict, input_sources),
+        returning (member name, result) where result is
+        (parm_dict, {subcategory : parm_dict keys}, tracer count,
+        {parm_dict key : input file line}) or None if
+        MARBL_defaults_class aborted (it logs the reason before aborting).
+    """
+    from MARBL_defaults import MARBL_defaults_class
+
+    member_name, input_dict, input_sources = member_info
+    if input_dict is None:
+        return member_name, None
+    try:
+        member = MARBL_defaults_class(None, _worker_grid, input_dict, parms=_worker_schema,
+                                      input_sources=input_sources)
+    except SystemExit:
+        return member_name, None
+
+    return member_name, (member.parm_dict, member.get_subcategory_index(), member.get_tracer_cnt(),
+                         member.get_parm_dict_sources())
+
+################################################################################
+
+# Members are read while earlier members are being resolved, so the total number
+# of members is not known up front; they are sent to workers in fixed-size chunks
+_MEMBER_CHUNKSIZE = 4
+
+def _resolve_members(parms, grid, members, nprocs):
+    """ Generator that yields (member name, result) from _resolve_member() for each
+        (member name, input_dict, input_sources) in members, in order. Uses a
+        multiprocessing pool unless nprocs is 1.
+    """
+    import itertools
+    import multiprocessing
+
+    if nprocs is None:
+        nprocs = multiprocessing.cpu_count()
+
+    # Never start more workers than there are members: read up to nprocs members
+    # first (the rest are still read while these are being resolved)
+    first_members = list(itertools.islice(members, max(nprocs, 1)))
+    nprocs = max(1, min(nprocs, len(first_members)))
+    members = itertools.chain(first_members, members)
+
+    if nprocs <= 1:
+        _init_ensemble_worker(parms, grid)
+        for member_info in members:
+            yield _resolve_member(member_info)
+        return
+
+    pool = multiprocessing.Pool(nprocs, initializer=_init_ensemble_worker, initargs=(parms, grid))
+    try:
+        for result in pool.imap(_resolve_member, members, _MEMBER_CHUNKSIZE):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+################################################################################
@@ -0,0 +1,265 @@
+import logging
+
+class MARBL_ensemble_diff_class(object):
+    """ This class compares every member of an ensemble with a baseline configuration.
+
+        Members and the baseline are aligned on one list of parm_dict keys (grouped by
+        subcategory and naturally sorted, the order print_defaults.py uses), and the
+        comparison is done one key (column) at a time: each distinct value in a column
+        is compared with the baseline (numbers as floats, within a relative tolerance)
+        and converted to a number once, no matter how many members share it. A key
+        that only exists in the baseline or only in a member (e.g. autotrophs(4)%... )
+        counts as a change.
+
+        Members can also have baselines of their own (e.g. the defaults for the grid of
+        each configuration in a matrix, so differences between grids are not reported
+        as changes); each member is then compared with its own baseline.
+
+        This file also contains several subroutines that are not part of the class but are
+        called by member functions in the class.
+    """
+
+    ###############
+    # CONSTRUCTOR #
+    ###############
+
+    def __init__(self, Members, Baseline):
+        """ Class constructor: Members is any object with the MARBL_ensemble_class
+            interface (an ensemble, a configuration matrix, or a settings file) and
+            Baseline is a MARBL_defaults_class object, or a dictionary of member ->
+            MARBL_defaults_class object to compare each member with its own baseline
+            (members may share baseline objects)
+        """
+
+        from MARBL_defaults import _sort, _natural_sort_key
+
+        logger = logging.getLogger(__name__)
+
+        self._members = Members.get_member_names()
+        self._member_index = dict([(member, m) for m, member in enumerate(self._members)])
+        parm_dicts = [Members.get_parm_dict(member) for member in self._members]
+
+        # Distinct baselines, and the index of each member's baseline in that list
+        if isinstance(Baseline, dict):
+            baselines = []
+            baseline_index = dict()
+            self._member_baselines = []
+            for member in self._members:
+                MemberBaseline = Baseline[member]
+                if id(MemberBaseline) not in baseline_index:
+                    baseline_index[id(MemberBaseline)] = len(baselines)
+                    baselines.append(MemberBaseline)
+                self._member_baselines.append(baseline_index[id(MemberBaseline)])
+        else:
+            baselines = [Baseline]
+            self._member_baselines = [0] * len(self._members)
+        self._subcat_names = baselines[0].get_subcategory_names()
+
+        # 1. Keys from the baselines and every member, in print_defaults.py order
+        self._keys = []
+        self._subcat_keys = dict()
+        for subcat_name in self._subcat_names:
+            subcat_keys = set()
+            for MemberBaseline in baselines:
+                subcat_keys.update(MemberBaseline.get_parm_dict_variable_names(subcat_name))
+            for member in self._members:
+                subcat_keys.update(Members.get_parm_dict_variable_names(member, subcat_name))
+            self._subcat_keys[subcat_name] = _sort(subcat_keys, sort_key=_natural_sort_key)
+            self._keys.extend(self._subcat_keys[subcat_name])
+
+        # 2. Compare one column at a time
+        self._baseline = dict()
+        self._changed_members = dict()
+        self._spread = dict()
+        self._member_changes = [[] for member in self._members]
+        for key in self._keys:
+            baseline_values = [MemberBaseline.parm_dict[key] if key in MemberBaseline.parm_dict else None
+                               for MemberBaseline in baselines]
+            baseline_numbers = [_to_number(baseline_value) for baseline_value in baseline_values]
+            self._baseline[key] = baseline_values
+
+            # Group members by value (and baseline), then compare each distinct pair once
+            column = dict()
+            for m, parm_dict in enumerate(parm_dicts):
+                value = parm_dict[key] if key in parm_dict else None
+                column.setdefault((value, self._member_baselines[m]), []).append(m)
+            changed = []
+            for (value, b), members in column.items():
+                if not _same_value(value, baseline_values[b], baseline_numbers[b]):
+                    changed.extend(members)
+            if not changed:
+                continue
+            changed.sort()
+            self._changed_members[key] = changed
+            for m in changed:
+                self._member_changes[m].append(key)
+            self._spread[key] = _get_spread(column, baseline_numbers)
+
+        logger.debug("Compared %d members with the baseline: %d of %d keys differ in at least one member" %
+                     (len(self._members), len(self._changed_members), len(self._keys)))
+
+    ################################################################################
+    #                             PUBLIC CLASS METHODS                             #
+    ################################################################################
+
+    def get_member_names(self):
+        """ Returns the list of members, in the order of Members.get_member_names()
+        """
+
+        return self._members
+
+    ################################################################################
+
+    def get_subcategory_names(self):
+        """ Returns the baseline's sorted list of subcategories
+        """
+
+        return self._subcat_names
+
+    ################################################################################
+
+    def get_baseline_value(self, varname, member=None):
+        """ Returns the baseline value of a parm_dict key for member (default: the first
+            member); None if the baseline does not have that key
+        """
+
+        b = 0 if member is None else self._member_baselines[self._member_index[member]]
+        return self._baseline[varname][b]
+
+    ################################################################################
+
+    def get_baseline_values(self, varname):
+        """ Returns the distinct baseline values of a parm_dict key, in the order of the
+            members they belong to (a single value unless members have their own
+            baselines)
+        """
+
+        values = []
+        for value in self._baseline[varname]:
+            if value not in values:
+                values.append(value)
+        return values
+
+    ################################################################################
+
+    def get_changed_variable_names(self, member):
+        """ Returns the parm_dict keys whose value for member differs from the baseline,
+            in print_defaults.py order
+        """
+
+        return self._member_changes[self._member_index[member]]
+
+    ################################################################################
+
+    def get_changed_member_names(self, varname):
+        """ Returns the members whose value of varname differs from the baseline
+        """
+
+        return [self._members[m] for m in self._changed_members.get(varname, [])]
+
+    ################################################################################
+
+    def get_differing_variable_names(self, subcategory):
+        """ Returns the sorted list of keys in the provided subcategory that differ from
+            the baseline in at least one member
+        """
+
+        return [key for key in self._subcat_keys[subcategory] if key in self._changed_members]
+
+    ################################################################################
+
+    def get_spread(self, varname):
+        """ Returns a dictionary describing the values of varname across all members
+            (None if no member differs from the baseline):
+                changed      : number of members that differ from the baseline
+                distinct     : number of distinct values (a missing key counts as a value)
+                min, max,
+                mean, std    : statistics of the members' numeric values
+                max_abs_diff : largest |value - baseline value|
+            The statistics are None if varname is not numeric (or, for max_abs_diff, if
+            the baseline does not have varname); members without varname are left out.
+        """
+
+        if varname not in self._spread:
+            return None
+        spread = dict(self._spread[varname])
+        spread["changed"] = len(self._changed_members[varname])
+        return spread
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+# Relative tolerance for numeric values; parm_dict reals have 16 significant digits, and
+# the summary statistics (get_spread) are computed from the same float values
+_RTOL = 1e-15
+
+################################################################################
+
+def _to_number(value):
+    """ Return value (an integer or a real formatted as in parm_dict) as a float, or
+        None if it is not a number
+    """
+
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+################################################################################
+
+def _same_value(value, baseline_value, baseline_number):
+    """ True if value matches the baseline: numbers are compared as floats (within
+        _RTOL, so 100.0e2 and 1.000000000000000e+04 are the same) and anything else
+        as strings; baseline_number is _to_number(baseline_value)
+    """
+
+    if value is None or baseline_value is None:
+        return value is baseline_value
+    number = _to_number(value)
+    if number is None or baseline_number is None:
+        return value == baseline_value
+    return abs(number - baseline_number) <= _RTOL * max(abs(number), abs(baseline_number))
+
+################################################################################
+
+def _get_spread(column, baseline_numbers):
+    """ Statistics for one parm_dict key; column is {(value, baseline) : [members with
+        that value and baseline]} and baseline_numbers is the value of each baseline
+        from _to_number() (see get_spread() for the keys of the returned dictionary)
+    """
+
+    import math
+
+    spread = dict([(stat, None) for stat in ["min", "max", "mean", "std", "max_abs_diff"]])
+    spread["distinct"] = len(set([value for (value, b) in column.keys()]))
+
+    # Each distinct value is converted to a number once, and counts as often as it appears
+    numbers = []
+    abs_diffs = []
+    value_numbers = dict()
+    for (value, b), members in column.items():
+        if value is None:
+            continue
+        if value not in value_numbers:
+            value_numbers[value] = _to_number(value)
+        number = value_numbers[value]
+        if number is None:
+            return spread
+        numbers.append((number, len(members)))
+        if baseline_numbers[b] is not None:
+            abs_diffs.append(abs(number - baseline_numbers[b]))
+    if not numbers:
+        return spread
+
+    count = sum([member_cnt for number, member_cnt in numbers])
+    mean = math.fsum([number * member_cnt for number, member_cnt in numbers]) / count
+    spread["min"] = min([number for number, member_cnt in numbers])
+    spread["max"] = max([number for number, member_cnt in numbers])
+    spread["mean"] = mean
+    spread["std"] = math.sqrt(math.fsum([member_cnt * (number - mean)**2 for number, member_cnt in numbers]) / count)
+    if abs_diffs:
+        spread["max_abs_diff"] = max(abs_diffs)
+    return spread
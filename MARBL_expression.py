@@ -0,0 +1,209 @@
+""" Restricted evaluator for the arithmetic expressions that real-valued parameters may
+    contain (e.g. "1.0/117" in the YAML file or "c1 / spd" in an input file).
+
+    Only numeric literals, + - * / **, parentheses and the named constants in
+    _NAMED_CONSTANTS are accepted; anything else (function calls, attributes,
+    subscripts, other names) is rejected before the expression is compiled, so user
+    input is never passed to eval() unchecked. Compiled expressions are kept in a
+    least-recently-used cache, so each distinct expression is only parsed once per
+    process.
+"""
+
+import logging
+import re
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def evaluate_real_expression(expr, varname=None):
+    """ Return the value of expr (a string) as a float; aborts if expr is not a valid
+        expression (varname, if provided, is included in the error message)
+    """
+
+    try:
+        return _get_compiled_expression(expr, ())[1]
+    except SystemExit:
+        if varname is not None:
+            logger = logging.getLogger(__name__)
+            logger.error("Invalid value for %s" % varname)
+        raise
+
+################################################################################
+
+def evaluate_real_expression_array(expr, values, var_name="x"):
+    """ Evaluate expr once for every entry in values, with var_name standing for that
+        entry (e.g. expr = "x * 1.0e-6" or "c1 / (x * spd)"); returns an array('d').
+        The expression is parsed and checked once, not once per value.
+    """
+
+    from array import array
+
+    code, constant_value = _get_compiled_expression(expr, (var_name,))
+    if constant_value is not None:
+        return array('d', [constant_value]*len(values))
+
+    env = dict(_NAMED_CONSTANTS)
+    result = array('d')
+    try:
+        for value in values:
+            env[var_name] = float(value)
+            result.append(_real_result(eval(code, _EVAL_GLOBALS, env)))
+    except (ArithmeticError, TypeError, ValueError) as err:
+        _expression_error(expr, "%s (%s = %s)" % (err, var_name, value))
+    return result
+
+################################################################################
+
+def clear_expression_cache():
+    """ Empty the cache of compiled expressions
+    """
+
+    if _expression_cache is not None:
+        _expression_cache.clear()
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+def _abort(err_code=0):
+    """ This routine imports sys and calls exit
+    """
+    import sys
+    sys.exit(err_code)
+
+################################################################################
+
+# Named constants that may appear in expressions; these are the values of the
+# parameters with the same names in marbl_constants_mod
+_NAMED_CONSTANTS = {
+    "c0" : 0.0,
+    "c1" : 1.0,
+    "c2" : 2.0,
+    "c3" : 3.0,
+    "c4" : 4.0,
+    "c5" : 5.0,
+    "c10" : 10.0,
+    "c1000" : 1000.0,
+    "p001" : 0.001,
+    "p5" : 0.5,
+    "pi" : 3.14159265358979323846,
+    "spd" : 86400.0,
+    "dps" : 1.0/86400.0,
+    "yps" : 1.0/(365.0*86400.0),
+    "mpercm" : 0.01,
+    "cmperm" : 100.0,
+    "T0_Kelvin" : 273.15,
+}
+
+# Expressions are evaluated without access to any builtins
+_EVAL_GLOBALS = {"__builtins__" : {}}
+
+# Maximum number of compiled expressions to keep (least recently used are dropped)
+_EXPRESSION_CACHE_SIZE = 1024
+_expression_cache = None
+
+# Fortran spellings of real literals: 1.0d-3 and 1.0_r8
+_FORTRAN_EXPONENT_RE = re.compile(r'\b(\d+\.?\d*|\.\d+)[dD]([+-]?\d+)\b')
+_FORTRAN_KIND_RE = re.compile(r'\b(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)_r8\b')
+
+################################################################################
+
+def _get_compiled_expression(expr, var_names):
+    """ Return (code object, value) for expr, where value is the float value of expr
+        if it does not refer to any of var_names (otherwise None); parsing is skipped
+        if expr is in the cache
+    """
+
+    from collections import OrderedDict
+
+    global _expression_cache
+    if _expression_cache is None:
+        _expression_cache = OrderedDict()
+
+    cache_key = (expr, var_names)
+    try:
+        # Move to the end of the cache (most recently used)
+        compiled_expr = _expression_cache.pop(cache_key)
+    except KeyError:
+        compiled_expr = _compile_expression(expr, var_names)
+        if len(_expression_cache) >= _EXPRESSION_CACHE_SIZE:
+            _expression_cache.popitem(last=False)
+    _expression_cache[cache_key] = compiled_expr
+    return compiled_expr
+
+################################################################################
+
+def _compile_expression(expr, var_names):
+    """ Parse expr, check that it only contains allowed operations, and compile it;
+        returns (code object, value) as described in _get_compiled_expression()
+    """
+
+    import ast
+
+    fortran_expr = _FORTRAN_KIND_RE.sub(r'\1', _FORTRAN_EXPONENT_RE.sub(r'\1e\2', expr.strip()))
+    try:
+        tree = ast.parse(fortran_expr, mode='eval')
+    except SyntaxError:
+        _expression_error(expr, "is not a valid expression")
+
+    uses_var = False
+    for node in ast.walk(tree):
+        if isinstance(node, _NUMBER_NODES):
+            # bool is a subclass of int, but True / False are not numbers here
+            value_attr = "value" if hasattr(node, "value") else "n"
+            value = getattr(node, value_attr)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                _expression_error(expr, "contains %s" % repr(value))
+            # Evaluate in floating point so huge integer powers can not hang the evaluator
+            setattr(node, value_attr, float(value))
+        elif isinstance(node, ast.Name):
+            if node.id in var_names:
+                uses_var = True
+            elif node.id not in _NAMED_CONSTANTS:
+                _expression_error(expr, "refers to unknown constant '%s'" % node.id)
+        elif not isinstance(node, _ALLOWED_NODES):
+            _expression_error(expr, "contains unsupported operation '%s'" % type(node).__name__)
+
+    code = compile(tree, "<expression>", "eval")
+    if uses_var:
+        return code, None
+    try:
+        return code, _real_result(eval(code, _EVAL_GLOBALS, _NAMED_CONSTANTS))
+    except (ArithmeticError, TypeError, ValueError) as err:
+        _expression_error(expr, str(err))
+
+################################################################################
+
+def _real_result(value):
+    """ value as a float; raises ValueError if it is not real (e.g. a negative number
+        raised to a fractional power is complex)
+    """
+
+    if isinstance(value, complex):
+        raise ValueError("result is not a real number")
+    return float(value)
+
+################################################################################
+
+def _expression_error(expr, message):
+    """ Log an error about expr and abort
+    """
+
+    logger = logging.getLogger(__name__)
+    logger.error("Can not evaluate '%s': %s" % (expr, message))
+    _abort(1)
+
+################################################################################
+
+def _get_node_types(*names):
+    """ Return a tuple of the ast node classes in names that exist in this version of
+        python
+    """
+
+    import ast
+    return tuple(getattr(ast, name) for name in names if hasattr(ast, name))
+
+_NUMBER_NODES = _get_node_types("Constant", "Num")
+_ALLOWED_NODES = _get_node_types("Expression", "BinOp", "UnaryOp", "Name", "Load",
+                                 "Add", "Sub", "Mult", "Div", "Pow", "UAdd", "USub")
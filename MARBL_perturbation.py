@@ -0,0 +1,654 @@
+import logging
+import re
+
+class MARBL_perturbation_class(object):
+    """ This class builds an ensemble by sampling parameters: a spec lists the parm_dict
+        keys to perturb (e.g. autotrophs(2)%PCref_per_day or parm_scalelen_z(2)) and,
+        for each one, a range "min : max" (integers and reals) or a list of values to
+        choose from (any datatype). Samples for every member and every key are drawn in
+        one step from a sampling design:
+            * uniform : independent uniform samples
+            * lhs     : Latin hypercube (each key's range is split into member_cnt strata
+                        and every stratum is sampled exactly once)
+            * halton  : Halton low-discrepancy sequence (with a random shift)
+
+        The spec is checked against the schema before anything is sampled: every key must
+        exist in the baseline configuration (the grid plus the values in input_file), and
+        both ends of every range and every listed value must pass MARBL_validator_class.
+        The "cannot change" and "must set" conditions in the YAML (e.g. PFT_defaults ==
+        'CESM2') are also enforced: a key MARBL would not let the user change can not be
+        perturbed (or set in input_file), and a key that must be set has to be in
+        input_file or the spec. Each member is then resolved and validated as it is generated (see
+        iter_members()), so a member that MARBL would reject is never written.
+
+        This file also contains several subroutines that are not part of the class but are
+        called by member functions in the class.
+    """
+
+    ###############
+    # CONSTRUCTOR #
+    ###############
+
+    def __init__(self, yaml_file, grid, spec, member_cnt, design="lhs", seed=None, input_file=None,
+                 parms=None, spec_sources=None, validate=True):
+        """ Class constructor: spec is an (ordered) dictionary of parm_dict key -> list of
+            values formatted as they would be in an input file; a single value
+            "min : max" is a range (integers and reals only), anything else is a list of
+            values to choose from. spec_sources (optional) maps each key to the
+            "file:line" it came from (see read_perturbation_spec()). Values in input_file
+            are applied to every member (spec keys take precedence over them).
+
+            If parms is provided, it must be a dictionary returned by read_parms_file()
+            (or a MARBL_schema_class object) and yaml_file is ignored.
+        """
+
+        from collections import OrderedDict
+        from MARBL_defaults import MARBL_defaults_class, read_parms_file, _parse_input_file, _get_override_aliases
+        from MARBL_defaults import _sort, _natural_sort_key
+        from MARBL_schema import get_schema
+        from MARBL_validator import MARBL_validator_class
+
+        logger = logging.getLogger(__name__)
+
+        if design not in _DESIGNS:
+            logger.error("Unknown sampling design '%s' (valid designs: %s)" % (design, ", ".join(_DESIGN_NAMES)))
+            _abort(1)
+        if member_cnt < 1:
+            logger.error("Number of members must be positive, not %d" % member_cnt)
+            _abort(1)
+        if not spec:
+            logger.error("No parameters to perturb")
+            _abort(1)
+
+        if parms is None:
+            parms = read_parms_file(yaml_file)
+        self._schema = get_schema(parms)
+        self._grid = grid
+        self._validator = MARBL_validator_class(self._schema.parms) if validate else None
+        self._value_cache = dict()
+        if spec_sources is None:
+            spec_sources = dict()
+
+        # 1. Baseline: the spec must only refer to keys that exist in it
+        self._base_overrides, self._base_sources = _parse_input_file(input_file)
+        Baseline = MARBL_defaults_class(None, grid, self._base_overrides, parms=self._schema,
+                                        input_sources=self._base_sources, value_cache=self._value_cache)
+
+        # 2. Compile the spec, reporting every problem before aborting
+        self._samplers = OrderedDict()
+        self._spec_sources = dict()
+        spec_keys = OrderedDict()
+        error_cnt = 0
+        violations = []
+        for varname, values in spec.items():
+            source = spec_sources.get(varname)
+            parm_key = None
+            for alias in _get_override_aliases(varname):
+                if alias in Baseline.parm_dict:
+                    parm_key = alias
+                    break
+            if parm_key is None:
+                logger.error("%s is not a parameter in the baseline configuration%s" %
+                             (varname, _source_suffix(source)))
+                error_cnt = error_cnt + 1
+                continue
+            try:
+                sampler = _Sampler(varname, _get_datatype(self._schema, parm_key), values)
+            except ValueError as err:
+                logger.error("%s: %s%s" % (varname, err, _source_suffix(source)))
+                error_cnt = error_cnt + 1
+                continue
+            if self._validator is not None:
+                for value in sampler.get_bounding_values():
+                    violations.extend(self._validator.validate_parm_dict({parm_key : value}, {parm_key : source}))
+            self._samplers[varname] = sampler
+            self._spec_sources[varname] = source
+            spec_keys[varname] = parm_key
+        error_cnt = error_cnt + _check_conditions(self._schema, Baseline.parm_dict, self._samplers, spec_keys,
+                                                  self._spec_sources, self._base_overrides, self._base_sources)
+        if self._validator is not None and self._validator.log_violations(violations):
+            error_cnt = error_cnt + 1
+        if error_cnt > 0:
+            logger.error("Invalid perturbation spec")
+            _abort(1)
+
+        # 3. Draw every sample at once: one column of member_cnt values per key
+        import random
+        rng = random.Random(seed)
+        unit_samples = _DESIGNS[design](member_cnt, len(self._samplers), rng)
+        self._samples = OrderedDict()
+        for sampler, unit_column in zip(self._samplers.values(), unit_samples):
+            self._samples[sampler.varname] = sampler.sample(unit_column)
+
+        # 4. Members are named member_<n>, padded so they sort in order
+        width = len(str(member_cnt))
+        self._members = ["member_%0*d" % (width, m+1) for m in range(member_cnt)]
+        self._design = design
+        self._seed = seed
+
+        # Values from input_file that are not perturbed (spec keys replace their aliases)
+        replaced = set()
+        for varname in self._samplers.keys():
+            replaced.update(_get_override_aliases(varname))
+        self._fixed_overrides = OrderedDict([(varname, self._base_overrides[varname]) for varname in
+                                             _sort(self._base_overrides.keys(), sort_key=_natural_sort_key)
+                                             if varname not in replaced])
+
+        logger.debug("Sampled %d parameters for %d members (%s design)" %
+                     (len(self._samplers), member_cnt, design))
+
+    ################################################################################
+    #                             PUBLIC CLASS METHODS                             #
+    ################################################################################
+
+    def get_member_names(self):
+        """ Returns the list of members
+        """
+
+        return self._members
+
+    ################################################################################
+
+    def get_perturbed_variable_names(self):
+        """ Returns the keys from the spec, in the order they were provided
+        """
+
+        return list(self._samplers.keys())
+
+    ################################################################################
+
+    def get_samples(self, varname):
+        """ Returns the sampled values of varname (formatted as they would be in an input
+            file), one per member
+        """
+
+        return self._samples[varname]
+
+    ################################################################################
+
+    def get_member_input(self, member):
+        """ Returns the input_dict for a member: the values from input_file followed by
+            the sampled values, in the order they are written to input files
+        """
+
+        from collections import OrderedDict
+
+        m = self._members.index(member) if not isinstance(member, int) else member
+        input_dict = OrderedDict(self._fixed_overrides)
+        for varname, values in self._samples.items():
+            input_dict[varname] = values[m]
+        return input_dict
+
+    ################################################################################
+
+    def iter_members(self):
+        """ Generator that yields (member name, input_dict) for every member, in order.
+            Each member is resolved (and validated, unless validate=False was passed to
+            the constructor) before it is yielded; aborts at the first member MARBL
+            would reject.
+        """
+
+        from MARBL_defaults import MARBL_defaults_class
+
+        logger = logging.getLogger(__name__)
+
+        for m, member in enumerate(self._members):
+            input_dict = self.get_member_input(m)
+            input_sources = dict()
+            for varname, source in self._base_sources.items():
+                if varname in self._fixed_overrides:
+                    input_sources[varname] = source
+            for varname in self._samplers.keys():
+                input_sources[varname] = "%s sample%s" % (member, _source_suffix(self._spec_sources[varname]))
+            try:
+                DefaultParms = MARBL_defaults_class(None, self._grid, input_dict, parms=self._schema,
+                                                    input_sources=input_sources, value_cache=self._value_cache)
+            except SystemExit:
+                logger.error("MARBL rejects %s" % member)
+                raise
+            if self._validator is not None:
+                violations = self._validator.validate_ensemble({member : DefaultParms.parm_dict},
+                                                               {member : DefaultParms.get_parm_dict_sources()})
+                if self._validator.log_violations(violations):
+                    logger.error("MARBL rejects %s" % member)
+                    _abort(1)
+            yield member, input_dict
+
+    ################################################################################
+
+    def write_input_files(self, output_dir):
+        """ Write one input file per member (<output_dir>/<member>.input); returns the
+            list of files written. Each member is written to a temporary file as it is
+            generated, and the files are only renamed once every member has been
+            generated, so a member MARBL rejects leaves no input files behind.
+        """
+
+        import os
+
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        tmp_files = []
+        try:
+            for member, input_dict in self.iter_members():
+                file_name = os.path.join(output_dir, "%s.input" % member)
+                fout, tmp_file = _open_temporary(file_name)
+                tmp_files.append((tmp_file, file_name))
+                with fout:
+                    self._write_header(fout)
+                    _write_input_dict(fout, input_dict)
+        except:
+            for tmp_file, file_name in tmp_files:
+                _remove(tmp_file)
+            raise
+        for tmp_file, file_name in tmp_files:
+            _replace(tmp_file, file_name)
+        return [file_name for tmp_file, file_name in tmp_files]
+
+    ################################################################################
+
+    def write_input_file(self, fout):
+        """ Write every member to fout (an open file) as a single input file, each
+            member starting with a "!! member <name>" line (see iter_input_file_members())
+        """
+
+        self._write_header(fout)
+        for member, input_dict in self.iter_members():
+            fout.write("!! member %s\n" % member)
+            _write_input_dict(fout, input_dict)
+
+    ################################################################################
+
+    def save_input_file(self, file_name):
+        """ Write every member to file_name as a single input file (see
+            write_input_file()); the members are written to a temporary file in the same
+            directory that replaces file_name once every member has been generated, so
+            a member MARBL rejects never leaves a truncated file behind
+        """
+
+        fout, tmp_file = _open_temporary(file_name)
+        try:
+            with fout:
+                self.write_input_file(fout)
+        except:
+            _remove(tmp_file)
+            raise
+        _replace(tmp_file, file_name)
+
+    ################################################################################
+    #                            PRIVATE CLASS METHODS                             #
+    ################################################################################
+
+    def _write_header(self, fout):
+        """ Comment lines describing how the input file was generated
+        """
+
+        fout.write("! Generated by MARBL_perturbation_class: %d members, %s design, seed %s\n" %
+                   (len(self._members), self._design, self._seed))
+        for sampler in self._samplers.values():
+            fout.write("! %s = %s\n" % (sampler.varname, sampler.describe()))
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def read_perturbation_spec(spec_file):
+    """ Read a perturbation spec, written like an input file:
+              autotrophs(2)%PCref_per_day = 4.0 : 6.0   ! range
+              caco3_bury_thres_opt = 'fixed_depth', 'omega_calc'   ! values to choose from
+        Returns (spec, spec_sources), where spec_sources maps each key to "file:line";
+        every line that can not be parsed is reported, and then the run aborts.
+    """
+
+    from collections import OrderedDict
+    from MARBL_defaults import _tokenize_input_line
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        fin = open(spec_file, "r")
+    except (IOError, OSError):
+        logger.error("Perturbation spec '%s' was not found" % spec_file)
+        _abort(1)
+
+    spec = OrderedDict()
+    spec_sources = dict()
+    error_cnt = 0
+    with fin:
+        for line_num, line in enumerate(fin, 1):
+            source = "%s:%d" % (spec_file, line_num)
+            try:
+                parsed_line = _tokenize_input_line(line)
+            except ValueError as err:
+                logger.error("%s: %s" % (source, err))
+                error_cnt = error_cnt + 1
+                continue
+            if parsed_line is None:
+                continue
+            varname, values = parsed_line
+            if varname in spec:
+                logger.error("%s: %s is already perturbed (%s)" % (source, varname, spec_sources[varname]))
+                error_cnt = error_cnt + 1
+                continue
+            spec[varname] = values
+            spec_sources[varname] = source
+
+    if error_cnt > 0:
+        logger.error("Could not parse perturbation spec '%s' (%d errors)" % (spec_file, error_cnt))
+        _abort(1)
+    return spec, spec_sources
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+def _abort(err_code=0):
+    """ This routine imports sys and calls exit
+    """
+    import sys
+    sys.exit(err_code)
+
+################################################################################
+
+def _source_suffix(source):
+    return "" if source is None else " (%s)" % source
+
+################################################################################
+
+def _get_datatype(schema, parm_key):
+    """ Datatype of a parm_dict key, from the YAML variable (or derived type component)
+    """
+
+    from MARBL_defaults import _parse_parm_key
+
+    var_name, index, component, sub_index = _parse_parm_key(parm_key)
+    var_spec = schema.variables[var_name]
+    if component is not None:
+        var_spec = var_spec.derived_type.component_index[component]
+    return var_spec.datatype
+
+################################################################################
+
+def _check_conditions(schema, parm_dict, samplers, spec_keys, spec_sources, overrides, override_sources):
+    """ Log an error for every key in the spec (or input file) whose variable has a
+        "cannot change" condition that holds, and for every variable with a "must set"
+        condition that holds but is not completely set in the input file or the spec;
+        returns the number of errors. A condition holds if it is true for the baseline
+        configuration or, when it depends on a perturbed key, for any value of that key
+        in the spec (only the ends of a range are checked).
+    """
+
+    from MARBL_defaults import _get_override_aliases, _parse_parm_key
+
+    logger = logging.getLogger(__name__)
+
+    error_cnt = 0
+    holds = dict()
+    for flag in ["cannot change", "must set"]:
+        for var_name, var_spec in schema.variables.items():
+            condition = schema.parms[var_spec.category][var_name].get(flag)
+            if condition is None:
+                continue
+            if condition not in holds:
+                try:
+                    holds[condition] = _condition_holds(condition, parm_dict, samplers)
+                except ValueError as err:
+                    logger.error("%s: %s" % (var_name, err))
+                    error_cnt = error_cnt + 1
+                    holds[condition] = False
+            if not holds[condition]:
+                continue
+
+            if flag == "cannot change":
+                # Every key set for all members: the input file, then the spec
+                set_keys = [(varname, override_sources.get(varname)) for varname in overrides.keys()
+                            if varname not in spec_keys]
+                set_keys.extend([(varname, spec_sources.get(varname)) for varname in spec_keys.keys()])
+                for varname, source in set_keys:
+                    parsed_key = _parse_parm_key(spec_keys.get(varname, varname))
+                    if parsed_key is not None and parsed_key[0] == var_name:
+                        logger.error("%s can not be changed when %s%s" % (varname, condition, _source_suffix(source)))
+                        error_cnt = error_cnt + 1
+            else:
+                missing = []
+                for parm_key in parm_dict.keys():
+                    parsed_key = _parse_parm_key(parm_key)
+                    if parsed_key is None or parsed_key[0] != var_name:
+                        continue
+                    if not [alias for alias in _get_override_aliases(parm_key)
+                            if alias in overrides or alias in samplers]:
+                        missing.append(parm_key)
+                if missing:
+                    logger.error("%s must be set when %s (%d key(s) are not in the input file or spec, e.g. %s)" %
+                                 (var_name, condition, len(missing), missing[0]))
+                    error_cnt = error_cnt + 1
+    return error_cnt
+
+################################################################################
+
+def _condition_holds(condition, parm_dict, samplers):
+    """ True if a "cannot change" / "must set" condition ("name == value" or
+        "name != value") is true for the baseline value of name or, if name is
+        perturbed, for any of its values in the spec; raises ValueError if the
+        condition can not be understood
+    """
+
+    from MARBL_defaults import _get_override_aliases
+
+    match = _CONDITION_RE.match(condition)
+    if match is None:
+        raise ValueError("can not understand condition '%s'" % condition)
+    name, operator, literal = match.groups()
+    values = None
+    for alias in _get_override_aliases(name):
+        if alias in samplers:
+            values = samplers[alias].get_bounding_values()
+            break
+    if values is None:
+        values = [parm_dict[alias] for alias in _get_override_aliases(name) if alias in parm_dict][:1]
+    if not values:
+        raise ValueError("condition '%s' refers to unknown parameter %s" % (condition, name))
+    for value in values:
+        if (_unquote(value) == _unquote(literal)) == (operator == "=="):
+            return True
+    return False
+
+################################################################################
+
+def _unquote(value):
+    """ Strip whitespace and the quotes around a string literal
+    """
+
+    value = str(value).strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in ['"', "'"]:
+        return value[1:-1]
+    return value
+
+################################################################################
+
+# "cannot change" / "must set" conditions: name == value or name != value
+_CONDITION_RE = re.compile(r"^\s*(\w+)\s*(==|!=)\s*(.+?)\s*$")
+
+################################################################################
+
+def _open_temporary(file_name):
+    """ Returns (open file, file name) for a new temporary file in the directory of
+        file_name; see _replace()
+    """
+
+    import os
+    import tempfile
+
+    fd, tmp_file = tempfile.mkstemp(prefix="." + os.path.basename(file_name) + ".",
+                                    dir=os.path.dirname(os.path.abspath(file_name)))
+    return os.fdopen(fd, "w"), tmp_file
+
+################################################################################
+
+def _replace(tmp_file, file_name):
+    """ Give a file from _open_temporary() the usual permissions and move it to file_name
+    """
+
+    import os
+
+    # mkstemp() creates files that only the owner can read
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp_file, 0o666 & ~umask)
+    os.replace(tmp_file, file_name)
+
+################################################################################
+
+def _remove(file_name):
+    import os
+    try:
+        os.remove(file_name)
+    except OSError:
+        pass
+
+################################################################################
+
+def _write_input_dict(fout, input_dict):
+    for varname, value in input_dict.items():
+        fout.write("%s = %s\n" % (varname, value))
+
+################################################################################
+
+def _sample_uniform(member_cnt, dim_cnt, rng):
+    """ Independent uniform samples in [0, 1): one array('d') column per dimension
+    """
+
+    from array import array
+    return [array('d', [rng.random() for m in range(member_cnt)]) for d in range(dim_cnt)]
+
+################################################################################
+
+def _sample_lhs(member_cnt, dim_cnt, rng):
+    """ Latin hypercube: in each column, the m-th stratum [m/member_cnt, (m+1)/member_cnt)
+        is sampled once, and the strata are shuffled independently for each column
+    """
+
+    from array import array
+    columns = []
+    for d in range(dim_cnt):
+        strata = list(range(member_cnt))
+        rng.shuffle(strata)
+        columns.append(array('d', [(stratum + rng.random()) / member_cnt for stratum in strata]))
+    return columns
+
+################################################################################
+
+def _sample_halton(member_cnt, dim_cnt, rng):
+    """ Halton sequence (the d-th column uses the d-th prime as its base), shifted by a
+        random offset modulo 1 in each column so different seeds give different samples
+    """
+
+    from array import array
+    columns = []
+    for base in _get_primes(dim_cnt):
+        shift = rng.random()
+        column = array('d')
+        for m in range(1, member_cnt+1):
+            # radical inverse of m in this base
+            value, scale = 0.0, 1.0 / base
+            while m > 0:
+                m, digit = divmod(m, base)
+                value = value + digit * scale
+                scale = scale / base
+            column.append((value + shift) % 1.0)
+        columns.append(column)
+    return columns
+
+################################################################################
+
+def _get_primes(cnt):
+    """ First cnt prime numbers
+    """
+
+    primes = []
+    candidate = 2
+    while len(primes) < cnt:
+        if all([candidate % prime for prime in primes]):
+            primes.append(candidate)
+        candidate = candidate + 1
+    return primes
+
+################################################################################
+
+# Sampling designs: name -> function(member_cnt, dim_cnt, rng) returning one column of
+# values in [0, 1) per dimension
+_DESIGNS = {
+    "uniform" : _sample_uniform,
+    "lhs" : _sample_lhs,
+    "halton" : _sample_halton,
+}
+_DESIGN_NAMES = ["uniform", "lhs", "halton"]
+
+################################################################################
+
+class _Sampler(object):
+    """ Maps samples in [0, 1) to values of one parm_dict key: a range of integers or
+        reals, or a list of values (formatted as they would be in an input file)
+    """
+
+    def __init__(self, varname, datatype, values):
+        """ Raises ValueError (with a description of the problem) if values is not a
+            valid range or list of values for datatype
+        """
+
+        from MARBL_expression import evaluate_real_expression
+
+        self.varname = varname
+        self.datatype = datatype
+        self.choices = None
+        if len(values) == 1 and ':' in values[0]:
+            if datatype not in ["integer", "real"]:
+                raise ValueError("ranges are only allowed for integers and reals, not %s" % datatype)
+            bounds = [bound.strip() for bound in values[0].split(':')]
+            if len(bounds) != 2 or '' in bounds:
+                raise ValueError("range must be 'min : max'")
+            try:
+                if datatype == "integer":
+                    self.bounds = (int(bounds[0]), int(bounds[1]))
+                else:
+                    self.bounds = (evaluate_real_expression(bounds[0], self.varname),
+                                   evaluate_real_expression(bounds[1], self.varname))
+            except ValueError:
+                raise ValueError("'%s' is not a valid %s range" % (values[0], datatype))
+            if self.bounds[0] > self.bounds[1]:
+                raise ValueError("minimum of range is larger than maximum")
+        else:
+            self.choices = list(values)
+
+    def get_bounding_values(self):
+        """ Values that must all be valid for every sample to be valid
+        """
+
+        if self.choices is not None:
+            return self.choices
+        return [self._format(bound) for bound in self.bounds]
+
+    def describe(self):
+        if self.choices is not None:
+            return ", ".join(self.choices)
+        return "%s : %s" % tuple(self.get_bounding_values())
+
+    def sample(self, unit_column):
+        """ Convert a column of samples in [0, 1) to a list of values
+        """
+
+        if self.choices is not None:
+            choice_cnt = len(self.choices)
+            return [self.choices[min(int(u * choice_cnt), choice_cnt-1)] for u in unit_column]
+        min_value, max_value = self.bounds
+        if self.datatype == "integer":
+            return ["%d" % min(min_value + int(u * (max_value - min_value + 1)), max_value) for u in unit_column]
+
+        # Reals: scale the whole column with one (compiled once) expression
+        from MARBL_expression import evaluate_real_expression_array
+        values = evaluate_real_expression_array("(%r) + x * (%r)" % (min_value, max_value - min_value), unit_column)
+        return [self._format(min(value, max_value)) for value in values]
+
+    def _format(self, value):
+        if self.datatype == "integer":
+            return "%d" % value
+        return repr(float(value))
@@ -0,0 +1,373 @@
+""" Columnar tables of the PFT derived types (autotrophs, zooplankton, grazing).
+
+    parm_dict stores each component of each element under its own key
+    (autotrophs(2)%PCref_per_day, grazing(3,1)%z_grz, ...). MARBL_pft_table_class holds
+    the same values one column per component, built from the components listed in the
+    YAML datatype dictionary:
+        * real    : array('d') (missing values are nan)
+        * integer : array('l') (missing values are -1)
+        * logical : array('b'), 1 for .true. and 0 for .false. (missing values are 0)
+        * string  : list of strings without quotes (missing values are "")
+    Columns are flattened in C order (last index fastest), the order parm_dict keys
+    use: grazing(1,1), grazing(1,2), ..., grazing(2,1), ... The typed columns support
+    the buffer protocol, so numpy.frombuffer(column, column.typecode).reshape(shape)
+    wraps one without copying (get_numpy_array() does this, if numpy is installed).
+
+    Tables stacked across ensemble members (stack_pft_tables()) have an extra leading
+    dimension, one entry per member; members with fewer PFTs than others are padded
+    with the missing values above.
+"""
+
+import logging
+
+class MARBL_pft_table_class(object):
+    """ Columnar copy of one array of derived types (e.g. autotrophs or grazing), for
+        a single configuration or stacked across ensemble members
+    """
+
+    ###############
+    # CONSTRUCTOR #
+    ###############
+
+    def __init__(self, var_name, shape, members=None):
+        """ Class constructor: an empty table for var_name with the given shape (the
+            array dimensions, with the number of members first if members is not None);
+            use get_pft_tables() or stack_pft_tables() rather than calling this directly
+        """
+
+        from collections import OrderedDict
+
+        self._var_name = var_name
+        self._shape = tuple(shape)
+        self._members = members
+        self._columns = OrderedDict()
+        self._datatypes = dict()
+        self._component_lens = dict()
+
+    ################################################################################
+    #                             PUBLIC CLASS METHODS                             #
+    ################################################################################
+
+    def get_name(self):
+        """ Returns the YAML variable name (e.g. "autotrophs")
+        """
+
+        return self._var_name
+
+    ################################################################################
+
+    def get_shape(self):
+        """ Returns the shape of the table: the array dimensions (e.g. (autotroph_cnt,)
+            or (max_grazer_prey_cnt, zooplankton_cnt)), preceded by the number of members
+            for stacked tables
+        """
+
+        return self._shape
+
+    ################################################################################
+
+    def get_member_names(self):
+        """ Returns the members along the first dimension (None if the table is not stacked)
+        """
+
+        return self._members
+
+    ################################################################################
+
+    def get_component_names(self):
+        """ Returns the components of the derived type, in the order they are processed
+        """
+
+        return list(self._columns.keys())
+
+    ################################################################################
+
+    def get_datatype(self, component):
+        """ Returns the YAML datatype of a component
+        """
+
+        return self._datatypes[component]
+
+    ################################################################################
+
+    def get_component_shape(self, component):
+        """ Returns the shape of a component's column: get_shape(), plus a trailing
+            dimension for components that are arrays (e.g. grazing%auto_ind, as long as
+            the longest one; shorter ones are padded with missing values)
+        """
+
+        if self._component_lens[component] is None:
+            return self._shape
+        return self._shape + (self._component_lens[component],)
+
+    ################################################################################
+
+    def get_column(self, component):
+        """ Returns the flattened (C order) column of values for a component
+        """
+
+        return self._columns[component]
+
+    ################################################################################
+
+    def get_record(self, index):
+        """ Returns an ordered dictionary of component -> value for one element; index
+            is a tuple of 1-based indices matching get_shape() (for stacked tables, the
+            first index is the member's position in get_member_names()). Components that
+            are arrays are returned as lists.
+        """
+
+        from collections import OrderedDict
+
+        if len(index) != len(self._shape):
+            raise IndexError("%s index %s does not match shape %s" % (self._var_name, index, self._shape))
+        elem = 0
+        for ind, dim in zip(index, self._shape):
+            if not 1 <= ind <= dim:
+                raise IndexError("%s index %s is out of bounds for shape %s" % (self._var_name, index, self._shape))
+            elem = elem*dim + (ind-1)
+
+        record = OrderedDict()
+        for component, column in self._columns.items():
+            comp_len = self._component_lens[component]
+            if comp_len is None:
+                record[component] = column[elem]
+            else:
+                record[component] = list(column[elem*comp_len:(elem+1)*comp_len])
+        return record
+
+    ################################################################################
+
+    def get_records(self):
+        """ Returns one record (see get_record()) per element, in C order
+        """
+
+        from itertools import product
+        return [self.get_record(index) for index in product(*[range(1, dim+1) for dim in self._shape])]
+
+    ################################################################################
+
+    def get_numpy_array(self, component):
+        """ Returns a component's column as a numpy array of shape
+            get_component_shape(component); numeric and logical columns share memory
+            with the table (logicals are int8, 1 for .true.). Aborts if numpy is not
+            installed.
+        """
+
+        logger = logging.getLogger(__name__)
+
+        try:
+            import numpy
+        except ImportError:
+            logger.error("get_numpy_array() requires numpy")
+            _abort(1)
+
+        column = self._columns[component]
+        shape = self.get_component_shape(component)
+        if self._datatypes[component] == "string":
+            return numpy.array(column).reshape(shape)
+        return numpy.frombuffer(column, dtype=column.typecode).reshape(shape)
+
+    ################################################################################
+    #                            PRIVATE CLASS METHODS                             #
+    ################################################################################
+
+    def _add_column(self, component, datatype, column, comp_len):
+        self._columns[component] = column
+        self._datatypes[component] = datatype
+        self._component_lens[component] = comp_len
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def get_pft_tables(DefaultParms):
+    """ Returns an ordered dictionary of YAML variable name -> MARBL_pft_table_class for
+        every array of derived types in a MARBL_defaults_class object
+    """
+
+    return _build_tables(DefaultParms.get_schema(), [DefaultParms.parm_dict], None)
+
+################################################################################
+
+def stack_pft_tables(parms, Members, members=None):
+    """ Returns an ordered dictionary of YAML variable name -> MARBL_pft_table_class for
+        every array of derived types, stacked across members (default is every member)
+        of Members, any object with the MARBL_ensemble_class interface (an ensemble, a
+        configuration matrix, or a settings file). parms is the dictionary returned by
+        read_parms_file() (or a MARBL_schema_class object) the members were resolved with.
+    """
+
+    from MARBL_schema import get_schema
+
+    if members is None:
+        members = Members.get_member_names()
+    return _build_tables(get_schema(parms), [Members.get_parm_dict(member) for member in members], list(members))
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+def _abort(err_code=0):
+    """ This routine imports sys and calls exit
+    """
+    import sys
+    sys.exit(err_code)
+
+################################################################################
+
+# Value used for entries that are not in parm_dict, by datatype
+_MISSING_VALUES = {
+    "real" : float("nan"),
+    "integer" : -1,
+    "logical" : 0,
+    "string" : "",
+}
+
+# array typecode used for each datatype (strings are kept in lists)
+_TYPECODES = {
+    "real" : 'd',
+    "integer" : 'l',
+    "logical" : 'b',
+}
+
+################################################################################
+
+def _build_tables(schema, parm_dicts, members):
+    """ Build a MARBL_pft_table_class for every array of derived types in schema; if
+        members is None there must be a single parm_dict, otherwise there is one per member
+    """
+
+    from collections import OrderedDict
+    from MARBL_defaults import _get_array_shape
+
+    tables = OrderedDict()
+    for var_name, var_spec in schema.variables.items():
+        if var_spec.derived_type is None or var_spec.array_size is None:
+            continue
+
+        # 1. Shape: the largest size of each dimension across members
+        member_dims = [tuple(_get_array_shape(var_spec.array_size, parm_dict)) for parm_dict in parm_dicts]
+        shape = tuple([max(dims) for dims in zip(*member_dims)])
+        elem_cnt = 1
+        for dim in shape:
+            elem_cnt = elem_cnt * dim
+
+        # 2. Where each member's elements go in the (padded) table
+        positions = [_get_positions(dims, shape) for dims in member_dims]
+
+        table = MARBL_pft_table_class(var_name, shape if members is None else (len(members),) + shape, members)
+        for comp_spec in var_spec.derived_type.components:
+            member_values = [_get_member_values(var_name, comp_spec, dims, parm_dict)
+                             for dims, parm_dict in zip(member_dims, parm_dicts)]
+            comp_len = None
+            if comp_spec.array_size is not None:
+                comp_len = max([0] + [len(value) for values in member_values for value in values])
+            column = _fill_column(var_name, comp_spec, member_values, positions, elem_cnt, comp_len, members)
+            table._add_column(comp_spec.name, comp_spec.datatype, column, comp_len)
+        tables[var_name] = table
+    return tables
+
+################################################################################
+
+def _get_positions(dims, shape):
+    """ Flat (C order) position in a table of the given shape of every element of an
+        array with dimensions dims (also in C order)
+    """
+
+    from itertools import product
+
+    positions = []
+    for index in product(*[range(dim) for dim in dims]):
+        position = 0
+        for ind, dim in zip(index, shape):
+            position = position*dim + ind
+        positions.append(position)
+    return positions
+
+################################################################################
+
+def _get_member_values(var_name, comp_spec, dims, parm_dict):
+    """ Values of one component for every element of one member, in C order (a list
+        per element for components that are arrays). Arrays kept in a _ParmArray
+        (array_storage=True) are read a column at a time instead of key by key.
+    """
+
+    from itertools import product
+
+    get_parm_array = getattr(parm_dict, "get_parm_array", None)
+    parm_array = get_parm_array(var_name) if get_parm_array is not None else None
+    if parm_array is not None:
+        return parm_array.get_column(comp_spec.name)
+
+    values = []
+    for index in product(*[range(1, dim+1) for dim in dims]):
+        key = "%s(%s)%%%s" % (var_name, ",".join([str(ind) for ind in index]), comp_spec.name)
+        if comp_spec.array_size is None:
+            values.append(parm_dict.get(key))
+            continue
+        # Only the first _array_len_to_print entries are in parm_dict
+        value = []
+        while "%s(%d)" % (key, len(value)+1) in parm_dict:
+            value.append(parm_dict["%s(%d)" % (key, len(value)+1)])
+        values.append(value)
+    return values
+
+################################################################################
+
+def _fill_column(var_name, comp_spec, member_values, positions, elem_cnt, comp_len, members):
+    """ Convert each member's values to the component's datatype and put them in one
+        flat column (missing entries keep the missing value)
+    """
+
+    from array import array
+
+    logger = logging.getLogger(__name__)
+
+    datatype = comp_spec.datatype
+    width = 1 if comp_len is None else comp_len
+    size = len(member_values) * elem_cnt * width
+    column = [_MISSING_VALUES[datatype]] * size
+    for m, values in enumerate(member_values):
+        offset = m * elem_cnt
+        for elem, value in enumerate(values):
+            start = (offset + positions[m][elem]) * width
+            try:
+                if comp_len is None:
+                    if value is not None:
+                        column[start] = _convert(value, datatype)
+                else:
+                    for n, entry in enumerate(value):
+                        column[start+n] = _convert(entry, datatype)
+            except (TypeError, ValueError):
+                member = "" if members is None else " (%s)" % members[m]
+                logger.error("%s%%%s: '%s' is not a valid %s%s" % (var_name, comp_spec.name, value, datatype, member))
+                _abort(1)
+    if datatype in _TYPECODES:
+        return array(_TYPECODES[datatype], column)
+    return column
+
+################################################################################
+
+def _convert(value, datatype):
+    """ Convert a parm_dict value to the type stored in a column
+    """
+
+    if datatype == "real":
+        if isinstance(value, str):
+            value = value.strip().replace('d', 'e').replace('D', 'e')
+        return float(value)
+    if datatype == "integer":
+        if isinstance(value, float):
+            raise ValueError
+        return int(value)
+    if datatype == "logical":
+        if isinstance(value, bool):
+            return int(value)
+        value = value.strip().lower()
+        if value not in [".true.", ".false."]:
+            raise ValueError
+        return 1 if value == ".true." else 0
+    if isinstance(value, str) and len(value) > 1 and value[0] == value[-1] and value[0] in ['"', "'"]:
+        return value[1:-1]
+    return str(value)
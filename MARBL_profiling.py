@@ -0,0 +1,302 @@
+""" Phase-level profiling for the MARBL python tools.
+
+    enable_profiling() replaces the functions in _PROFILED_FUNCTIONS (YAML loading,
+    schema validation, input parsing, array expansion, config-keyword matching in
+    _get_var_value(), sorting, ...) with wrappers that record wall time and call
+    counts; disable_profiling() puts the original functions back. Nothing is wrapped
+    while profiling is off, so the only cost of the hooks is profile_phase() and
+    add_count() in code that is not part of a module (e.g. the gen_code.py render
+    loop), which do nothing when profiling is off.
+
+    Times are wall-clock and inclusive (a phase includes the phases it calls). Only the
+    current process is profiled; work done in MARBL_ensemble worker processes is not
+    included.
+"""
+
+import logging
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def enable_profiling():
+    """ Start recording phase times and call counts (clears any earlier results)
+    """
+
+    global _profile
+    if _profile is not None:
+        reset_profile()
+        return
+    _profile = _new_profile()
+    _install_wrappers()
+
+################################################################################
+
+def disable_profiling():
+    """ Stop recording and restore the original functions (results are discarded)
+    """
+
+    global _profile
+    _remove_wrappers()
+    _profile = None
+
+################################################################################
+
+def profiling_enabled():
+    """ True if enable_profiling() has been called (and disable_profiling() has not)
+    """
+
+    return _profile is not None
+
+################################################################################
+
+def reset_profile():
+    """ Discard results recorded so far (profiling stays enabled)
+    """
+
+    global _profile
+    if _profile is not None:
+        _profile = _new_profile()
+
+################################################################################
+
+def profile_phase(name):
+    """ Context manager that records the time spent in the with block as phase name:
+
+            with profile_phase("render"):
+                ...
+
+        Does nothing if profiling is off.
+    """
+
+    if _profile is None:
+        return _NULL_PHASE
+    return _Phase(name)
+
+################################################################################
+
+def add_count(name, count=1):
+    """ Add count to the counter name (does nothing if profiling is off)
+    """
+
+    if _profile is not None:
+        _profile["counters"][name] = _profile["counters"].get(name, 0) + count
+
+################################################################################
+
+def get_profile():
+    """ Return the results so far as a dictionary:
+            total_time : seconds since profiling was enabled
+            phases     : {phase name : {"calls" : int, "time" : seconds}}
+            counters   : {counter name : int}
+        or None if profiling is off
+    """
+
+    from timeit import default_timer
+
+    if _profile is None:
+        return None
+    phases = dict()
+    for name, (calls, time) in _profile["phases"].items():
+        phases[name] = {"calls" : calls, "time" : time}
+    return {"total_time" : default_timer() - _profile["start"],
+            "phases" : phases,
+            "counters" : dict(_profile["counters"])}
+
+################################################################################
+
+def write_profile_table(fout):
+    """ Write the results as a table (slowest phases first) to fout
+    """
+
+    profile = get_profile()
+    if profile is None:
+        return
+    fout.write("%-45s %10s %12s %7s\n" % ("phase", "calls", "time (s)", "%"))
+    for name, stats in sorted(profile["phases"].items(), key=lambda item: -item[1]["time"]):
+        fout.write("%-45s %10d %12.6f %7.1f\n" % (name, stats["calls"], stats["time"],
+                                                   100.0 * stats["time"] / max(profile["total_time"], 1.0e-12)))
+    fout.write("%-45s %10s %12.6f\n" % ("total", "", profile["total_time"]))
+    if profile["counters"]:
+        fout.write("\n%-45s %10s\n" % ("counter", "calls"))
+        for name in sorted(profile["counters"].keys()):
+            fout.write("%-45s %10d\n" % (name, profile["counters"][name]))
+
+################################################################################
+
+def write_profile_json(fout):
+    """ Write the results (see get_profile()) as JSON to fout
+    """
+
+    import json
+
+    profile = get_profile()
+    if profile is None:
+        return
+    json.dump(profile, fout, indent=2, sort_keys=True)
+    fout.write("\n")
+
+################################################################################
+
+def write_profile(profile_file):
+    """ Used by the --profile option of the scripts: write a table to stderr if
+        profile_file is "-", JSON if profile_file ends in .json, and a table otherwise
+    """
+
+    import sys
+
+    if profile_file == "-":
+        write_profile_table(sys.stderr)
+        return
+    with open(profile_file, "w") as fout:
+        if profile_file.endswith(".json"):
+            write_profile_json(fout)
+        else:
+            write_profile_table(fout)
+    logger = logging.getLogger(__name__)
+    logger.info("Wrote profile to %s" % profile_file)
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+# Functions that are replaced by wrappers while profiling is on:
+# (module, class name or None, function name, phase / counter name, timed)
+# Functions that are not timed (they are called too often for a timer to be cheap
+# compared to the function itself) only have their calls counted.
+_PROFILED_FUNCTIONS = [
+    ("MARBL_defaults", None, "read_parms_file", "read_parms_file", True),
+    ("yaml", None, "safe_load", "YAML load", True),
+    ("MARBL_defaults", None, "_invalid_parms_file", "schema validation", True),
+    ("MARBL_defaults", None, "_parse_input_file", "input parsing", True),
+    ("MARBL_defaults", None, "_tokenize_input_line", "_tokenize_input_line", False),
+    ("MARBL_defaults", "MARBL_defaults_class", "_build_dependency_graph", "dependency graph", True),
+    ("MARBL_defaults", "MARBL_defaults_class", "_resolve_all", "resolve", True),
+    ("MARBL_defaults", "MARBL_defaults_class", "_process_array_variable", "array expansion (array_storage)", True),
+    ("MARBL_defaults", None, "_get_array_info", "array expansion", True),
+    ("MARBL_defaults", None, "_get_var_value", "config-keyword matching (_get_var_value)", True),
+    ("MARBL_defaults", "MARBL_defaults_class", "_sort_subcategory_index", "sorting", True),
+    ("MARBL_defaults", None, "_natural_sort_key", "_natural_sort_key", False),
+    ("MARBL_defaults", None, "evaluate_real_expression", "evaluate_real_expression", False),
+    ("MARBL_expression", None, "evaluate_real_expression", "evaluate_real_expression", False),
+    ("MARBL_expression", None, "_compile_expression", "eval (expressions compiled)", False),
+]
+
+_profile = None
+_installed_wrappers = []
+
+################################################################################
+
+def _new_profile():
+    """ Empty set of results
+    """
+
+    from timeit import default_timer
+    return {"start" : default_timer(), "phases" : dict(), "counters" : dict(), "depth" : dict()}
+
+################################################################################
+
+def _record_phase(name, elapsed):
+    """ Add one call taking elapsed seconds to phase name
+    """
+
+    calls, time = _profile["phases"].get(name, (0, 0.0))
+    _profile["phases"][name] = (calls + 1, time + elapsed)
+
+################################################################################
+
+def _make_wrapper(func, name, timed):
+    """ Return a function that records its calls (and, if timed, its time) as name and
+        then calls func
+    """
+
+    from timeit import default_timer
+
+    if not timed:
+        def counting_wrapper(*args, **kwargs):
+            counters = _profile["counters"]
+            counters[name] = counters.get(name, 0) + 1
+            return func(*args, **kwargs)
+        return counting_wrapper
+
+    def timing_wrapper(*args, **kwargs):
+        # Only the outermost call of a recursive (or re-entrant) phase is timed
+        depth = _profile["depth"]
+        if depth.get(name, 0) > 0:
+            return func(*args, **kwargs)
+        depth[name] = 1
+        start = default_timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = default_timer() - start
+            depth[name] = 0
+            _record_phase(name, elapsed)
+    return timing_wrapper
+
+################################################################################
+
+def _install_wrappers():
+    """ Replace every function in _PROFILED_FUNCTIONS (that can be imported) with a wrapper
+    """
+
+    import importlib
+
+    for module_name, class_name, func_name, name, timed in _PROFILED_FUNCTIONS:
+        try:
+            owner = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        if class_name is not None:
+            owner = getattr(owner, class_name)
+        # Look in __dict__ so methods are wrapped as plain functions
+        func = owner.__dict__.get(func_name)
+        if func is None:
+            continue
+        setattr(owner, func_name, _make_wrapper(func, name, timed))
+        _installed_wrappers.append((owner, func_name, func))
+
+################################################################################
+
+def _remove_wrappers():
+    """ Put back the functions replaced by _install_wrappers()
+    """
+
+    while _installed_wrappers:
+        owner, func_name, func = _installed_wrappers.pop()
+        setattr(owner, func_name, func)
+
+################################################################################
+
+class _Phase(object):
+    """ Context manager returned by profile_phase() while profiling is on
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        from timeit import default_timer
+        self._start = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        from timeit import default_timer
+        if _profile is not None:
+            _record_phase(self._name, default_timer() - self._start)
+        return False
+
+################################################################################
+
+class _NullPhase(object):
+    """ Context manager returned by profile_phase() while profiling is off
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_PHASE = _NullPhase()
@@ -0,0 +1,496 @@
+""" Persistent cache of resolved MARBL settings.
+
+    Pipeline stages (case setup, validation, archiving, ...) often run print_defaults.py
+    for the same YAML file, grid and input file. MARBL_result_cache_class keeps the
+    resolved parm_dict (with its subcategory index, the tracer count, and the result of
+    validation) in a directory, one JSON entry per configuration, named by the
+    SHA-256 of
+        * the contents of the YAML file (the schema hash)
+        * the grid
+        * the input file as parsed by iter_input_file_members(): sorted (key, value)
+          pairs, so blank lines, comments, whitespace and the order of the lines in the
+          input file do not change the key
+        * the contents of the modules that resolve and validate the settings
+          (_RESOLVER_MODULES), so changing the code invalidates existing entries
+        * _RESULT_CACHE_VERSION
+    A hit does not read the YAML file (beyond hashing it) or run the resolver.
+
+    The cache is safe to share between processes:
+        * entries are written to a temporary file and renamed, so readers never see
+          part of an entry, and an entry removed while it is being read is a miss
+        * the statistics file and eviction are guarded by an flock() on .lock in the
+          cache directory (there is no lock where fcntl is not available)
+    When the entries use more than max_size bytes, the least recently used ones are
+    removed; each hit updates the modification time of its entry, which is the time
+    eviction sorts by.
+"""
+
+import logging
+
+class MARBL_result_cache_class(object):
+    """ This class stores and looks up resolved settings in a cache directory; see
+        get_defaults() for the usual way to use it.
+
+        This file also contains several subroutines that are not part of the class but are
+        called by member functions in the class.
+    """
+
+    ###############
+    # CONSTRUCTOR #
+    ###############
+
+    def __init__(self, cache_dir, max_size=None):
+        """ Class constructor: use (and create, if needed) cache_dir; max_size is the
+            largest total size of the entries, in bytes (default is _DEFAULT_MAX_SIZE)
+        """
+
+        import os
+
+        logger = logging.getLogger(__name__)
+
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                if not os.path.isdir(cache_dir):
+                    logger.error("Can not create result cache directory %s" % cache_dir)
+                    _abort(1)
+        self._cache_dir = cache_dir
+        self._max_size = _DEFAULT_MAX_SIZE if max_size is None else max_size
+        self._session_stats = _new_stats()
+
+    ################################################################################
+    #                             PUBLIC CLASS METHODS                             #
+    ################################################################################
+
+    def get_defaults(self, yaml_file, grid, input_file, parms=None, validate=False):
+        """ Return the resolved settings for (yaml_file, grid, input_file) as an object
+            with the same interface as MARBL_defaults_class for reading results
+            (parm_dict, get_tracer_cnt(), get_subcategory_names(),
+            get_parm_dict_variable_names(), get_parm_dict_sources()), looking them up in
+            the cache first and resolving (and storing) them on a miss.
+
+            parms (a dictionary returned by read_parms_file() or a MARBL_schema_class
+            object) is only needed on a miss; it is read from yaml_file if it is None.
+            If validate is True, get_violations() of the returned object is the list
+            MARBL_defaults_class.validate() returns; the result of validation is stored
+            with the entry, so a hit does not validate again.
+        """
+
+        from MARBL_defaults import _parse_input_file
+        from MARBL_profiling import profile_phase
+
+        # input_sources are not part of the key; they are only used to report where
+        # invalid values came from, so they always come from this input file
+        input_dict, input_sources = _parse_input_file(input_file)
+        with profile_phase("result cache lookup"):
+            key = self.get_key(yaml_file, grid, input_dict)
+            result = self.lookup(key, input_sources)
+        if result is not None and (result.get_violations() is not None or not validate):
+            return result
+
+        if parms is None:
+            from MARBL_defaults import read_parms_file
+            parms = read_parms_file(yaml_file)
+        if result is None:
+            from MARBL_defaults import MARBL_defaults_class
+            DefaultParms = MARBL_defaults_class(yaml_file, grid, input_dict, parms=parms,
+                                                input_sources=input_sources)
+            result = _CachedResult(_get_entry(DefaultParms), input_sources)
+
+        if validate:
+            from MARBL_validator import MARBL_validator_class
+            from MARBL_schema import get_schema
+            violations = MARBL_validator_class(get_schema(parms).parms).validate_parm_dict(result.parm_dict)
+            result._entry["violations"] = [violation[:3] for violation in violations]
+        with profile_phase("result cache store"):
+            self._store_entry(key, result._entry)
+        return result
+
+    ################################################################################
+
+    def get_key(self, yaml_file, grid, input_dict):
+        """ Returns the cache key (a hex string) for a YAML file, a grid and an input_dict
+            from iter_input_file_members()
+        """
+
+        import hashlib
+        import json
+
+        logger = logging.getLogger(__name__)
+
+        try:
+            with open(yaml_file, "rb") as fin:
+                schema_hash = hashlib.sha256(fin.read()).hexdigest()
+        except (IOError, OSError):
+            logger.error("Can not find %s" % yaml_file)
+            _abort(1)
+        key_data = json.dumps([_RESULT_CACHE_VERSION, _get_resolver_hash(), schema_hash, grid,
+                               sorted(input_dict.items())])
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    ################################################################################
+
+    def lookup(self, key, input_sources=None):
+        """ Returns the cached result for key (see get_defaults()), or None on a miss;
+            input_sources is used by get_parm_dict_sources() of the result
+        """
+
+        import os
+
+        entry = _read_entry(self._get_entry_file(key), key)
+        if entry is None:
+            self._update_stats(misses=1)
+            return None
+        try:
+            os.utime(self._get_entry_file(key), None)
+        except OSError:
+            # Evicted since it was read
+            pass
+        self._update_stats(hits=1)
+        return _CachedResult(entry, input_sources)
+
+    ################################################################################
+
+    def store(self, key, DefaultParms, violations=None):
+        """ Store the resolved settings of a MARBL_defaults_class object under key;
+            violations is the list returned by DefaultParms.validate(), or None if the
+            settings were not validated
+        """
+
+        entry = _get_entry(DefaultParms)
+        if violations is not None:
+            entry["violations"] = [violation[:3] for violation in violations]
+        self._store_entry(key, entry)
+
+    ################################################################################
+
+    def get_stats(self):
+        """ Returns a dictionary of statistics for every process that has used the
+            cache (hits, misses, stores, evictions), plus the number of entries and
+            their total size in bytes
+        """
+
+        with _CacheLock(self._cache_dir):
+            stats = self._read_stats()
+        entries = self._get_entries()
+        stats["entries"] = len(entries)
+        stats["size"] = sum([size for (mtime, size, entry_file) in entries])
+        return stats
+
+    ################################################################################
+
+    def get_session_stats(self):
+        """ Returns hits, misses, stores and evictions by this object only
+        """
+
+        return dict(self._session_stats)
+
+    ################################################################################
+
+    def clear(self):
+        """ Remove every entry and reset the statistics
+        """
+
+        import os
+
+        with _CacheLock(self._cache_dir):
+            for (mtime, size, entry_file) in self._get_entries():
+                _remove(entry_file)
+            _remove(os.path.join(self._cache_dir, _STATS_FILE))
+
+    ################################################################################
+    #                            PRIVATE CLASS METHODS                             #
+    ################################################################################
+
+    def _get_entry_file(self, key):
+        import os
+        return os.path.join(self._cache_dir, key + _ENTRY_SUFFIX)
+
+    ################################################################################
+
+    def _get_entries(self):
+        """ List of (mtime, size, file name) for every entry, least recently used first
+        """
+
+        import os
+
+        entries = []
+        for file_name in os.listdir(self._cache_dir):
+            if not file_name.endswith(_ENTRY_SUFFIX):
+                continue
+            entry_file = os.path.join(self._cache_dir, file_name)
+            try:
+                stat = os.stat(entry_file)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_file))
+        entries.sort()
+        return entries
+
+    ################################################################################
+
+    def _store_entry(self, key, entry):
+        """ Write entry (see _get_entry()) to the cache and evict entries until the cache
+            is no larger than max_size (the new entry is never evicted). Failing to
+            write (e.g. a full disk) is not an error.
+        """
+
+        import json
+        import os
+        import tempfile
+
+        logger = logging.getLogger(__name__)
+
+        entry_file = self._get_entry_file(key)
+        entry = dict(entry, version=_RESULT_CACHE_VERSION, key=key)
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+        except (IOError, OSError):
+            logger.debug("Can not write to result cache %s" % self._cache_dir)
+            return
+        try:
+            with os.fdopen(fd, "w") as fout:
+                json.dump(entry, fout)
+        except (IOError, OSError, TypeError, ValueError):
+            logger.debug("Can not write to result cache %s" % self._cache_dir)
+            _remove(tmp_file)
+            return
+
+        with _CacheLock(self._cache_dir):
+            os.rename(tmp_file, entry_file)
+            entries = self._get_entries()
+            total_size = sum([size for (mtime, size, entry_file_) in entries])
+            evicted = 0
+            for (mtime, size, old_file) in entries:
+                if total_size <= self._max_size:
+                    break
+                if old_file == entry_file:
+                    continue
+                _remove(old_file)
+                total_size = total_size - size
+                evicted = evicted + 1
+            self._update_stats(stores=1, evictions=evicted, locked=True)
+        if evicted > 0:
+            logger.debug("Evicted %d entries from result cache %s" % (evicted, self._cache_dir))
+
+    ################################################################################
+
+    def _read_stats(self):
+        """ Read the statistics file (the lock must be held); a missing or corrupt file
+            counts as no use yet
+        """
+
+        import json
+        import os
+
+        stats = _new_stats()
+        try:
+            with open(os.path.join(self._cache_dir, _STATS_FILE), "r") as fin:
+                saved_stats = json.load(fin)
+            for name in stats.keys():
+                stats[name] = int(saved_stats.get(name, 0))
+        except (IOError, OSError, ValueError, AttributeError):
+            pass
+        return stats
+
+    ################################################################################
+
+    def _update_stats(self, locked=False, **counts):
+        """ Add counts to the statistics of this object and to the statistics file
+            (taking the lock unless the caller holds it)
+        """
+
+        import json
+        import os
+        import tempfile
+
+        if not locked:
+            with _CacheLock(self._cache_dir):
+                self._update_stats(locked=True, **counts)
+            return
+
+        for name, count in counts.items():
+            self._session_stats[name] = self._session_stats[name] + count
+        stats = self._read_stats()
+        for name, count in counts.items():
+            stats[name] = stats[name] + count
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as fout:
+                json.dump(stats, fout)
+            os.rename(tmp_file, os.path.join(self._cache_dir, _STATS_FILE))
+        except (IOError, OSError):
+            logging.getLogger(__name__).debug("Can not update result cache statistics")
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+def _abort(err_code=0):
+    """ This routine imports sys and calls exit
+    """
+    import sys
+    sys.exit(err_code)
+
+################################################################################
+
+# Increment this whenever the format of an entry changes, to invalidate existing entries
+# (changes to the resolver itself are covered by the hash of _RESOLVER_MODULES)
+_RESULT_CACHE_VERSION = 2
+
+# Modules whose code determines the resolved values (and the result of validation)
+_RESOLVER_MODULES = ["MARBL_defaults.py", "MARBL_schema.py", "MARBL_expression.py", "MARBL_validator.py",
+                     "MARBL_pft_tables.py"]
+
+# Default for max_size: 64 MB (an entry for parameters.yaml is about 13 KB, so this holds
+# thousands of configurations, or hundreds of much larger YAML files)
+_DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+_ENTRY_SUFFIX = ".result"
+_STATS_FILE = "stats.json"
+_LOCK_FILE = ".lock"
+
+try:
+    import fcntl as _fcntl
+except ImportError:
+    _fcntl = None
+
+################################################################################
+
+def _new_stats():
+    return dict(hits=0, misses=0, stores=0, evictions=0)
+
+################################################################################
+
+_resolver_hash = None
+
+def _get_resolver_hash():
+    """ SHA-256 of the contents of _RESOLVER_MODULES (computed once per process)
+    """
+
+    global _resolver_hash
+
+    import hashlib
+    import os
+
+    if _resolver_hash is None:
+        lib_dir = os.path.dirname(os.path.abspath(__file__))
+        module_hash = hashlib.sha256()
+        for module_name in _RESOLVER_MODULES:
+            module_hash.update(module_name.encode("utf-8"))
+            try:
+                with open(os.path.join(lib_dir, module_name), "rb") as fin:
+                    module_hash.update(hashlib.sha256(fin.read()).digest())
+            except (IOError, OSError):
+                module_hash.update(b"missing")
+        _resolver_hash = module_hash.hexdigest()
+    return _resolver_hash
+
+################################################################################
+
+def _remove(file_name):
+    """ Remove a file that another process may already have removed
+    """
+    import os
+    try:
+        os.remove(file_name)
+    except OSError:
+        pass
+
+################################################################################
+
+def _get_entry(DefaultParms):
+    """ Everything a _CachedResult needs from a MARBL_defaults_class object
+    """
+
+    subcat_keys = [(subcat_name, list(DefaultParms.get_parm_dict_variable_names(subcat_name)))
+                   for subcat_name in DefaultParms.get_subcategory_names()]
+    return dict(parm_items=list(DefaultParms.parm_dict.items()),
+                subcat_keys=subcat_keys,
+                tracer_cnt=DefaultParms.get_tracer_cnt(),
+                violations=None)
+
+################################################################################
+
+def _read_entry(entry_file, key):
+    """ Return the entry in entry_file if it exists and matches both key and
+        _RESULT_CACHE_VERSION; otherwise return None. Entries are JSON, so reading one
+        never runs code, whoever wrote it.
+    """
+    import json
+
+    try:
+        with open(entry_file, "r") as fin:
+            entry = json.load(fin)
+    except (IOError, OSError, ValueError):
+        # Missing, unreadable, or corrupt entries are all cache misses
+        return None
+
+    if not isinstance(entry, dict):
+        return None
+    if entry.get("version") != _RESULT_CACHE_VERSION or entry.get("key") != key:
+        return None
+    return entry
+
+################################################################################
+
+class _CacheLock(object):
+    """ Context manager holding an exclusive flock() on the cache directory's lock file
+    """
+
+    def __init__(self, cache_dir):
+        import os
+        self._lock_file = os.path.join(cache_dir, _LOCK_FILE)
+        self._fd = None
+
+    def __enter__(self):
+        import os
+        if _fcntl is not None:
+            self._fd = os.open(self._lock_file, os.O_RDWR | os.O_CREAT, 0o666)
+            _fcntl.flock(self._fd, _fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        import os
+        if self._fd is not None:
+            _fcntl.flock(self._fd, _fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        return False
+
+################################################################################
+
+class _CachedResult(object):
+    """ Resolved settings read from (or about to be stored in) the cache
+    """
+
+    def __init__(self, entry, input_sources=None):
+        from collections import OrderedDict
+        self._entry = entry
+        self._subcat_keys = OrderedDict(entry["subcat_keys"])
+        self._input_sources = input_sources or dict()
+        self.parm_dict = OrderedDict(entry["parm_items"])
+
+    def get_tracer_cnt(self):
+        return self._entry["tracer_cnt"]
+
+    def get_subcategory_names(self):
+        return list(self._subcat_keys.keys())
+
+    def get_parm_dict_variable_names(self, subcategory):
+        return self._subcat_keys[subcategory]
+
+    def get_parm_dict_sources(self):
+        from MARBL_defaults import _get_parm_dict_sources
+        return _get_parm_dict_sources(self._input_sources, self.parm_dict)
+
+    def get_violations(self):
+        """ Violations in the format of MARBL_defaults_class.validate() (sources come
+            from the current input file), or None if the entry was not validated
+        """
+        if self._entry["violations"] is None:
+            return None
+        sources = self.get_parm_dict_sources()
+        return [(parm_key, value, message, sources.get(parm_key))
+                for (parm_key, value, message) in self._entry["violations"]]
@@ -0,0 +1,257 @@
+""" Compiled, read-only form of a MARBL parameter file.
+
+    read_parms_file() returns the YAML file as nested dictionaries. MARBL_schema_class
+    compiles those dictionaries once into records that MARBL_defaults_class reads while
+    resolving values:
+        * _VariableSpec: one YAML variable (or one component of a derived type)
+        * _DerivedTypeSpec: the components of a derived type, in processing order
+        * _ArrayShapeSpec / _DimSpec: an _array_size (or _array_len_to_print) entry
+    Records use __slots__ and can not be changed once they are built; names are
+    interned, lists become tuples and dictionaries become read-only mappings. Nothing
+    in MARBL_defaults_class writes to the schema (per-object state such as the config
+    keywords lives in MARBL_defaults_class and its _ResolutionContext), so one schema
+    can be shared by any number of MARBL_defaults_class objects, including objects
+    used by different threads at the same time.
+
+    Schemas are not picklable; processes that need one (e.g. MARBL_ensemble workers)
+    build their own from the parms dictionary.
+"""
+
+import sys
+
+class MARBL_schema_class(object):
+    """ Read-only schema compiled from a dictionary returned by read_parms_file():
+            parms         : that dictionary (treat it as read-only)
+            categories    : category names, in processing order
+            variables     : read-only mapping of variable name -> _VariableSpec, in
+                            processing order (by category, then alphabetically)
+            subcategories : naturally-sorted subcategories (see get_subcategory_list())
+            tracer_cnt    : _DimSpec for _tracer_cnt
+    """
+
+    __slots__ = ("parms", "categories", "variables", "subcategories", "tracer_cnt")
+
+    def __init__(self, parms):
+        from collections import OrderedDict
+        from MARBL_defaults import get_subcategory_list, _sort
+
+        categories = tuple([sys.intern(cat_name) for cat_name in parms['_order']])
+        try:
+            all_pft_keys = parms['general_parms']['PFT_defaults']['_CESM2_PFT_keys']
+        except KeyError:
+            all_pft_keys = dict()
+        variables = OrderedDict()
+        for cat_name in categories:
+            for var_name in _sort(parms[cat_name].keys()):
+                pft_keys = None
+                if cat_name == "PFT_derived_types" and var_name in all_pft_keys:
+                    pft_keys = all_pft_keys[var_name]
+                variables[sys.intern(var_name)] = _compile_variable(var_name, cat_name, parms[cat_name][var_name],
+                                                                 pft_keys)
+        _init_record(self, parms=parms,
+                     categories=categories,
+                     variables=_read_only(variables),
+                     subcategories=tuple(get_subcategory_list(parms)),
+                     tracer_cnt=_compile_dim(parms['_tracer_cnt']))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MARBL_schema_class objects can not be modified")
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def get_schema(parms):
+    """ Return parms if it is already a MARBL_schema_class object, otherwise compile
+        it (parms must be a dictionary returned by read_parms_file())
+    """
+
+    if isinstance(parms, MARBL_schema_class):
+        return parms
+    return MARBL_schema_class(parms)
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+try:
+    from types import MappingProxyType as _read_only
+except ImportError:
+    _read_only = dict
+
+################################################################################
+
+def _init_record(record, **fields):
+    """ Set the (slot) fields of a record; records block setattr once they are built
+    """
+    for name, value in fields.items():
+        object.__setattr__(record, name, value)
+
+################################################################################
+
+def _freeze(value):
+    """ Immutable copy of a value from the YAML file: lists become tuples and
+        dictionaries become read-only mappings (with interned keys)
+    """
+    if isinstance(value, list):
+        return tuple([_freeze(entry) for entry in value])
+    if isinstance(value, dict):
+        return _read_only(dict([(sys.intern(key) if isinstance(key, str) else key, _freeze(entry))
+                                for key, entry in value.items()]))
+    return value
+
+################################################################################
+
+def _compile_dim(dim_in):
+    """ _DimSpec for one dimension: an integer, the name of a variable, or a dictionary
+        with a 'default' size and 'increments' ("var = value" : change)
+    """
+    increments = []
+    if isinstance(dim_in, dict):
+        for key_check, change in dim_in.get('increments', dict()).items():
+            var_name, value = key_check.split(" = ")
+            increments.append((sys.intern(var_name), value, change))
+        dim_in = dim_in['default']
+    if isinstance(dim_in, str):
+        dim_in = sys.intern(dim_in)
+    return _DimSpec(dim_in, tuple(increments))
+
+################################################################################
+
+def _compile_shape(size_in):
+    """ _ArrayShapeSpec for an _array_size entry (a list for 2D arrays), or None
+    """
+    if size_in is None:
+        return None
+    if isinstance(size_in, list):
+        return _ArrayShapeSpec(tuple([_compile_dim(dim_in) for dim_in in size_in]))
+    return _ArrayShapeSpec((_compile_dim(size_in),))
+
+################################################################################
+
+def _compile_variable(var_name, cat_name, var_dict, pft_keys=None):
+    """ _VariableSpec for a YAML variable (or derived type component)
+    """
+    from MARBL_defaults import _get_var_dependencies, _can_store_as_array, _sort_with_specific_suffix_first
+
+    array_size = _compile_shape(var_dict.get("_array_size"))
+    if "_array_len_to_print" in var_dict.keys():
+        array_len = _compile_shape(var_dict["_array_len_to_print"])
+    else:
+        array_len = array_size
+
+    derived_type = None
+    if isinstance(var_dict["datatype"], dict):
+        components = tuple([_compile_variable(key, cat_name, var_dict["datatype"][key])
+                            for key in _sort_with_specific_suffix_first(var_dict["datatype"].keys(), '_cnt')
+                            if key[0] != '_'])
+        derived_type = _DerivedTypeSpec(components)
+        datatype = None
+        subcategory = None
+        default_value = None
+        subcats = frozenset([component.subcategory for component in components])
+        default_keys = frozenset().union(*[component.default_keys for component in components])
+    else:
+        datatype = sys.intern(var_dict["datatype"])
+        subcategory = sys.intern(var_dict["subcategory"])
+        default_value = _freeze(var_dict["default_value"])
+        subcats = frozenset([subcategory])
+        if isinstance(var_dict["default_value"], dict):
+            default_keys = frozenset(default_value.keys())
+        else:
+            default_keys = frozenset()
+
+    return _VariableSpec(name=sys.intern(var_name),
+                         category=cat_name,
+                         datatype=datatype,
+                         subcategory=subcategory,
+                         default_value=default_value,
+                         default_keys=default_keys,
+                         array_size=array_size,
+                         array_len=array_len,
+                         append_to_config_keywords=bool(var_dict.get("_append_to_config_keywords", False)),
+                         derived_type=derived_type,
+                         pft_keys=None if pft_keys is None else tuple([sys.intern(key) for key in pft_keys]),
+                         pft_dependents=tuple(var_dict.get("_CESM2_PFT_keys", dict()).keys()),
+                         dependencies=frozenset(_get_var_dependencies(var_dict)),
+                         subcats=subcats,
+                         array_storable=_can_store_as_array(var_dict))
+
+################################################################################
+
+class _Record(object):
+    """ Base class for schema records: fields are set once, by _init_record()
+    """
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s objects can not be modified" % type(self).__name__)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__,
+                           ", ".join(["%s=%r" % (name, getattr(self, name)) for name in self.__slots__]))
+
+################################################################################
+
+class _VariableSpec(_Record):
+    """ One YAML variable, or one component of a derived type:
+            name, category, datatype, subcategory, default_value
+                : from the YAML (datatype, subcategory and default_value are None for
+                  derived types; default_value is frozen, see _freeze())
+            default_keys : keys of default_value if it is a dictionary (for derived
+                           types, the keys of every component)
+            array_size   : _ArrayShapeSpec or None
+            array_len    : _ArrayShapeSpec for _array_len_to_print (array_size if not set)
+            append_to_config_keywords : value is added to the config keywords
+            derived_type : _DerivedTypeSpec or None
+            pft_keys     : CESM2 PFT keys for the elements of a PFT derived type
+            pft_dependents : derived types listed in this variable's _CESM2_PFT_keys
+            dependencies : names referred to by array sizes and default_value keys
+            subcats      : subcategories of the parm_dict entries for this variable
+            array_storable : can be kept in a _ParmArray (see _can_store_as_array())
+    """
+
+    __slots__ = ("name", "category", "datatype", "subcategory", "default_value", "default_keys", "array_size",
+                 "array_len", "append_to_config_keywords", "derived_type", "pft_keys", "pft_dependents",
+                 "dependencies", "subcats", "array_storable")
+
+    def __init__(self, **fields):
+        _init_record(self, **fields)
+
+################################################################################
+
+class _DerivedTypeSpec(_Record):
+    """ Components of a derived type (_VariableSpec records, in processing order:
+        components ending in _cnt first, then alphabetically)
+    """
+
+    __slots__ = ("components", "component_index")
+
+    def __init__(self, components):
+        _init_record(self, components=components,
+                     component_index=_read_only(dict([(component.name, component) for component in components])))
+
+################################################################################
+
+class _ArrayShapeSpec(_Record):
+    """ Shape of an array: one _DimSpec per dimension
+    """
+
+    __slots__ = ("dims",)
+
+    def __init__(self, dims):
+        _init_record(self, dims=dims)
+
+################################################################################
+
+class _DimSpec(_Record):
+    """ Size of one dimension: size is an integer or the name of a variable (looked up
+        in parm_dict), and increments is a tuple of (variable name, value, change)
+        added when parm_dict[variable name] == value
+    """
+
+    __slots__ = ("size", "increments")
+
+    def __init__(self, size, increments):
+        _init_record(self, size=size, increments=increments)
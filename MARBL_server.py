@@ -0,0 +1,390 @@
+""" Long-lived local server for print_defaults.py.
+
+    Case-setup scripts call print_defaults.py many times with the same YAML file; most
+    of the time goes to starting python, importing PyYAML and reading the schema. The
+    server (print_defaults.py --server) listens on a Unix domain socket and keeps every
+    schema it has read in memory (compiled into a read-only MARBL_schema_class), keyed by
+    the YAML file's path and the hash of its contents; a YAML file that changes on disk
+    is re-read on the next request. Requests are handled in their own threads, all
+    sharing the one copy of each schema.
+
+    print_defaults.py --client sends its grid, YAML file and input file to the server
+    and copies the result to stdout. If no server is running, request_defaults()
+    returns None and print_defaults.py resolves the values itself.
+
+    Protocol: the client sends one line of JSON (the request) and the server answers
+    with one line of JSON (status and log messages) followed by the output.
+
+    This module is imported by the client before anything else, so it must not import
+    PyYAML or MARBL_defaults at module level.
+"""
+
+import logging
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def get_default_socket_path():
+    """ Socket used when none is specified: $MARBL_DEFAULTS_SOCKET if it is set,
+        otherwise marbl_defaults.sock in $XDG_RUNTIME_DIR (a directory only the user
+        can access) or, if that is not set, in marbl_defaults_<uid>/ in the temporary
+        directory (created by the server with mode 0700)
+    """
+
+    import os
+
+    if os.environ.get("MARBL_DEFAULTS_SOCKET"):
+        return os.environ["MARBL_DEFAULTS_SOCKET"]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], _SOCKET_NAME)
+    return os.path.join(_get_private_socket_dir(), _SOCKET_NAME)
+
+################################################################################
+
+def request_defaults(socket_path, yaml_file, grid, input_file, fout, ferr, validate=True):
+    """ Ask the server at socket_path to resolve yaml_file / grid / input_file (and
+        check the values, if validate is True), writing the output to fout and the
+        server's log messages to ferr. Returns the exit status reported by the server,
+        or None if no server is listening on socket_path.
+    """
+
+    import os
+
+    request = dict()
+    request["command"] = "print_defaults"
+    request["yaml_file"] = os.path.abspath(yaml_file)
+    request["grid"] = grid
+    request["input_file"] = None if input_file is None else os.path.abspath(input_file)
+    request["validate"] = validate
+    response = _send_request(socket_path, request)
+    if response is None:
+        return None
+
+    header, sock_file = response
+    for message in header["messages"]:
+        ferr.write(message + "\n")
+    while True:
+        chunk = sock_file.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        fout.write(chunk.decode("utf-8"))
+    sock_file.close()
+    return header["status"]
+
+################################################################################
+
+def shutdown_server(socket_path):
+    """ Ask the server at socket_path to exit; returns False if no server is listening
+    """
+
+    response = _send_request(socket_path, {"command" : "shutdown"})
+    if response is None:
+        return False
+    response[1].close()
+    return True
+
+################################################################################
+
+def serve(socket_path, use_cache=True):
+    """ Listen on socket_path until a shutdown request arrives (or the process is
+        interrupted); each request is handled in its own thread
+    """
+
+    import os
+
+    logger = logging.getLogger(__name__)
+
+    # The directory in the temporary directory must only be accessible by this user
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    if socket_dir == _get_private_socket_dir():
+        message = _make_private_dir(socket_dir)
+        if message is not None:
+            logger.error(message)
+            _abort(1)
+
+    # Remove a socket left behind by a server that is no longer running (but nothing else)
+    if os.path.lexists(socket_path):
+        message = _check_socket(socket_path)
+        if message is not None:
+            logger.error("Will not replace %s: %s" % (socket_path, message))
+            _abort(1)
+        if _send_request(socket_path, {"command" : "ping"}) is not None:
+            logger.error("A server is already listening on %s" % socket_path)
+            _abort(1)
+        os.remove(socket_path)
+
+    server = _MARBLServer(socket_path, use_cache)
+    logger.info("Listening on %s" % socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+    logger.info("Server on %s has stopped" % socket_path)
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+def _abort(err_code=0):
+    """ This routine imports sys and calls exit
+    """
+    import sys
+    sys.exit(err_code)
+
+################################################################################
+
+_CHUNK_SIZE = 65536
+
+_SOCKET_NAME = "marbl_defaults.sock"
+
+# Same format as the scripts' logging.basicConfig() call
+_LOG_FORMAT = '%(levelname)s (%(funcName)s): %(message)s'
+
+################################################################################
+
+def _get_private_socket_dir():
+    """ Per-user directory for the default socket when $XDG_RUNTIME_DIR is not set
+    """
+
+    import os
+    import tempfile
+
+    return os.path.join(tempfile.gettempdir(), "marbl_defaults_%d" % os.getuid())
+
+################################################################################
+
+def _make_private_dir(dir_name):
+    """ Create dir_name with mode 0700 if it does not exist; returns None if it is a
+        directory owned by this user that no one else can access, otherwise a
+        description of the problem
+    """
+
+    import errno
+    import os
+    import stat
+
+    try:
+        os.mkdir(dir_name, 0o700)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            return "Can not create %s: %s" % (dir_name, err)
+    dir_stat = os.lstat(dir_name)
+    if not stat.S_ISDIR(dir_stat.st_mode):
+        return "%s is not a directory" % dir_name
+    if dir_stat.st_uid != os.getuid():
+        return "%s is owned by another user" % dir_name
+    if dir_stat.st_mode & 0o077:
+        return "%s can be accessed by other users (mode %o)" % (dir_name, stat.S_IMODE(dir_stat.st_mode))
+    return None
+
+################################################################################
+
+def _check_socket(socket_path):
+    """ Returns None if socket_path is a socket owned by this user, otherwise a
+        description of what it is
+    """
+
+    import os
+    import stat
+
+    try:
+        path_stat = os.lstat(socket_path)
+    except OSError:
+        return "it does not exist"
+    if not stat.S_ISSOCK(path_stat.st_mode):
+        return "it is not a socket"
+    if path_stat.st_uid != os.getuid():
+        return "it is owned by another user"
+    return None
+
+################################################################################
+
+def _send_request(socket_path, request):
+    """ Send request (a dictionary) to the server; returns (response header, file object
+        for reading the rest of the response) or None if nothing is listening. Only
+        sockets owned by this user are used (anything else is logged and ignored).
+    """
+
+    import json
+    import os
+    import socket
+
+    if not os.path.lexists(socket_path):
+        return None
+    message = _check_socket(socket_path)
+    if message is not None:
+        logging.getLogger(__name__).warning("Ignoring %s: %s" % (socket_path, message))
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        sock.shutdown(socket.SHUT_WR)
+        sock_file = sock.makefile("rb")
+        header = sock_file.readline()
+    except (IOError, OSError, socket.error):
+        sock.close()
+        return None
+    sock.close()
+    if not header:
+        sock_file.close()
+        return None
+    return json.loads(header.decode("utf-8")), sock_file
+
+################################################################################
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+class _MARBLServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Unix domain socket server that holds the schemas read so far
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, use_cache):
+        import threading
+        # {YAML file : (os.stat() key, content hash, MARBL_schema_class object)}
+        self.schemas = dict()
+        # {content hash : MARBL_validator_class object}
+        self.validators = dict()
+        self.use_cache = use_cache
+        # Held while reading or looking up a schema
+        self.lock = threading.Lock()
+        socketserver.UnixStreamServer.__init__(self, socket_path, _MARBLRequestHandler)
+
+    def get_schema(self, yaml_file):
+        """ Return the schema for yaml_file, re-reading it if its contents changed
+        """
+
+        import hashlib
+        import os
+        from MARBL_defaults import read_parms_file
+        from MARBL_schema import MARBL_schema_class
+
+        logger = logging.getLogger(__name__)
+
+        with self.lock:
+            try:
+                stat = os.stat(yaml_file)
+            except OSError:
+                # read_parms_file() reports the missing file
+                return MARBL_schema_class(read_parms_file(yaml_file, self.use_cache))
+            stat_key = (stat.st_mtime, stat.st_size, stat.st_ino)
+            if yaml_file in self.schemas and self.schemas[yaml_file][0] == stat_key:
+                return self.schemas[yaml_file][2]
+
+            with open(yaml_file, "rb") as fin:
+                yaml_hash = hashlib.sha256(fin.read()).hexdigest()
+            if yaml_file in self.schemas and self.schemas[yaml_file][1] == yaml_hash:
+                # File was touched but not changed
+                schema = self.schemas[yaml_file][2]
+            else:
+                if yaml_file in self.schemas:
+                    logger.info("Reloading %s" % yaml_file)
+                schema = MARBL_schema_class(read_parms_file(yaml_file, self.use_cache))
+            self.schemas[yaml_file] = (stat_key, yaml_hash, schema)
+            return schema
+
+    def get_validator(self, yaml_file, schema):
+        """ Return a validator for schema (returned by get_schema(yaml_file))
+        """
+
+        from MARBL_validator import MARBL_validator_class
+
+        with self.lock:
+            if yaml_file not in self.schemas or self.schemas[yaml_file][2] is not schema:
+                return MARBL_validator_class(schema.parms)
+            yaml_hash = self.schemas[yaml_file][1]
+            if yaml_hash not in self.validators:
+                self.validators[yaml_hash] = MARBL_validator_class(schema.parms)
+            return self.validators[yaml_hash]
+
+################################################################################
+
+class _MARBLRequestHandler(socketserver.StreamRequestHandler):
+    """ Handle a single request: resolve the defaults and send them back, along with
+        everything MARBL_defaults logged while doing so
+    """
+
+    def handle(self):
+        import json
+        import threading
+
+        request = json.loads(self.rfile.readline().decode("utf-8"))
+        if request["command"] == "shutdown":
+            self._send_response(0, [], "")
+            # shutdown() waits for serve_forever() to return, so call it from another thread
+            threading.Thread(target=self.server.shutdown).start()
+            return
+        if request["command"] == "ping":
+            self._send_response(0, [], "")
+            return
+
+        # Collect log messages (from this thread only) for the client
+        messages = []
+        handler = _ListHandler(messages, threading.current_thread().ident)
+        handler.setFormatter(logging.Formatter(_LOG_FORMAT))
+        root_logger = logging.getLogger()
+        root_logger.addHandler(handler)
+        try:
+            status, output = self._print_defaults(request)
+        finally:
+            root_logger.removeHandler(handler)
+        self._send_response(status, messages, output)
+
+    def _print_defaults(self, request):
+        """ Return (exit status, output) for a print_defaults request
+        """
+
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+        from MARBL_defaults import MARBL_defaults_class, print_parm_dict
+
+        fout = StringIO()
+        try:
+            schema = self.server.get_schema(request["yaml_file"])
+            DefaultParms = MARBL_defaults_class(request["yaml_file"], request["grid"], request["input_file"],
+                                                parms=schema)
+            if request.get("validate", True):
+                validator = self.server.get_validator(request["yaml_file"], schema)
+                if validator.log_violations(DefaultParms.validate(validator)):
+                    return 1, ""
+            print_parm_dict(fout, DefaultParms.get_subcategory_names(),
+                            DefaultParms.get_parm_dict_variable_names, DefaultParms.parm_dict)
+        except SystemExit as err:
+            # MARBL_defaults has logged the reason
+            return (err.code if isinstance(err.code, int) else 1), ""
+        return 0, fout.getvalue()
+
+    def _send_response(self, status, messages, output):
+        import json
+        header = {"status" : status, "messages" : messages}
+        self.wfile.write((json.dumps(header) + "\n").encode("utf-8"))
+        if output:
+            self.wfile.write(output.encode("utf-8"))
+
+################################################################################
+
+class _ListHandler(logging.Handler):
+    """ Logging handler that appends formatted messages logged by one thread to a list
+    """
+
+    def __init__(self, messages, thread_id):
+        logging.Handler.__init__(self)
+        self._messages = messages
+        self._thread_id = thread_id
+
+    def emit(self, record):
+        if record.thread == self._thread_id:
+            self._messages.append(self.format(record))
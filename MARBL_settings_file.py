@@ -0,0 +1,547 @@
+""" Compact binary files of resolved MARBL settings.
+
+    print_defaults.py writes "varname = value" text, which downstream tools have to
+    parse again every time they read it. write_settings_file() stores the parm_dict of
+    one or more members (an ensemble, a configuration matrix, or a single run) in one
+    file, and MARBL_settings_file_class memory-maps that file so any value of any
+    member can be read without reading the rest of the file.
+
+    File layout (all integers little-endian; every section starts on an 8-byte boundary):
+        header          : magic, version, string / member / subcategory / key counts,
+                          and the offset of each of the sections below
+        string offsets  : uint64[n_strings + 1], offsets into the string data
+        string data     : UTF-8 strings (names, subcategories, and string values)
+        members         : uint32[n_members], string id of each member name
+        member order    : uint32[n_members], members sorted by name (for lookups)
+        subcategories   : (uint32 name id, uint32 first key, uint32 key count)[n_subcats]
+        keys            : uint32[n_keys], string id of each parm_dict key; keys are grouped
+                          by subcategory and naturally sorted within each subcategory
+        key order       : uint32[n_keys], keys sorted by name (for lookups)
+        value types     : uint8[n_members * n_keys], one of the _TYPE_* codes below
+        values          : 8 bytes [n_members * n_keys]: int64 for integers, float64 for
+                          reals, 0 / 1 for logicals, and the string id for strings (and
+                          for reals written in a form that is not reproduced by
+                          formatting the float, e.g. 1.5d0)
+
+    Values are stored one row per member, so a member's parm_dict is contiguous; a key
+    that does not exist for a member (e.g. autotrophs(3)%... in a member with two
+    autotrophs) has type _TYPE_MISSING.
+
+    The type of each value comes from the datatype in the schema. The type code of a
+    real also records how it was written: "%20.15e" (the format MARBL_defaults uses
+    for computed reals), repr() (e.g. 0.07 from the YAML file), or any other text
+    (e.g. 1.5d0 from an input file, kept in the string table). Converting a file back
+    to text therefore reproduces print_defaults.py exactly, and every real is read
+    back as a float when typed values are asked for.
+"""
+
+import logging
+
+class MARBL_settings_file_class(object):
+    """ Read-only access to a file written by write_settings_file(). The file is
+        memory-mapped and only the header is read when it is opened; names and values
+        are read from the mapping when they are asked for, and a key or member name is
+        found with a binary search of the sorted lookup tables.
+
+        The interface matches MARBL_ensemble_class (get_member_names(),
+        get_subcategory_names(), get_parm_dict(), get_parm_dict_variable_names()), so
+        code written for ensembles can read settings files as well.
+    """
+
+    ###############
+    # CONSTRUCTOR #
+    ###############
+
+    def __init__(self, file_name):
+        """ Class constructor: map file_name into memory and check its header
+        """
+
+        import mmap
+
+        logger = logging.getLogger(__name__)
+
+        self._file_name = file_name
+        with open(file_name, "rb") as fin:
+            try:
+                self._map = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                self._map = b""
+        if len(self._map) < _HEADER.size or self._map[:len(_MAGIC)] != _MAGIC:
+            logger.error("%s is not a MARBL settings file" % file_name)
+            _abort(1)
+        header = _HEADER.unpack_from(self._map, 0)
+        if header[1] not in _READABLE_VERSIONS:
+            logger.error("%s is version %d of the settings file format; only versions up to %d are supported" %
+                         (file_name, header[1], _VERSION))
+            _abort(1)
+        (self._n_strings, self._n_members, self._n_subcats, self._n_keys) = header[2:6]
+        (self._string_offsets, self._string_data, self._members, self._member_order, self._subcats,
+         self._keys, self._key_order, self._value_types, self._values) = header[7:]
+        self._member_index = dict()
+        self._key_index = dict()
+
+    ################################################################################
+    #                             PUBLIC CLASS METHODS                             #
+    ################################################################################
+
+    def close(self):
+        """ Release the memory map
+        """
+
+        if not isinstance(self._map, bytes):
+            self._map.close()
+
+    ################################################################################
+
+    def get_member_names(self):
+        """ Returns the list of members, in the order they were written
+        """
+
+        return [self._get_string(self._get_uint32(self._members, m)) for m in range(self._n_members)]
+
+    ################################################################################
+
+    def get_subcategory_names(self):
+        """ Returns the list of subcategories, in the order they were written
+        """
+
+        return [self._get_string(self._get_uint32(self._subcats, 3 * s)) for s in range(self._n_subcats)]
+
+    ################################################################################
+
+    def get_variable_names(self, subcategory):
+        """ Returns the sorted list of keys in the provided subcategory (for any member)
+        """
+
+        first_key, key_cnt = self._get_subcat_keys(subcategory)
+        return [self._get_key_name(n) for n in range(first_key, first_key + key_cnt)]
+
+    ################################################################################
+
+    def get_parm_dict_variable_names(self, member, subcategory):
+        """ Returns the sorted list of parm_dict keys for a specific member that are in
+            the provided subcategory
+        """
+
+        row = self._get_member_index(member) * self._n_keys
+        first_key, key_cnt = self._get_subcat_keys(subcategory)
+        return [self._get_key_name(n) for n in range(first_key, first_key + key_cnt)
+                if self._get_value_type(row + n) != _TYPE_MISSING]
+
+    ################################################################################
+
+    def get_value(self, member, key, typed=False):
+        """ Returns the value of key for a specific member, formatted as it is in
+            parm_dict (or as a python int / float / bool / unquoted string if typed is
+            True); raises KeyError if the member does not have that key
+        """
+
+        n = self._get_member_index(member) * self._n_keys + self._get_key_index(key)
+        if self._get_value_type(n) == _TYPE_MISSING:
+            raise KeyError(key)
+        return self._decode_value(n, typed)
+
+    ################################################################################
+
+    def get_parm_dict(self, member, typed=False):
+        """ Returns an ordered dictionary with every key / value of a specific member
+            (see get_value() for the meaning of typed)
+        """
+
+        from collections import OrderedDict
+
+        row = self._get_member_index(member) * self._n_keys
+        parm_dict = OrderedDict()
+        for n in range(self._n_keys):
+            if self._get_value_type(row + n) != _TYPE_MISSING:
+                parm_dict[self._get_key_name(n)] = self._decode_value(row + n, typed)
+        return parm_dict
+
+    ################################################################################
+
+    def get_column(self, key, typed=False):
+        """ Returns an ordered dictionary of member -> value of key, for every member
+            that has key (see get_value() for the meaning of typed)
+        """
+
+        from collections import OrderedDict
+
+        n = self._get_key_index(key)
+        column = OrderedDict()
+        for m in range(self._n_members):
+            if self._get_value_type(m * self._n_keys + n) != _TYPE_MISSING:
+                member = self._get_string(self._get_uint32(self._members, m))
+                column[member] = self._decode_value(m * self._n_keys + n, typed)
+        return column
+
+    ################################################################################
+    #                            PRIVATE CLASS METHODS                             #
+    ################################################################################
+
+    def _get_uint32(self, section, n):
+        return _UINT32.unpack_from(self._map, section + 4 * n)[0]
+
+    ################################################################################
+
+    def _get_string_bytes(self, string_id):
+        start, end = _STRING_OFFSETS.unpack_from(self._map, self._string_offsets + 8 * string_id)
+        return self._map[self._string_data + start : self._string_data + end]
+
+    ################################################################################
+
+    def _get_string(self, string_id):
+        return self._get_string_bytes(string_id).decode("utf-8")
+
+    ################################################################################
+
+    def _get_key_name(self, n):
+        return self._get_string(self._get_uint32(self._keys, n))
+
+    ################################################################################
+
+    def _get_value_type(self, n):
+        return _UINT8.unpack_from(self._map, self._value_types + n)[0]
+
+    ################################################################################
+
+    def _decode_value(self, n, typed):
+        """ Value number n (member * n_keys + key) of the values section
+        """
+
+        value_type = self._get_value_type(n)
+        position = self._values + 8 * n
+        if value_type == _TYPE_INTEGER:
+            return _INT64.unpack_from(self._map, position)[0]
+        if value_type == _TYPE_REAL:
+            value = _FLOAT64.unpack_from(self._map, position)[0]
+            return value if typed else _REAL_FORMAT % value
+        if value_type == _TYPE_REAL_REPR:
+            value = _FLOAT64.unpack_from(self._map, position)[0]
+            return value if typed else repr(value)
+        if value_type == _TYPE_REAL_TEXT:
+            value = self._get_string(_INT64.unpack_from(self._map, position)[0])
+            return _parse_real(value) if typed else value
+        if value_type == _TYPE_LOGICAL:
+            value = _INT64.unpack_from(self._map, position)[0] != 0
+            if typed:
+                return value
+            return ".true." if value else ".false."
+        value = self._get_string(_INT64.unpack_from(self._map, position)[0])
+        if typed and len(value) > 1 and value[0] == value[-1] and value[0] in ['"', "'"]:
+            return value[1:-1]
+        return value
+
+    ################################################################################
+
+    def _find(self, order_section, id_section, count, name):
+        """ Binary search of a lookup table (order_section lists indices into
+            id_section, sorted by name); returns the index of name or None
+        """
+
+        target = name.encode("utf-8")
+        low = 0
+        high = count
+        while low < high:
+            middle = (low + high) // 2
+            index = self._get_uint32(order_section, middle)
+            candidate = self._get_string_bytes(self._get_uint32(id_section, index))
+            if candidate < target:
+                low = middle + 1
+            elif candidate > target:
+                high = middle
+            else:
+                return index
+        return None
+
+    ################################################################################
+
+    def _get_member_index(self, member):
+        if member not in self._member_index:
+            index = self._find(self._member_order, self._members, self._n_members, member)
+            if index is None:
+                raise KeyError(member)
+            self._member_index[member] = index
+        return self._member_index[member]
+
+    ################################################################################
+
+    def _get_key_index(self, key):
+        if key not in self._key_index:
+            index = self._find(self._key_order, self._keys, self._n_keys, key)
+            if index is None:
+                raise KeyError(key)
+            self._key_index[key] = index
+        return self._key_index[key]
+
+    ################################################################################
+
+    def _get_subcat_keys(self, subcategory):
+        """ Returns (first key, key count) for subcategory; subcategories are few, so
+            this is a linear search
+        """
+
+        for s in range(self._n_subcats):
+            if self._get_string(self._get_uint32(self._subcats, 3 * s)) == subcategory:
+                return self._get_uint32(self._subcats, 3 * s + 1), self._get_uint32(self._subcats, 3 * s + 2)
+        raise KeyError(subcategory)
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def write_settings_file(file_name, subcat_names, members, parms):
+    """ Write a settings file; subcat_names is the ordered list of subcategories and
+        members is a list of (member name, get_variable_names, parm_dict), where
+        get_variable_names(subcat_name) returns the parm_dict keys in subcat_name (the
+        same arguments print_parm_dict() takes for a single member). parms (a
+        dictionary returned by read_parms_file() or a MARBL_schema_class object)
+        provides the datatype of every key.
+    """
+
+    import struct
+    from MARBL_defaults import _sort, _natural_sort_key
+    from MARBL_schema import get_schema
+
+    logger = logging.getLogger(__name__)
+
+    schema = get_schema(parms)
+
+    strings = _StringTable()
+
+    # 1. Every key (from every member), grouped by subcategory
+    keys = []
+    subcats = []
+    for subcat_name in subcat_names:
+        subcat_keys = set()
+        for member_name, get_variable_names, parm_dict in members:
+            subcat_keys.update(get_variable_names(subcat_name))
+        subcats.append((strings.get_id(subcat_name), len(keys), len(subcat_keys)))
+        keys.extend(_sort(subcat_keys, sort_key=_natural_sort_key))
+    key_index = dict([(key, n) for n, key in enumerate(keys)])
+    key_ids = [strings.get_id(key) for key in keys]
+    member_ids = [strings.get_id(member_name) for member_name, get_variable_names, parm_dict in members]
+
+    # 2. Typed values, one row per member
+    n_keys = len(keys)
+    value_types = bytearray(len(members) * n_keys)
+    values = bytearray(8 * len(members) * n_keys)
+    datatypes = [_get_datatype(schema, key) for key in keys]
+    for m, (member_name, get_variable_names, parm_dict) in enumerate(members):
+        for subcat_name in subcat_names:
+            for key in get_variable_names(subcat_name):
+                n = m * n_keys + key_index[key]
+                value_type, value_format, value = _encode_value(parm_dict[key], datatypes[key_index[key]], strings)
+                value_types[n] = value_type
+                struct.pack_into(value_format, values, 8 * n, value)
+
+    # 3. Lookup tables: members and keys sorted by name
+    member_order = sorted(range(len(member_ids)), key=lambda m: strings.get_bytes(member_ids[m]))
+    key_order = sorted(range(n_keys), key=lambda n: strings.get_bytes(key_ids[n]))
+
+    # 4. Lay out the sections and write the file
+    string_offsets, string_data = strings.pack()
+    sections = [string_offsets,
+                string_data,
+                _pack_uint32(member_ids),
+                _pack_uint32(member_order),
+                struct.pack("<%dI" % (3 * len(subcats)), *[entry for subcat in subcats for entry in subcat]),
+                _pack_uint32(key_ids),
+                _pack_uint32(key_order),
+                bytes(value_types),
+                bytes(values)]
+    offsets = []
+    position = _HEADER.size
+    for section in sections:
+        position = _align(position)
+        offsets.append(position)
+        position = position + len(section)
+    header = _HEADER.pack(_MAGIC, _VERSION, strings.get_count(), len(member_ids), len(subcats), n_keys, 0,
+                          *offsets)
+    with open(file_name, "wb") as fout:
+        fout.write(header)
+        position = _HEADER.size
+        for offset, section in zip(offsets, sections):
+            fout.write(b"\0" * (offset - position))
+            fout.write(section)
+            position = offset + len(section)
+    logger.info("Wrote %d member(s) with %d keys to %s" % (len(member_ids), n_keys, file_name))
+
+################################################################################
+
+def write_settings_text(fout, Settings, member):
+    """ Write one member of a settings file (a MARBL_settings_file_class object) in the
+        format print_defaults.py uses
+    """
+
+    from MARBL_defaults import print_parm_dict
+    print_parm_dict(fout, Settings.get_subcategory_names(),
+                    lambda subcat_name: Settings.get_parm_dict_variable_names(member, subcat_name),
+                    Settings.get_parm_dict(member))
+
+################################################################################
+
+def write_settings_json(fout, Settings, members=None):
+    """ Write members (default: all of them) of a settings file as JSON:
+            {"subcategories" : {subcategory : [keys]},
+             "members" : {member : {key : value}}}
+        Integers and reals are JSON numbers, logicals are true / false, and strings are
+        written without their Fortran quotes.
+    """
+
+    import json
+    from collections import OrderedDict
+
+    if members is None:
+        members = Settings.get_member_names()
+    subcategories = OrderedDict()
+    for subcat_name in Settings.get_subcategory_names():
+        subcategories[subcat_name] = Settings.get_variable_names(subcat_name)
+    member_dicts = OrderedDict()
+    for member in members:
+        member_dicts[member] = Settings.get_parm_dict(member, typed=True)
+    json.dump(OrderedDict([("subcategories", subcategories), ("members", member_dicts)]), fout, indent=2)
+    fout.write("\n")
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+def _abort(err_code=0):
+    """ This routine imports sys and calls exit
+    """
+    import sys
+    sys.exit(err_code)
+
+################################################################################
+
+import struct
+
+_MAGIC = b"MARBLSET"
+_VERSION = 2
+# Version 2 added _TYPE_REAL_REPR and _TYPE_REAL_TEXT; version 1 files are still readable
+_READABLE_VERSIONS = (1, 2)
+
+# magic, version, n_strings, n_members, n_subcats, n_keys, (unused), and the offsets of
+# the nine sections
+_HEADER = struct.Struct("<8s6I9Q")
+_UINT8 = struct.Struct("<B")
+_UINT32 = struct.Struct("<I")
+_INT64 = struct.Struct("<q")
+_FLOAT64 = struct.Struct("<d")
+_STRING_OFFSETS = struct.Struct("<2Q")
+
+_TYPE_MISSING = 0
+_TYPE_INTEGER = 1
+_TYPE_REAL = 2
+_TYPE_LOGICAL = 3
+_TYPE_STRING = 4
+_TYPE_REAL_REPR = 5
+_TYPE_REAL_TEXT = 6
+
+# Must match the format _get_var_value() in MARBL_defaults.py uses for reals
+_REAL_FORMAT = "%20.15e"
+
+################################################################################
+
+def _align(position):
+    return (position + 7) // 8 * 8
+
+################################################################################
+
+def _pack_uint32(values):
+    return struct.pack("<%dI" % len(values), *values)
+
+################################################################################
+
+def _get_datatype(schema, parm_key):
+    """ Datatype of a parm_dict key, from the YAML variable (or derived type
+        component); None if the key is not in the schema
+    """
+
+    from MARBL_defaults import _parse_parm_key
+
+    parsed_key = _parse_parm_key(parm_key)
+    if parsed_key is None or parsed_key[0] not in schema.variables:
+        return None
+    var_spec = schema.variables[parsed_key[0]]
+    if parsed_key[2] is not None:
+        if var_spec.derived_type is None or parsed_key[2] not in var_spec.derived_type.component_index:
+            return None
+        var_spec = var_spec.derived_type.component_index[parsed_key[2]]
+    return var_spec.datatype
+
+################################################################################
+
+def _parse_real(text):
+    """ Convert a Fortran real literal (which may use d as the exponent) to a float;
+        raises ValueError if that is not possible
+    """
+
+    return float(text.strip().replace('d', 'e').replace('D', 'e'))
+
+################################################################################
+
+def _encode_value(value, datatype, strings):
+    """ Return (type code, struct format, value to pack) for a parm_dict value of the
+        given datatype; values that are not valid for their datatype are stored as
+        strings
+    """
+
+    if isinstance(value, bool):
+        return _TYPE_LOGICAL, "<q", int(value)
+    text = value if isinstance(value, str) else "%s" % (value,)
+    if datatype == "integer":
+        if isinstance(value, int) and -2**63 <= value < 2**63:
+            return _TYPE_INTEGER, "<q", value
+        try:
+            int_value = int(text)
+        except ValueError:
+            int_value = None
+        if int_value is not None and "%d" % int_value == text and -2**63 <= int_value < 2**63:
+            return _TYPE_INTEGER, "<q", int_value
+    elif datatype == "logical":
+        if text in [".true.", ".false."]:
+            return _TYPE_LOGICAL, "<q", int(text == ".true.")
+    elif datatype == "real":
+        try:
+            real_value = _parse_real(text)
+        except ValueError:
+            real_value = None
+        if real_value is not None:
+            if _REAL_FORMAT % real_value == text:
+                return _TYPE_REAL, "<d", real_value
+            if repr(real_value) == text:
+                return _TYPE_REAL_REPR, "<d", real_value
+            return _TYPE_REAL_TEXT, "<q", strings.get_id(text)
+    return _TYPE_STRING, "<q", strings.get_id(text)
+
+################################################################################
+
+class _StringTable(object):
+    """ Strings used in a settings file; each distinct string is stored once
+    """
+
+    def __init__(self):
+        self._ids = dict()
+        self._strings = []
+
+    def get_id(self, string):
+        if string not in self._ids:
+            self._ids[string] = len(self._strings)
+            self._strings.append(string.encode("utf-8"))
+        return self._ids[string]
+
+    def get_bytes(self, string_id):
+        return self._strings[string_id]
+
+    def get_count(self):
+        return len(self._strings)
+
+    def pack(self):
+        """ Returns (string offsets section, string data section)
+        """
+        offsets = [0]
+        for string in self._strings:
+            offsets.append(offsets[-1] + len(string))
+        return struct.pack("<%dQ" % len(offsets), *offsets), b"".join(self._strings)
@@ -0,0 +1,447 @@
+""" Read the settings MARBL writes to its status log, and audit runs against them.
+
+    finalize_vars() (marbl_settings_mod) writes every setting to the status log after
+    a "Tunable Parameters" header:
+
+        (prefix)------------------
+        (prefix)Tunable Parameters
+        (prefix)------------------
+        (prefix)
+        (prefix)PFT_defaults = 'CESM2'
+        (prefix)parm_Fe_bioavail =   0.1000000000000000E+01
+        ...
+
+    where (prefix) is whatever the driver puts in front of each MARBL message (it is
+    taken from the header line). The block ends at the next header (a line of dashes)
+    or at the first line that is not a setting, a comment or blank. Lines that do not
+    start with the prefix (output from other components, interleaved with MARBL's) are
+    skipped.
+
+    Logs are usually large and the block is a small part of them, so plain files are
+    memory-mapped and searched for the header without reading them line by line;
+    compressed (.gz) logs are decompressed a chunk at a time and each chunk is searched
+    the same way. A log may hold more than one block (e.g. one per MARBL instance);
+    every block is read.
+
+    Values are compared by type, not by text: strings without quotes (and trailing
+    blanks, which Fortran trims), logicals, and numbers (integers and reals, with a
+    relative tolerance, since the log only has 16 significant digits).
+
+    This file also contains several subroutines that are not part of the class but are
+    called by member functions in the class.
+"""
+
+import logging
+import zlib
+
+class MARBL_log_audit_class(object):
+    """ This class compares the settings in many status logs with the settings they
+        were expected to use (e.g. the output of print_defaults.py for each run's input
+        file). Logs are read and compared in a process pool; only the differences are
+        sent back.
+    """
+
+    ###############
+    # CONSTRUCTOR #
+    ###############
+
+    def __init__(self, log_files, expected, members=None, nprocs=None, rtol=None):
+        """ Class constructor: read every log in log_files and compare it with expected,
+            an (ordered) dictionary of member -> parm_dict. members is a list with one
+            member per log file (default: expected must have a single member, which
+            every log is compared with).
+
+            nprocs is the size of the process pool (default: one process per CPU);
+            nprocs = 1 reads the logs serially in this process. rtol is the relative
+            tolerance for numbers (default is _DEFAULT_RTOL).
+        """
+
+        from collections import OrderedDict
+
+        logger = logging.getLogger(__name__)
+
+        self._log_files = list(log_files)
+        if members is None:
+            if len(expected) != 1:
+                logger.error("Specify the member each log is compared with (%d expected configurations)" %
+                             len(expected))
+                _abort(1)
+            members = list(expected.keys()) * len(self._log_files)
+        if len(members) != len(self._log_files):
+            logger.error("Got %d members for %d log files" % (len(members), len(self._log_files)))
+            _abort(1)
+        unknown_members = sorted(set(members) - set(expected.keys()))
+        if unknown_members:
+            logger.error("No expected settings for %s" % ", ".join([str(member) for member in unknown_members]))
+            _abort(1)
+        self._members = OrderedDict(zip(self._log_files, members))
+
+        # Normalize each expected configuration once, not once per log
+        expected_settings = dict([(member, _normalize_settings(list(expected[member].items())))
+                                  for member in set(members)])
+
+        self._results = OrderedDict()
+        tasks = [(log_file, self._members[log_file]) for log_file in self._log_files]
+        for log_file, result in _audit_logs(expected_settings, _DEFAULT_RTOL if rtol is None else rtol,
+                                            tasks, nprocs):
+            self._results[log_file] = result
+
+    ################################################################################
+    #                             PUBLIC CLASS METHODS                             #
+    ################################################################################
+
+    def get_log_files(self):
+        """ Returns the log files, in the order they were given
+        """
+
+        return self._log_files
+
+    ################################################################################
+
+    def get_member(self, log_file):
+        """ Returns the member of the expected settings a log was compared with
+        """
+
+        return self._members[log_file]
+
+    ################################################################################
+
+    def get_status(self, log_file):
+        """ Returns one of
+                "ok"          : every block matches the expected settings
+                "mismatch"    : at least one setting differs, is missing, or is extra
+                "no settings" : the log has no Tunable Parameters block
+                "unreadable"  : the log could not be read
+        """
+
+        return self._results[log_file][0]
+
+    ################################################################################
+
+    def get_block_cnt(self, log_file):
+        """ Returns the number of Tunable Parameters blocks in a log
+        """
+
+        return self._results[log_file][1]
+
+    ################################################################################
+
+    def get_setting_cnt(self, log_file):
+        """ Returns the number of settings read from a log (summed over its blocks)
+        """
+
+        return self._results[log_file][2]
+
+    ################################################################################
+
+    def get_mismatches(self, log_file):
+        """ Returns a list of (block, key, expected value, logged value) for every setting
+            that differs, in the order of the log; block is 1-based, and the expected
+            (logged) value is None for settings that are only in the log (expected
+            settings)
+        """
+
+        return self._results[log_file][3]
+
+    ################################################################################
+
+    def get_failed_log_files(self):
+        """ Returns the log files whose status is not "ok"
+        """
+
+        return [log_file for log_file in self._log_files if self.get_status(log_file) != "ok"]
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def read_status_log(log_file):
+    """ Return a list with one ordered dictionary of key -> value per Tunable Parameters
+        block in log_file. Keys and values use the parm_dict conventions (strings in
+        double quotes), so blocks can be used anywhere a parm_dict can; reals keep the
+        log's formatting. Aborts if the log can not be read.
+    """
+
+    from collections import OrderedDict
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        blocks = list(_iter_log_blocks(log_file))
+    except _READ_ERRORS as err:
+        logger.error("Can not read %s: %s" % (log_file, err))
+        _abort(1)
+    return [OrderedDict([(key, _to_parm_dict_value(value)) for key, value in block]) for block in blocks]
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+def _abort(err_code=0):
+    """ This routine imports sys and calls exit
+    """
+    import sys
+    sys.exit(err_code)
+
+################################################################################
+
+_HEADER = b"Tunable Parameters"
+
+# E24.16 has 16 significant digits
+_DEFAULT_RTOL = 1e-15
+
+# Logs are sent to workers in chunks; each one is small compared to the cost of reading it
+_LOG_CHUNKSIZE = 8
+
+# Compressed logs are decompressed this many bytes at a time
+_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Errors reading a log: missing or unreadable files, and truncated (EOFError) or
+# corrupt (zlib.error) .gz files
+_READ_ERRORS = (IOError, OSError, EOFError, zlib.error)
+
+################################################################################
+
+def _iter_log_blocks(log_file):
+    """ Generator that yields a list of (key, value as logged) for each Tunable Parameters
+        block in log_file
+    """
+
+    import gzip
+    import mmap
+    import os
+
+    if log_file.endswith(".gz"):
+        # Decompress in chunks and search each chunk for the header; only the lines
+        # of the blocks are split
+        with gzip.open(log_file, "rb") as fin:
+            data = b""
+            while True:
+                chunk = fin.read(_CHUNK_SIZE)
+                data = data + chunk
+                pos = data.find(_HEADER)
+                if pos < 0:
+                    if not chunk:
+                        return
+                    # Keep the last (partial) line, it may hold part of the header
+                    data = data[data.rfind(b"\n") + 1:]
+                    continue
+                lines = _LogLines(data, data.rfind(b"\n", 0, pos) + 1, fin)
+                yield _read_block(next(lines), lines)
+                data = lines.data[lines.pos:]
+        return
+
+    with open(log_file, "rb") as fin:
+        if os.fstat(fin.fileno()).st_size == 0:
+            return
+        log_map = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = log_map.find(_HEADER)
+            while pos >= 0:
+                lines = _LogLines(log_map, log_map.rfind(b"\n", 0, pos) + 1)
+                yield _read_block(next(lines), lines)
+                pos = log_map.find(_HEADER, lines.pos)
+        finally:
+            log_map.close()
+
+################################################################################
+
+class _LogLines(object):
+    """ Iterator over the lines of data (bytes or a memory-mapped file), starting at
+        offset pos; pos is the offset of the next line. If fin is not None, data is the
+        part of fin read so far, and more is read from fin as needed.
+    """
+
+    def __init__(self, data, pos, fin=None):
+        self.data = data
+        self.pos = pos
+        self._fin = fin
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        end = self.data.find(b"\n", self.pos)
+        while end < 0 and self._fin is not None:
+            chunk = self._fin.read(_CHUNK_SIZE)
+            if not chunk:
+                self._fin = None
+                break
+            self.data = self.data[self.pos:] + chunk
+            self.pos = 0
+            end = self.data.find(b"\n")
+        if self.pos >= len(self.data):
+            raise StopIteration
+        if end < 0:
+            end = len(self.data)
+        line = self.data[self.pos:end]
+        self.pos = end + 1
+        return line
+
+    next = __next__
+
+################################################################################
+
+def _read_block(header_line, lines):
+    """ Read the settings that follow header_line (the line with the Tunable Parameters
+        header) from lines; returns a list of (key, value as logged). Consumes the line
+        that ends the block.
+    """
+
+    from MARBL_defaults import _tokenize_input_line
+
+    header_line = header_line.decode("utf-8", "replace").rstrip()
+    prefix = header_line[:header_line.index(_HEADER.decode("utf-8"))]
+    blank_line = prefix.rstrip()
+    settings = []
+    in_header = True
+    for line in lines:
+        line = line.decode("utf-8", "replace").rstrip()
+        if line == blank_line:
+            continue
+        if not line.startswith(prefix):
+            # Interleaved output from something other than MARBL
+            continue
+        line = line[len(prefix):]
+        if line.strip("-") == "":
+            # Dashes under the header, or the start of the next header
+            if in_header:
+                in_header = False
+                continue
+            break
+        in_header = False
+        try:
+            parsed_line = _tokenize_input_line(line)
+        except ValueError:
+            break
+        if parsed_line is not None:
+            settings.append((parsed_line[0], ", ".join(parsed_line[1])))
+    return settings
+
+################################################################################
+
+def _to_parm_dict_value(value):
+    """ parm_dict strings are in double quotes; the log uses single quotes
+    """
+
+    if len(value) > 1 and value[0] == value[-1] == "'":
+        return '"%s"' % value[1:-1].replace("''", "'")
+    return value
+
+################################################################################
+
+def _normalize(value):
+    """ Convert a logged or parm_dict value to something that can be compared:
+            (0, string without quotes or trailing blanks)
+            (1, True / False) for logicals
+            (2, float) for integers and reals
+        Values that are none of these are compared as they are (0, value).
+    """
+
+    if not isinstance(value, str):
+        if isinstance(value, bool):
+            return (1, value)
+        if isinstance(value, (int, float)):
+            return (2, float(value))
+        value = str(value)
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in ['"', "'"]:
+        return (0, value[1:-1].replace(value[0]*2, value[0]).rstrip())
+    lower_value = value.lower()
+    if lower_value in [".true.", ".false."]:
+        return (1, lower_value == ".true.")
+    try:
+        return (2, float(lower_value.replace('d', 'e')))
+    except ValueError:
+        return (0, value)
+
+################################################################################
+
+def _normalize_settings(settings):
+    """ Dictionary of lower-case key (Fortran names are not case sensitive) ->
+        (key, value, normalized value) for a list of (key, value)
+    """
+
+    return dict([(key.lower(), (key, value, _normalize(value))) for key, value in settings])
+
+################################################################################
+
+def _same_value(expected, logged, rtol):
+    """ True if two normalized values are equal (numbers within rtol)
+    """
+
+    if expected[0] != logged[0]:
+        return False
+    if expected[0] != 2:
+        return expected[1] == logged[1]
+    return abs(expected[1] - logged[1]) <= rtol * max(abs(expected[1]), abs(logged[1]))
+
+################################################################################
+
+_worker_expected = None
+_worker_rtol = None
+
+def _init_audit_worker(expected_settings, rtol):
+    """ Pool initializer: store the normalized expected settings in the worker process
+    """
+    global _worker_expected, _worker_rtol
+    _worker_expected = expected_settings
+    _worker_rtol = rtol
+
+################################################################################
+
+def _audit_log(task):
+    """ Compare one log with its member's expected settings; task is (log file, member).
+        Returns (log file, (status, block count, setting count, mismatches)), see
+        MARBL_log_audit_class.
+    """
+
+    log_file, member = task
+    expected = _worker_expected[member]
+    try:
+        blocks = list(_iter_log_blocks(log_file))
+    except _READ_ERRORS:
+        return log_file, ("unreadable", 0, 0, [])
+    if not blocks:
+        return log_file, ("no settings", 0, 0, [])
+
+    mismatches = []
+    setting_cnt = 0
+    for block_ind, block in enumerate(blocks, 1):
+        setting_cnt = setting_cnt + len(block)
+        logged = _normalize_settings(block)
+        for lower_key, (key, value, normalized_value) in logged.items():
+            if lower_key not in expected:
+                mismatches.append((block_ind, key, None, value))
+            elif not _same_value(expected[lower_key][2], normalized_value, _worker_rtol):
+                mismatches.append((block_ind, key, expected[lower_key][1], value))
+        for lower_key, (key, value, normalized_value) in expected.items():
+            if lower_key not in logged:
+                mismatches.append((block_ind, key, value, None))
+    return log_file, ("mismatch" if mismatches else "ok", len(blocks), setting_cnt, mismatches)
+
+################################################################################
+
+def _audit_logs(expected_settings, rtol, tasks, nprocs):
+    """ Generator that yields _audit_log(task) for each (log file, member) in tasks, in
+        order. Uses a multiprocessing pool unless nprocs is 1.
+    """
+    import multiprocessing
+
+    if nprocs is None:
+        nprocs = multiprocessing.cpu_count()
+
+    if nprocs <= 1 or len(tasks) <= 1:
+        _init_audit_worker(expected_settings, rtol)
+        for task in tasks:
+            yield _audit_log(task)
+        return
+
+    pool = multiprocessing.Pool(min(nprocs, len(tasks)), initializer=_init_audit_worker,
+                                initargs=(expected_settings, rtol))
+    try:
+        for result in pool.imap(_audit_log, tasks, _LOG_CHUNKSIZE):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
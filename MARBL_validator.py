@@ -0,0 +1,307 @@
+import logging
+
+class MARBL_validator_class(object):
+    """ This class checks resolved parameter values against the schema in the YAML file:
+        * datatype: values must be valid Fortran literals of the declared type
+        * valid_values: strings (and numbers) must be one of the listed values
+        * valid_range: [min, max] bounds (inclusive; ~ for no bound) for integers and reals
+        * constraints: named constraints for integers and reals (see _CONSTRAINTS),
+          e.g. "non-negative"
+
+        The checks for each YAML variable (and each component of a derived type) are
+        compiled once, when the object is created. Values are checked one column at a
+        time: every distinct value of a parm_dict key (across all ensemble members) is
+        checked once, and every violation is reported, not just the first.
+
+        This file also contains several subroutines that are not part of the class but are
+        called by member functions in the class.
+    """
+
+    ###############
+    # CONSTRUCTOR #
+    ###############
+
+    def __init__(self, parms):
+        """ Class constructor: compile the checks for every variable in parms (a dictionary
+            returned by read_parms_file()); aborts if a valid_range or constraints entry
+            in the YAML can not be understood
+        """
+
+        logger = logging.getLogger(__name__)
+
+        self._rules = dict()
+        self._key_rules = dict()
+        invalid_schema = False
+        for cat_name in parms['_order']:
+            for var_name, var_dict in parms[cat_name].items():
+                if isinstance(var_dict['datatype'], dict):
+                    for comp_name, comp_dict in var_dict['datatype'].items():
+                        if comp_name[0] != '_':
+                            rule = _compile_rule("%s%%%s" % (var_name, comp_name), comp_dict)
+                            invalid_schema = invalid_schema or rule is None
+                            self._rules[(var_name, comp_name)] = rule
+                else:
+                    rule = _compile_rule(var_name, var_dict)
+                    invalid_schema = invalid_schema or rule is None
+                    self._rules[(var_name, None)] = rule
+        if invalid_schema:
+            logger.error("Can not build validator from YAML file")
+            _abort(1)
+
+    ################################################################################
+    #                             PUBLIC CLASS METHODS                             #
+    ################################################################################
+
+    def validate_parm_dict(self, parm_dict, sources=None):
+        """ Check every value in parm_dict; returns a list of violations, each a tuple
+            (parm_dict key, value, message, source), where source is sources[key] (the
+            input file line the value came from) or None for default values
+        """
+
+        return [(parm_key, value, message, source) for (member, parm_key, value, message, source) in
+                self.validate_ensemble({None : parm_dict}, {None : sources})]
+
+    ################################################################################
+
+    def validate_ensemble(self, parm_dicts, sources=None):
+        """ Check every value for every member; parm_dicts is an (ordered) dictionary of
+            member -> parm_dict, and sources (optional) is a dictionary of member ->
+            {parm_dict key : source}. Returns a list of violations, each a tuple
+            (member, parm_dict key, value, message, source), ordered by member and then
+            by the order of keys in that member's parm_dict.
+        """
+
+        from collections import OrderedDict
+
+        if sources is None:
+            sources = dict()
+
+        # 1. Gather each column: parm_dict key -> {value : [members]}
+        columns = OrderedDict()
+        for member, parm_dict in parm_dicts.items():
+            for parm_key, value in parm_dict.items():
+                columns.setdefault(parm_key, OrderedDict()).setdefault(_hashable(value), []).append(member)
+
+        # 2. Check each distinct value in each column once
+        bad_values = dict()
+        for parm_key, column in columns.items():
+            rule = self._get_rule(parm_key)
+            if rule is None:
+                continue
+            for value in column.keys():
+                message = rule.check(value)
+                if message is not None:
+                    for member in column[value]:
+                        bad_values[(member, parm_key)] = (value, message)
+
+        # 3. Report them in member / parm_dict order
+        violations = []
+        if not bad_values:
+            return violations
+        for member, parm_dict in parm_dicts.items():
+            member_sources = sources.get(member) or dict()
+            for parm_key in parm_dict.keys():
+                if (member, parm_key) in bad_values:
+                    value, message = bad_values[(member, parm_key)]
+                    violations.append((member, parm_key, value, message, member_sources.get(parm_key)))
+        return violations
+
+    ################################################################################
+
+    def log_violations(self, violations):
+        """ Log every violation (from validate_parm_dict() or validate_ensemble()) as a
+            single error message; returns True if there were any
+        """
+
+        return log_violations(violations)
+
+    ################################################################################
+    #                            PRIVATE CLASS METHODS                             #
+    ################################################################################
+
+    def _get_rule(self, parm_key):
+        """ Return the compiled rule for a parm_dict key (None if the key is not in the
+            schema); rules are looked up by (variable, component) and remembered by key
+        """
+
+        try:
+            return self._key_rules[parm_key]
+        except KeyError:
+            pass
+        from MARBL_defaults import _parse_parm_key
+        parsed_key = _parse_parm_key(parm_key)
+        rule = None
+        if parsed_key is not None:
+            rule = self._rules.get((parsed_key[0], parsed_key[2]))
+        self._key_rules[parm_key] = rule
+        return rule
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def log_violations(violations):
+    """ Log every violation (from validate_parm_dict() or validate_ensemble()) as a
+        single error message; returns True if there were any. This does not need a
+        validator, so results checked earlier (e.g. read from MARBL_result_cache) can
+        be reported without reading the YAML file.
+    """
+
+    if not violations:
+        return False
+    logger = logging.getLogger(__name__)
+    message = "Found %d invalid value(s):" % len(violations)
+    for violation in violations:
+        if len(violation) == 5 and violation[0] is not None:
+            message = message + "\n     * [%s] " % violation[0]
+        else:
+            message = message + "\n     * "
+        parm_key, value, reason, source = violation[-4:]
+        message = message + "%s = %s: %s" % (parm_key, value, reason)
+        message = message + (" (%s)" % source if source is not None else " (default value)")
+    logger.error(message)
+    return True
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+def _abort(err_code=0):
+    """ This routine imports sys and calls exit
+    """
+    import sys
+    sys.exit(err_code)
+
+################################################################################
+
+# Named constraints: name -> (test on the value as a float, description)
+_CONSTRAINTS = {
+    "non-negative" : (lambda value: value >= 0, "must be non-negative"),
+    "positive" : (lambda value: value > 0, "must be positive"),
+    "non-zero" : (lambda value: value != 0, "must be non-zero"),
+}
+
+################################################################################
+
+def _hashable(value):
+    """ parm_dict values are scalars, but guard against lists (e.g. from a YAML list
+        that was not expanded) so they can be used as dictionary keys
+    """
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+################################################################################
+
+def _compile_rule(var_name, var_dict):
+    """ Return a _Rule for var_dict, or None (after logging the problem) if its
+        valid_range or constraints can not be used
+    """
+
+    logger = logging.getLogger(__name__)
+
+    datatype = var_dict['datatype']
+    numeric = datatype in ["integer", "real"]
+    for key in ["valid_range", "constraints"]:
+        if key in var_dict.keys() and not numeric:
+            logger.error("%s: %s is only allowed for integers and reals" % (var_name, key))
+            return None
+
+    bounds = (None, None)
+    if "valid_range" in var_dict.keys():
+        valid_range = var_dict["valid_range"]
+        try:
+            if len(valid_range) != 2:
+                raise ValueError
+            bounds = tuple([None if bound is None else _to_number(bound, datatype) for bound in valid_range])
+        except (TypeError, ValueError):
+            logger.error("%s: valid_range must be a list [min, max] (~ for no bound)" % var_name)
+            return None
+
+    constraints = []
+    for name in var_dict.get("constraints", []):
+        if name not in _CONSTRAINTS:
+            logger.error("%s: unknown constraint '%s' (known constraints: %s)" %
+                         (var_name, name, ", ".join(sorted(_CONSTRAINTS.keys()))))
+            return None
+        constraints.append(_CONSTRAINTS[name])
+
+    valid_values = None
+    if "valid_values" in var_dict.keys():
+        try:
+            valid_values = set([_normalize(value, datatype) for value in var_dict["valid_values"]])
+        except ValueError:
+            logger.error("%s: valid_values must all be of type %s" % (var_name, datatype))
+            return None
+
+    return _Rule(datatype, valid_values, bounds, constraints)
+
+################################################################################
+
+def _to_number(value, datatype):
+    """ Convert an integer or real value (or Fortran literal) to int / float;
+        raises ValueError if that is not possible
+    """
+
+    if isinstance(value, bool):
+        raise ValueError
+    if datatype == "integer":
+        if isinstance(value, float):
+            raise ValueError
+        return int(value)
+    if isinstance(value, str):
+        return float(value.strip().replace('d', 'e').replace('D', 'e'))
+    return float(value)
+
+################################################################################
+
+def _normalize(value, datatype):
+    """ Convert a parm_dict (or YAML) value to a python value that can be compared with
+        valid_values: strings without quotes, lower-case logicals, ints, and floats.
+        Raises ValueError if value is not of the given datatype.
+    """
+
+    if datatype == "string":
+        if not isinstance(value, str):
+            raise ValueError
+        if len(value) > 1 and value[0] == value[-1] and value[0] in ['"', "'"]:
+            return value[1:-1]
+        return value
+    if datatype == "logical":
+        if isinstance(value, str) and value.strip().lower() in [".true.", ".false."]:
+            return value.strip().lower()
+        raise ValueError
+    return _to_number(value, datatype)
+
+################################################################################
+
+class _Rule(object):
+    """ Checks for one YAML variable (or derived type component)
+    """
+
+    def __init__(self, datatype, valid_values, bounds, constraints):
+        self._datatype = datatype
+        self._valid_values = valid_values
+        self._bounds = bounds
+        self._constraints = constraints
+
+    def check(self, value):
+        """ Return None if value is valid, otherwise a description of the problem
+        """
+
+        try:
+            normalized = _normalize(value, self._datatype)
+        except (TypeError, ValueError):
+            return "not a valid %s" % self._datatype
+        if self._valid_values is not None and normalized not in self._valid_values:
+            return "not one of the valid values (%s)" % ", ".join([str(valid_value) for valid_value in
+                                                                   sorted(self._valid_values)])
+        min_value, max_value = self._bounds
+        if min_value is not None and normalized < min_value:
+            return "less than the minimum value (%s)" % min_value
+        if max_value is not None and normalized > max_value:
+            return "greater than the maximum value (%s)" % max_value
+        for test, description in self._constraints:
+            if not test(normalized):
+                return description
+        return None
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# This script checks the settings MARBL wrote to the status logs of many runs (the
+# "Tunable Parameters" block from finalize_vars) against the settings print_defaults.py
+# says each run should have used. Every log can be compared with one configuration
+# (--input_file), or each log with its own input file (--manifest). Differences are
+# written as a tab-separated table; the exit status is 1 if any log does not match.
+
+################################
+# Parse command line arguments #
+################################
+
+import argparse
+
+parser = argparse.ArgumentParser(description="Compare settings in MARBL status logs with the expected settings")
+
+# Command line argument to point to YAML file (default is parameters.yaml)
+parser.add_argument('-y', '--yaml_file', action='store', dest='yaml_file', default='parameters.yaml',
+                    help='Location of YAML-formatted MARBL configuration file')
+
+# Command line argument to specify resolution (default is CESM_x1)
+parser.add_argument('-g', '--grid', action='store', dest='grid', default='CESM_x1',
+                    help='Some default values are grid-dependent')
+
+# Command line arguments for the expected settings of each log
+parser.add_argument('-i', '--input_file', action='store', dest='input_file', default=None,
+                    help='Input file every log is compared with (default is no input file)')
+parser.add_argument('-m', '--manifest', action='store', dest='manifest', default=None,
+                    help='File with one "log_file [input_file]" pair per line, instead of LOG_FILE arguments')
+
+# Command line argument to specify number of processes to use
+parser.add_argument('-n', '--nprocs', action='store', dest='nprocs', default=None, type=int,
+                    help='Number of processes to use (default is one per CPU)')
+
+# Command line argument for the tolerance used to compare numbers
+parser.add_argument('--rtol', action='store', dest='rtol', default=None, type=float,
+                    help='Relative tolerance for numbers (default is 1e-15; the log has 16 significant digits)')
+
+# Path to directory containing MARBL_status_log.py
+parser.add_argument('-l', '--lib_dir', action='store', dest='lib_dir', default='./',
+                    help='Directory that contains MARBL_status_log.py')
+
+# Status logs (with --input_file or neither option)
+parser.add_argument('log_files', nargs='*', metavar='LOG_FILE',
+                    help='Status log (plain text or .gz)')
+args = parser.parse_args()
+
+if args.manifest is not None and (args.input_file is not None or args.log_files):
+    parser.error("Can not specify --manifest with --input_file or LOG_FILE arguments")
+if args.manifest is None and not args.log_files:
+    parser.error("Specify LOG_FILE arguments or --manifest")
+
+##################
+# Set up logging #
+##################
+
+import logging
+logging.basicConfig(format='%(levelname)s (%(funcName)s): %(message)s', level=logging.DEBUG)
+
+#############
+# FUNCTIONS #
+#############
+
+def read_manifest(manifest):
+    """ Return lists of log files and input files (None if a line has no input file)
+        from a manifest; blank lines and lines starting with # are ignored
+    """
+    log_files = []
+    input_files = []
+    with open(manifest, "r") as fin:
+        for line_num, line in enumerate(fin, 1):
+            fields = line.split()
+            if not fields or fields[0][0] == '#':
+                continue
+            if len(fields) > 2:
+                logging.error("%s:%d: expecting 'log_file [input_file]'" % (manifest, line_num))
+                exit(1)
+            log_files.append(fields[0])
+            input_files.append(fields[1] if len(fields) == 2 else None)
+    return log_files, input_files
+
+def get_expected_settings(input_files):
+    """ Resolve each distinct input file once; returns an ordered dictionary of input file
+        (None for the defaults) -> parm_dict
+    """
+    from collections import OrderedDict
+    from MARBL_defaults import MARBL_defaults_class, read_parms_file
+    from MARBL_ensemble import MARBL_ensemble_class
+    parms = read_parms_file(args.yaml_file)
+    expected = OrderedDict()
+    if None in input_files:
+        expected[None] = MARBL_defaults_class(args.yaml_file, args.grid, None, parms=parms).parm_dict
+    members = sorted(set([input_file for input_file in input_files if input_file is not None]))
+    if members:
+        Ensemble = MARBL_ensemble_class(args.yaml_file, args.grid, members, args.nprocs, parms)
+        for member in members:
+            expected[member] = Ensemble.get_parm_dict(member)
+    return expected
+
+def print_audit_report(fout, Audit):
+    """ Write two tab-separated tables:
+        1. one row per setting that differs: log file, block, varname, expected and
+           logged values (blank if the setting is only in the log / expected settings)
+        2. one row per log file: status, number of blocks, settings and mismatches
+    """
+    fout.write("\t".join(["log_file", "block", "varname", "expected", "logged"]) + "\n")
+    for log_file in Audit.get_log_files():
+        for block, varname, expected, logged in Audit.get_mismatches(log_file):
+            fout.write("\t".join([log_file, str(block), varname, "" if expected is None else str(expected),
+                                  "" if logged is None else str(logged)]) + "\n")
+    fout.write("\n")
+    fout.write("\t".join(["log_file", "status", "blocks", "settings", "mismatches"]) + "\n")
+    for log_file in Audit.get_log_files():
+        fout.write("\t".join([log_file, Audit.get_status(log_file), str(Audit.get_block_cnt(log_file)),
+                              str(Audit.get_setting_cnt(log_file)),
+                              str(len(Audit.get_mismatches(log_file)))]) + "\n")
+
+################
+# BEGIN SCRIPT #
+################
+
+from sys import path as sys_path, stdout, exit
+sys_path.insert(0, args.lib_dir)
+from MARBL_status_log import MARBL_log_audit_class
+
+if args.manifest is not None:
+    log_files, input_files = read_manifest(args.manifest)
+else:
+    log_files = args.log_files
+    input_files = [args.input_file] * len(log_files)
+
+expected = get_expected_settings(input_files)
+Audit = MARBL_log_audit_class(log_files, expected, input_files, args.nprocs, args.rtol)
+print_audit_report(stdout, Audit)
+
+failed_log_files = Audit.get_failed_log_files()
+logging.info("Audited %d log(s): %d match the expected settings" %
+             (len(log_files), len(log_files) - len(failed_log_files)))
+if failed_log_files:
+    exit(1)
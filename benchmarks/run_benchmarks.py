@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+# This script measures how the python tools scale as the parameter file grows. For
+# every scale factor it writes a synthetic parameter file and input file (see
+# synthetic_parms.py) and times each phase separately:
+#
+#   load     -- parse the YAML file
+#   validate -- check it against the MARBL parameter file schema
+#   parse    -- read the input file
+#   resolve  -- construct MARBL_defaults_class (compute every parm_dict value)
+#   print    -- write parm_dict by subcategory, as print_defaults.py does
+#   codegen  -- run gen_code.py (in a separate process)
+#
+# Results (the fastest of --repeat runs of each phase, plus the log-log slope of time
+# against the number of parm_dict keys between consecutive scales) are written as JSON.
+# With --baseline, phases that are more than --tolerance slower than in a stored
+# result file are reported and the script exits with status 1.
+
+################################
+# Parse command line arguments #
+################################
+
+import argparse
+from os import path
+
+parser = argparse.ArgumentParser(description="Time MARBL python tools on synthetic parameter files")
+
+# Path to directory containing MARBL_defaults.py and gen_code.py
+parser.add_argument('-l', '--lib_dir', action='store', dest='lib_dir',
+                    default=path.dirname(path.dirname(path.abspath(__file__))),
+                    help='Directory that contains MARBL_defaults.py')
+
+# Parameter file to add synthetic variables to (default is parameters.yaml in lib_dir)
+parser.add_argument('-y', '--yaml_file', action='store', dest='yaml_file', default=None,
+                    help='Location of YAML-formatted MARBL configuration file')
+
+# Scale factors: every size below is multiplied by each of these
+parser.add_argument('-s', '--scales', action='store', dest='scales', default='1,2,4,8',
+                    help='Comma-separated list of scale factors')
+parser.add_argument('--nvars', action='store', dest='nvars', default=50, type=int,
+                    help='Synthetic variables in general_parms at scale 1')
+parser.add_argument('--array_size', action='store', dest='array_size', default=4, type=int,
+                    help='Length of synthetic arrays at scale 1')
+parser.add_argument('--autotroph_cnt', action='store', dest='autotroph_cnt', default=3, type=int,
+                    help='Number of autotrophs (and grazer prey) at scale 1')
+parser.add_argument('--zooplankton_cnt', action='store', dest='zooplankton_cnt', default=1, type=int,
+                    help='Number of zooplankton at scale 1')
+parser.add_argument('--default_keys', action='store', dest='default_keys', default=2, type=int,
+                    help='Keys in synthetic default_value dictionaries at scale 1')
+parser.add_argument('--input_lines', action='store', dest='input_lines', default=50, type=int,
+                    help='Lines in the synthetic input file at scale 1')
+
+# Timing and output
+parser.add_argument('-r', '--repeat', action='store', dest='repeat', default=3, type=int,
+                    help='Number of times to run each phase (the fastest run is reported)')
+parser.add_argument('--no_codegen', action='store_false', dest='codegen',
+                    help='Do not time gen_code.py')
+parser.add_argument('-o', '--output', action='store', dest='output', default=None,
+                    help='Write results to this JSON file (default is stdout)')
+parser.add_argument('-b', '--baseline', action='store', dest='baseline', default=None,
+                    help='JSON file from an earlier run to compare against')
+parser.add_argument('-t', '--tolerance', action='store', dest='tolerance', default=0.25, type=float,
+                    help='Report phases that are more than this fraction slower than the baseline')
+args = parser.parse_args()
+
+if args.yaml_file is None:
+    args.yaml_file = path.join(args.lib_dir, 'parameters.yaml')
+
+##################
+# Set up logging #
+##################
+
+import logging
+logging.basicConfig(format='%(levelname)s (%(funcName)s): %(message)s', level=logging.INFO)
+# Only report problems from the modules being timed
+logging.getLogger("MARBL_defaults").setLevel(logging.WARNING)
+logging.getLogger("MARBL_expression").setLevel(logging.WARNING)
+
+#############
+# FUNCTIONS #
+#############
+
+# Phases in the order they are run
+phases = ["load", "validate", "parse", "resolve", "print", "codegen"]
+
+# Slopes above this (time grows faster than keys^slope) are flagged as superlinear
+superlinear_slope = 1.3
+
+# Phases faster than this (in seconds) are too noisy to compare
+min_time = 1.0e-3
+
+def best_time(func, repeat):
+    """ Return (fastest time in seconds, return value of func) over repeat calls to func
+    """
+    from timeit import default_timer
+    times = []
+    for n in range(repeat):
+        start = default_timer()
+        result = func()
+        times.append(default_timer() - start)
+    return min(times), result
+
+def get_sizes(scale):
+    """ Arguments to make_synthetic_parms() (and number of input file lines) for a scale factor
+    """
+    sizes = dict()
+    sizes["nvars"] = args.nvars * scale
+    sizes["array_size"] = args.array_size * scale
+    sizes["autotroph_cnt"] = args.autotroph_cnt * scale
+    sizes["zooplankton_cnt"] = args.zooplankton_cnt * scale
+    sizes["default_keys"] = args.default_keys * scale
+    sizes["input_lines"] = args.input_lines * scale
+    return sizes
+
+def print_parms(DefaultParms):
+    """ Write every parm_dict value to a string, as print_defaults.py does
+    """
+    try:
+        from StringIO import StringIO
+    except ImportError:
+        from io import StringIO
+    fout = StringIO()
+    for subcat_name in DefaultParms.get_subcategory_names():
+        fout.write("! %s\n" % subcat_name.split('. ')[1])
+        for varname in DefaultParms.get_parm_dict_variable_names(subcat_name):
+            fout.write("%s = %s\n" % (varname, DefaultParms.parm_dict[varname]))
+    return fout.getvalue()
+
+def run_gen_code(yaml_file, out_file):
+    """ Run gen_code.py in a separate process (it is a script, not a module)
+    """
+    import subprocess
+    import sys
+    cmd = [sys.executable, path.join(args.lib_dir, "gen_code.py"), "-y", yaml_file,
+           "-t", path.join(args.lib_dir, "marbl_settings_mod.template"), "-o", out_file, "--force"]
+    with open(path.devnull, "w") as devnull:
+        if subprocess.call(cmd, stdout=devnull, stderr=devnull) != 0:
+            logger.error("gen_code.py failed on %s" % yaml_file)
+            exit(1)
+
+def run_scenario(scale, work_dir):
+    """ Write the synthetic files for scale and time every phase on them
+    """
+    import yaml
+    from synthetic_parms import write_synthetic_files
+    from MARBL_defaults import MARBL_defaults_class, _invalid_parms_file, _parse_input_file
+
+    sizes = get_sizes(scale)
+    yaml_file = path.join(work_dir, "parameters_x%d.yaml" % scale)
+    input_file = path.join(work_dir, "input_x%d.txt" % scale)
+    synthetic_args = dict(sizes)
+    input_lines = synthetic_args.pop("input_lines")
+    write_synthetic_files(args.yaml_file, yaml_file, input_file, input_lines, **synthetic_args)
+
+    timings = dict()
+    with open(yaml_file) as fin:
+        yaml_contents = fin.read()
+    timings["load"], parms = best_time(lambda: yaml.safe_load(yaml_contents), args.repeat)
+    timings["validate"], invalid = best_time(lambda: _invalid_parms_file(parms), args.repeat)
+    if invalid:
+        logger.error("%s is not a valid MARBL parameter file" % yaml_file)
+        exit(1)
+    timings["parse"], input_dict = best_time(lambda: _parse_input_file(input_file), args.repeat)
+    timings["resolve"], DefaultParms = best_time(lambda: MARBL_defaults_class(yaml_file, "CESM_x1", input_file,
+                                                                              parms=parms), args.repeat)
+    timings["print"], text = best_time(lambda: print_parms(DefaultParms), args.repeat)
+    if args.codegen:
+        out_file = path.join(work_dir, "marbl_settings_mod_x%d.F90" % scale)
+        timings["codegen"], result = best_time(lambda: run_gen_code(yaml_file, out_file), args.repeat)
+
+    result = dict()
+    result["name"] = "x%d" % scale
+    result["sizes"] = sizes
+    result["parm_dict_keys"] = len(DefaultParms.parm_dict)
+    result["timings"] = timings
+    logger.info("x%d: %d keys, %s" % (scale, result["parm_dict_keys"],
+                                      ", ".join(["%s %.4fs" % (phase, timings[phase])
+                                                 for phase in phases if phase in timings])))
+    return result
+
+def get_slopes(scenarios):
+    """ For every phase, log-log slope of time vs. parm_dict keys between consecutive
+        scenarios (None if either time is too small to measure reliably)
+    """
+    from math import log
+    slopes = dict()
+    for phase in phases:
+        phase_slopes = []
+        for prev, this in zip(scenarios[:-1], scenarios[1:]):
+            if phase not in this["timings"]:
+                continue
+            t0 = prev["timings"][phase]
+            t1 = this["timings"][phase]
+            if min(t0, t1) < min_time or this["parm_dict_keys"] == prev["parm_dict_keys"]:
+                phase_slopes.append(None)
+            else:
+                phase_slopes.append(log(t1/t0) / log(float(this["parm_dict_keys"])/prev["parm_dict_keys"]))
+        if phase_slopes:
+            slopes[phase] = phase_slopes
+    return slopes
+
+def compare_to_baseline(results, baseline):
+    """ Return a list of messages describing phases that are slower than in baseline
+        (or that became superlinear)
+    """
+    messages = []
+    baseline_scenarios = dict((scenario["name"], scenario) for scenario in baseline["scenarios"])
+    for scenario in results["scenarios"]:
+        if scenario["name"] not in baseline_scenarios:
+            continue
+        old_scenario = baseline_scenarios[scenario["name"]]
+        if old_scenario["sizes"] != scenario["sizes"]:
+            messages.append("%s: sizes differ from baseline, not compared" % scenario["name"])
+            continue
+        for phase, new_time in scenario["timings"].items():
+            old_time = old_scenario["timings"].get(phase)
+            if old_time is None or max(old_time, new_time) < min_time:
+                continue
+            if new_time > old_time * (1.0 + args.tolerance):
+                messages.append("%s %s: %.4fs (baseline %.4fs, %+.0f%%)" %
+                                (scenario["name"], phase, new_time, old_time,
+                                 100.0 * (new_time / old_time - 1.0)))
+    for phase, phase_slopes in results["slopes"].items():
+        for n, slope in enumerate(phase_slopes):
+            old_slopes = baseline.get("slopes", dict()).get(phase, [])
+            old_slope = old_slopes[n] if n < len(old_slopes) else None
+            if slope is not None and slope > superlinear_slope and (old_slope is None or old_slope <= superlinear_slope):
+                messages.append("%s: time grows like keys^%.2f between %s and %s" %
+                                (phase, slope, results["scenarios"][n]["name"], results["scenarios"][n+1]["name"]))
+    return messages
+
+################
+# BEGIN SCRIPT #
+################
+
+import json
+import platform
+import shutil
+import tempfile
+from sys import exit, path as sys_path, stdout
+
+sys_path.insert(0, args.lib_dir)
+sys_path.insert(0, path.dirname(path.abspath(__file__)))
+logger = logging.getLogger("run_benchmarks")
+
+scales = [int(scale) for scale in args.scales.split(',')]
+work_dir = tempfile.mkdtemp(prefix="marbl_benchmarks_")
+try:
+    scenarios = [run_scenario(scale, work_dir) for scale in scales]
+finally:
+    shutil.rmtree(work_dir)
+
+results = dict()
+results["python"] = platform.python_version()
+results["repeat"] = args.repeat
+results["scenarios"] = scenarios
+results["slopes"] = get_slopes(scenarios)
+for phase, phase_slopes in results["slopes"].items():
+    for n, slope in enumerate(phase_slopes):
+        if slope is not None and slope > superlinear_slope:
+            logger.warning("%s: time grows like keys^%.2f between %s and %s" %
+                           (phase, slope, scenarios[n]["name"], scenarios[n+1]["name"]))
+
+if args.output is None:
+    json.dump(results, stdout, indent=2, sort_keys=True)
+    stdout.write("\n")
+else:
+    with open(args.output, "w") as fout:
+        json.dump(results, fout, indent=2, sort_keys=True)
+        fout.write("\n")
+    logger.info("Wrote %s" % args.output)
+
+if args.baseline is not None:
+    with open(args.baseline) as fin:
+        baseline = json.load(fin)
+    messages = compare_to_baseline(results, baseline)
+    for message in messages:
+        logger.error("Regression: %s" % message)
+    if messages:
+        exit(1)
+    logger.info("No regressions compared to %s" % args.baseline)
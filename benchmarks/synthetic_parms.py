@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+""" Generate synthetic (but schema-valid) MARBL parameter files and input files for the
+    scaling benchmarks in run_benchmarks.py.
+
+    A synthetic parameter file is parameters.yaml with
+    1. nvars extra variables in general_parms (a mix of real, integer, logical and
+       string; every fourth one is an array of length array_size, and every third one
+       has a default_value dictionary with default_keys keys)
+    2. PFT_defaults = user-specified, so the PFT derived types are sized by
+       autotroph_cnt, zooplankton_cnt and max_grazer_prey_cnt (= autotroph_cnt); grazing
+       is a max_grazer_prey_cnt x zooplankton_cnt array whose elements contain arrays of
+       length autotroph_cnt and zooplankton_cnt
+
+    Usage: synthetic_parms.py -o synthetic.yaml [-i synthetic_input.txt] [--nvars N] ...
+"""
+
+import logging
+
+################################################################################
+#                            PUBLIC MODULE METHODS                             #
+################################################################################
+
+def make_synthetic_parms(base_parms, nvars=100, array_size=4, autotroph_cnt=3, zooplankton_cnt=1,
+                         default_keys=2):
+    """ Return a copy of base_parms (a dictionary from read_parms_file() or yaml.safe_load())
+        with the synthetic variables and PFT counts described in the module docstring
+    """
+
+    from copy import deepcopy
+
+    parms = deepcopy(base_parms)
+
+    # 1. Synthetic general parameters, _VARS_PER_SUBCATEGORY per subcategory
+    general_parms = parms['general_parms']
+    for n in range(nvars):
+        var_name = get_synthetic_var_name(n)
+        datatype = _SYNTHETIC_DATATYPES[n % len(_SYNTHETIC_DATATYPES)]
+        var_dict = dict()
+        var_dict['longname'] = "Synthetic %s parameter %d" % (datatype, n)
+        var_dict['subcategory'] = "%d. synthetic %d" % (_FIRST_SYNTHETIC_SUBCATEGORY + n // _VARS_PER_SUBCATEGORY,
+                                                         n // _VARS_PER_SUBCATEGORY + 1)
+        var_dict['units'] = "unitless" if datatype in ["real", "integer"] else "non-numeric"
+        var_dict['datatype'] = datatype
+        if n % 4 == 3:
+            var_dict['_array_size'] = array_size
+        if n % 3 == 2:
+            var_dict['default_value'] = dict()
+            var_dict['default_value']['default'] = _synthetic_value(datatype, n)
+            for key_ind in range(1, default_keys):
+                grid_name = "CESM_x3" if key_ind == 1 else "synthetic_grid_%d" % key_ind
+                var_dict['default_value']['grid = %s' % grid_name] = _synthetic_value(datatype, n + key_ind)
+        else:
+            var_dict['default_value'] = _synthetic_value(datatype, n)
+        general_parms[var_name] = var_dict
+
+    # 2. PFT counts come from the YAML rather than _CESM2_PFT_keys
+    general_parms['PFT_defaults']['default_value'] = 'user-specified'
+    pft_counts = parms['PFT_counts']
+    pft_counts['autotroph_cnt']['default_value']['default'] = autotroph_cnt
+    pft_counts['zooplankton_cnt']['default_value']['default'] = zooplankton_cnt
+    pft_counts['max_grazer_prey_cnt']['default_value']['default'] = autotroph_cnt
+
+    return parms
+
+################################################################################
+
+def get_synthetic_var_name(n):
+    """ Name of the n-th synthetic variable
+    """
+
+    return "synthetic_%s_%d" % (_SYNTHETIC_DATATYPES[n % len(_SYNTHETIC_DATATYPES)], n)
+
+################################################################################
+
+def get_synthetic_input_lines(parms, nlines):
+    """ Return nlines "varname = value" lines that override variables in parms (a
+        dictionary from make_synthetic_parms()): synthetic general parameters first,
+        then components of autotrophs(n)
+    """
+
+    lines = []
+    general_parms = parms['general_parms']
+    synthetic_names = [var_name for var_name in general_parms.keys() if var_name.startswith('synthetic_')]
+    for n, var_name in enumerate(synthetic_names[:nlines]):
+        var_dict = general_parms[var_name]
+        value = _synthetic_value(var_dict['datatype'], n + 1, for_input_file=True)
+        if '_array_size' in var_dict.keys():
+            value = ", ".join([value] * var_dict['_array_size'])
+        lines.append("%s = %s" % (var_name, value))
+
+    autotroph_cnt = parms['PFT_counts']['autotroph_cnt']['default_value']['default']
+    real_components = [comp_name for comp_name, comp_dict in parms['PFT_derived_types']['autotrophs']['datatype'].items()
+                       if comp_name[0] != '_' and comp_dict['datatype'] == 'real'
+                       and '_array_size' not in comp_dict.keys()]
+    n = 0
+    while len(lines) < nlines and n < autotroph_cnt * len(real_components):
+        lines.append("autotrophs(%d)%%%s = %s" % (n // len(real_components) + 1,
+                                                 real_components[n % len(real_components)],
+                                                 _synthetic_value('real', n, for_input_file=True)))
+        n += 1
+    return lines
+
+################################################################################
+
+def write_synthetic_files(base_yaml_file, yaml_file, input_file=None, input_lines=0, **kwargs):
+    """ Write a synthetic parameter file (and, if input_file is not None, an input file
+        with input_lines lines); kwargs are passed to make_synthetic_parms().
+        Returns the dictionary that was written to yaml_file.
+    """
+
+    import yaml
+
+    with open(base_yaml_file) as fin:
+        base_parms = yaml.safe_load(fin)
+    parms = make_synthetic_parms(base_parms, **kwargs)
+    with open(yaml_file, "w") as fout:
+        yaml.safe_dump(parms, fout, default_flow_style=False)
+    if input_file is not None:
+        with open(input_file, "w") as fout:
+            for line in get_synthetic_input_lines(parms, input_lines):
+                fout.write(line + "\n")
+    return parms
+
+################################################################################
+#                            PRIVATE MODULE METHODS                            #
+################################################################################
+
+_SYNTHETIC_DATATYPES = ["real", "integer", "logical", "string"]
+
+# Subcategories are numbered after the ones in parameters.yaml
+_FIRST_SYNTHETIC_SUBCATEGORY = 100
+_VARS_PER_SUBCATEGORY = 25
+
+################################################################################
+
+def _synthetic_value(datatype, n, for_input_file=False):
+    """ A value of the given datatype (as it would appear in the YAML file, or in an
+        input file if for_input_file is True)
+    """
+
+    if datatype == "real":
+        if for_input_file:
+            return "%d.5e-3" % (n % 10)
+        # Some real defaults are expressions, as in parameters.yaml
+        return "%d.0/%d" % (n + 1, n % 7 + 1) if n % 5 == 0 else float(n) + 0.25
+    if datatype == "integer":
+        return str(n) if for_input_file else n
+    if datatype == "logical":
+        return ".true." if n % 2 == 0 else ".false."
+    if for_input_file:
+        return "'value_%d'" % n
+    return "value_%d" % n
+
+################################################################################
+#                                 MAIN PROGRAM                                 #
+################################################################################
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic MARBL parameter file (and input file)")
+    parser.add_argument('-y', '--yaml_file', action='store', dest='base_yaml_file', default='parameters.yaml',
+                        help='Parameter file to add synthetic variables to')
+    parser.add_argument('-o', '--output', action='store', dest='yaml_file', required=True,
+                        help='Synthetic parameter file to write')
+    parser.add_argument('-i', '--input_file', action='store', dest='input_file', default=None,
+                        help='Synthetic input file to write')
+    parser.add_argument('--input_lines', action='store', dest='input_lines', default=100, type=int,
+                        help='Number of lines in the synthetic input file')
+    parser.add_argument('--nvars', action='store', dest='nvars', default=100, type=int,
+                        help='Number of synthetic variables to add to general_parms')
+    parser.add_argument('--array_size', action='store', dest='array_size', default=4, type=int,
+                        help='Length of synthetic array variables')
+    parser.add_argument('--autotroph_cnt', action='store', dest='autotroph_cnt', default=3, type=int,
+                        help='Number of autotrophs (also the number of grazer prey)')
+    parser.add_argument('--zooplankton_cnt', action='store', dest='zooplankton_cnt', default=1, type=int,
+                        help='Number of zooplankton')
+    parser.add_argument('--default_keys', action='store', dest='default_keys', default=2, type=int,
+                        help='Number of keys in synthetic default_value dictionaries')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s (%(funcName)s): %(message)s', level=logging.INFO)
+    write_synthetic_files(args.base_yaml_file, args.yaml_file, args.input_file, args.input_lines,
+                          nvars=args.nvars, array_size=args.array_size, autotroph_cnt=args.autotroph_cnt,
+                          zooplankton_cnt=args.zooplankton_cnt, default_keys=args.default_keys)
+    logging.getLogger("synthetic_parms").info("Wrote %s" % args.yaml_file)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# This script converts a binary settings file (written by print_defaults.py --binary_file)
+# back to the "varname = value" text print_defaults.py writes, or to JSON.
+
+################################
+# Parse command line arguments #
+################################
+
+import argparse
+
+parser = argparse.ArgumentParser(description="Convert a binary MARBL settings file to text or JSON")
+
+# Binary settings file to read
+parser.add_argument('settings_file', action='store',
+                    help='File written by print_defaults.py --binary_file')
+
+# Command line argument to choose the output format (default is text)
+parser.add_argument('-f', '--format', action='store', dest='format', default='text', choices=['text', 'json'],
+                    help='Output format')
+
+# Command line argument to select members (default is every member)
+parser.add_argument('-m', '--member', action='append', dest='members', default=None,
+                    help='Only convert this member; repeat for more members')
+
+# Command line argument to list the members and exit
+parser.add_argument('--list', action='store_true', dest='list_members',
+                    help='List the members in the file')
+
+# Path to directory containing MARBL_settings_file.py
+parser.add_argument('-l', '--lib_dir', action='store', dest='lib_dir', default='./',
+                    help='Directory that contains MARBL_settings_file.py')
+args = parser.parse_args()
+
+##################
+# Set up logging #
+##################
+
+import logging
+logging.basicConfig(format='%(levelname)s (%(funcName)s): %(message)s', level=logging.DEBUG)
+
+################
+# BEGIN SCRIPT #
+################
+
+from sys import path as sys_path, stdout, exit
+sys_path.insert(0, args.lib_dir)
+from MARBL_settings_file import MARBL_settings_file_class, write_settings_text, write_settings_json
+
+Settings = MARBL_settings_file_class(args.settings_file)
+members = args.members
+if members is None:
+    members = Settings.get_member_names()
+else:
+    all_members = Settings.get_member_names()
+    for member in members:
+        if member not in all_members:
+            logging.error("%s does not contain member %s" % (args.settings_file, member))
+            exit(1)
+
+if args.list_members:
+    for member in members:
+        stdout.write("%s\n" % member)
+elif args.format == 'json':
+    write_settings_json(stdout, Settings, members)
+else:
+    # Text: if there is more than one member, each one starts with a "!! member" line
+    # (the marker iter_input_file_members() looks for)
+    for member in members:
+        if len(members) > 1:
+            if member != members[0]:
+                stdout.write("\n")
+            stdout.write("!! member %s\n" % member)
+        write_settings_text(stdout, Settings, member)
+Settings.close()
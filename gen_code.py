@@ -1,29 +1,616 @@
 #!/usr/bin/env python
 
-# This script reads in
+# This script reads in parameters.yaml and marbl_settings_mod.template and writes
+# marbl_settings_mod.F90, replacing the !## lines in the template with generated code.
+# The same script generates marbl_pft_mod.F90 from marbl_pft_mod.template (use -t and -o).
+#
+# The output file is only written when the generated code changes, so unchanged
+# settings do not trigger a recompile of MARBL. A stamp file (.<output>.stamp) records
+# content hashes of the YAML file, the template, the generator, and the output;
+# --check compares those hashes without reading the YAML file and exits with status 1
+# if the output needs to be regenerated.
 
-import yaml
+################################
+# Parse command line arguments #
+################################
 
-# Read YAML file to get variables / values
-with open('parameters.yaml') as parmsfile:
-  parameters = yaml.load(parmsfile)
+import argparse
+
+parser = argparse.ArgumentParser(description="Generate marbl_settings_mod.F90 (or marbl_pft_mod.F90) from YAML file and template")
+
+# Command line argument to point to YAML file (default is parameters.yaml)
+parser.add_argument('-y', '--yaml_file', action='store', dest='yaml_file', default='parameters.yaml',
+                    help='Location of YAML-formatted MARBL configuration file')
+
+# Command line argument to point to template file
+parser.add_argument('-t', '--template', action='store', dest='template', default='marbl_settings_mod.template',
+                    help='Location of marbl_settings_mod template')
+
+# Command line argument to point to output file
+parser.add_argument('-o', '--output', action='store', dest='output', default='marbl_settings_mod.F90',
+                    help='Generated Fortran file')
+
+# Command line arguments to control regeneration
+parser.add_argument('--check', action='store_true', dest='check',
+                    help='Only report whether the output needs to be regenerated (exit status 1 if it does)')
+parser.add_argument('--force', action='store_true', dest='force',
+                    help='Regenerate the output even if the stamp says it is up to date')
+
+# Command line argument to report where the time goes
+parser.add_argument('--profile', action='store', dest='profile', default=None, nargs='?', const='-',
+                    help='Print time spent in each phase to stderr (or write it to PROFILE; JSON if it ends in .json)')
+args = parser.parse_args()
+
+if args.check and args.force:
+    parser.error("Can not specify both --check and --force")
+
+##################
+# Set up logging #
+##################
 
-in_file  = "marbl_settings_mod.template"
-out_file = "marbl_settings_mod.F90"
+import logging
+logging.basicConfig(format='%(levelname)s (%(funcName)s): %(message)s', level=logging.INFO)
+
+#############
+# FUNCTIONS #
+#############
 
 # Fortran declarations are a dictionary based on datatype in YAML
 types = dict()
-types["string"] = "character(len=char)"
+types["string"] = "character(len=char_len)"
 types["logical"] = "logical(log_kind)"
 types["integer"] = "integer(int_kind)"
 types["real"] = "real(r8)"
 
+# Files (other than this one) whose contents change the generated code
+generator_modules = ["MARBL_defaults.py", "MARBL_expression.py"]
 
-# Read template file line by line
-with open(in_file) as fin:
-    lines = [x.strip('\n') for x in fin.readlines()]
+def file_hash(file_name):
+    """ Return the SHA-256 hash of the contents of file_name (None if it does not exist)
+    """
+    import hashlib
+    try:
+        with open(file_name, 'rb') as fin:
+            return hashlib.sha256(fin.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+def combine_hashes(hash_list):
+    """ Combine a list of hashes into one
+    """
+    import hashlib
+    return hashlib.sha256(":".join([str(one_hash) for one_hash in hash_list]).encode('utf-8')).hexdigest()
+
+def get_stamp_file(out_file):
+    """ Stamp for path/to/file.F90 is path/to/.file.F90.stamp
+    """
+    from os import path
+    return path.join(path.dirname(out_file), "." + path.basename(out_file) + ".stamp")
+
+def get_input_stamp(yaml_file, template_file):
+    """ Return a dictionary of hashes for everything that goes into the generated code
+    """
+    from os import path
+    lib_dir = path.dirname(path.abspath(__file__))
+    generator_hashes = [file_hash(path.abspath(__file__))]
+    for module_name in generator_modules:
+        generator_hashes.append(file_hash(path.join(lib_dir, module_name)))
+
+    stamp = dict()
+    stamp["yaml"] = file_hash(yaml_file)
+    stamp["template"] = file_hash(template_file)
+    stamp["generator"] = combine_hashes(generator_hashes)
+    return stamp
+
+def read_stamp(stamp_file):
+    """ Return the dictionary stored in stamp_file (None if it can not be read)
+    """
+    import json
+    try:
+        with open(stamp_file) as fin:
+            return json.load(fin)
+    except (IOError, OSError, ValueError):
+        return None
+
+def atomic_write(file_name, contents):
+    """ Write contents to a temporary file in the same directory and then rename it,
+        so file_name is never left partially written
+    """
+    import os
+    import tempfile
+    fd, tmp_file = tempfile.mkstemp(prefix="." + os.path.basename(file_name) + ".",
+                                    dir=os.path.dirname(os.path.abspath(file_name)))
+    try:
+        with os.fdopen(fd, 'w') as fout:
+            fout.write(contents)
+        # mkstemp() creates files that only the owner can read
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_file, 0o666 & ~umask)
+        os.rename(tmp_file, file_name)
+    except:
+        os.remove(tmp_file)
+        raise
+
+def write_stamp(stamp_file, stamp):
+    """ Store the stamp dictionary in stamp_file
+    """
+    import json
+    atomic_write(stamp_file, json.dumps(stamp, indent=2, sort_keys=True) + "\n")
+
+def output_is_current(out_file, stamp_file, input_stamp):
+    """ True if the stamp matches the current inputs and the output has not changed
+        since it was written
+    """
+    stamp = read_stamp(stamp_file)
+    if stamp is None:
+        return False
+    for key in input_stamp.keys():
+        if stamp.get(key) != input_stamp[key]:
+            return False
+    return stamp.get("output") == file_hash(out_file)
+
+def fortran_value(datatype, value):
+    """ Convert a YAML value to a Fortran literal
+    """
+    from MARBL_expression import evaluate_real_expression
+    if datatype == "string":
+        return "'%s'" % value
+    if datatype == "logical":
+        if isinstance(value, str):
+            value = (value.strip().lower() == ".true.")
+        return ".true." if value else ".false."
+    if datatype == "integer":
+        return "%d" % int(value)
+    # real: values may be expressions such as "1.0/117"
+    if isinstance(value, str):
+        value = evaluate_real_expression(value)
+    return "%s_r8" % repr(float(value))
+
+def fortran_array_dims(var_dict):
+    """ Return the dimension attribute for a declaration ("" for scalars)
+    """
+    if "_array_size" not in var_dict.keys():
+        return ""
+    if isinstance(var_dict["_array_size"], int):
+        return ", dimension(%d)" % var_dict["_array_size"]
+    return ", allocatable, dimension(:)"
+
+def default_assignments(var_name, var_dict, value):
+    """ Return the list of assignments setting var_name to value
+    """
+    datatype = var_dict["datatype"]
+    if isinstance(value, list):
+        return ["%s(%d) = %s" % (var_name, n+1, fortran_value(datatype, elem_value))
+                for n, elem_value in enumerate(value)]
+    if "_array_size" in var_dict.keys():
+        return ["%s(:) = %s" % (var_name, fortran_value(datatype, value))]
+    return ["%s = %s" % (var_name, fortran_value(datatype, value))]
+
+def default_lines(var_name, var_dict, parameters):
+    """ Return the Fortran lines that set the default value of var_name. Defaults
+        that depend on another string parameter become a select case block; defaults
+        that depend on something Fortran does not know about (e.g. grid) use the
+        "default" entry, with the other values in a comment.
+    """
+    default_value = var_dict["default_value"]
+    if not isinstance(default_value, dict):
+        return default_assignments(var_name, var_dict, default_value)
+
+    # Group non-default keys by the variable they depend on
+    cases = []
+    config_vars = set()
+    for key in default_value.keys():
+        if key == "default":
+            continue
+        config_var, config_value = [x.strip() for x in key.split('=', 1)]
+        config_vars.add(config_var)
+        cases.append((config_value.strip('"').strip("'"), default_value[key]))
+
+    config_var = list(config_vars)[0] if len(config_vars) == 1 else None
+    is_string_parm = False
+    for cat_name in parameters["_order"]:
+        if config_var in parameters[cat_name].keys():
+            is_string_parm = (parameters[cat_name][config_var]["datatype"] == "string")
+
+    if not is_string_parm:
+        lines = default_assignments(var_name, var_dict, default_value["default"])
+        for key in default_value.keys():
+            if key != "default":
+                lines.append("! %s: %s" % (key, default_value[key]))
+        return lines
+
+    lines = ["select case (trim(%s))" % config_var]
+    for config_value, value in cases:
+        lines.append("  case ('%s')" % config_value)
+        lines = lines + ["    " + line for line in default_assignments(var_name, var_dict, value)]
+    lines.append("  case DEFAULT")
+    lines = lines + ["    " + line for line in default_assignments(var_name, var_dict, default_value["default"])]
+    lines.append("end select")
+    return lines
+
+# Pointer used to register each kind of setting (by datatype, scalar / 1D array)
+pointer_names = dict()
+pointer_names["real"] = ("rptr", "r1ptr")
+pointer_names["integer"] = ("iptr", "i1ptr")
+pointer_names["logical"] = ("lptr", None)
+pointer_names["string"] = ("sptr", "s1ptr")
+
+def fortran_string(value):
+    """ Quote value as a Fortran string literal
+    """
+    return "'%s'" % str(value).replace("'", "''")
+
+def fortran_condition(condition):
+    """ Convert a YAML "cannot change" / "must set" condition to Fortran
+    """
+    return condition.replace("==", ".eq.").replace("!=", ".ne.")
+
+def is_derived_type(var_dict):
+    return isinstance(var_dict["datatype"], dict)
+
+def get_table_groups(parameters, cat_name):
+    """ Settings in a category are registered from metadata tables; return a list of
+        (group name, parent variable, {name : variable dictionary}) where every derived
+        type is its own group (group name = variable name) and all other variables
+        in the category share a group named after the category
+    """
+    from collections import OrderedDict
+    groups = []
+    plain_vars = OrderedDict()
+    for var_name, var_dict in parameters[cat_name].items():
+        if is_derived_type(var_dict):
+            components = OrderedDict()
+            for comp_name, comp_dict in var_dict["datatype"].items():
+                if comp_name[0] != '_':
+                    components[comp_name] = comp_dict
+            groups.append((var_name, var_name, components))
+        else:
+            plain_vars[var_name] = var_dict
+    if plain_vars:
+        groups.insert(0, (cat_name, None, plain_vars))
+    return groups
+
+def string_table(table_name, cnt_name, values):
+    """ Return the lines declaring a parameter array of strings (as short as the
+        longest value, rather than char_len, to keep the object file small)
+    """
+    values = list(values)
+    str_len = max([1] + [len(str(value)) for value in values])
+    lines = ["character(len=%d), parameter :: %s(%s) = (/ character(len=%d) :: &" %
+             (str_len, table_name, cnt_name, str_len)]
+    for n, value in enumerate(values):
+        lines.append("    %s%s" % (fortran_string(value), ", &" if n < len(values)-1 else " /)"))
+    return lines
 
-with open(out_file, 'w') as fout:
+def integer_table(table_name, cnt_name, values):
+    """ Return the lines declaring a parameter array of integers
+    """
+    values = [str(value) for value in values]
+    lines = ["integer, parameter :: %s(%s) = (/ &" % (table_name, cnt_name)]
+    for n in range(0, len(values), 20):
+        lines.append("    %s%s" % (", ".join(values[n:n+20]), ", &" if n+20 < len(values) else " /)"))
+    return lines
+
+def metadata_lines(parameters, cat_name):
+    """ Declarations for marbl_settings_define_<cat_name>: one table per column of
+        metadata (short name, long name, units, datatype, category, subcategory index),
+        plus the local variables used by the lines from define_lines()
+    """
+    from MARBL_defaults import get_subcategory_list
+    # finalize_vars() logs categories in subcategory order; a subcategory index is
+    # its position in get_subcategory_names() on the python side
+    subcat_inds = dict((subcat_name, n+1) for n, subcat_name in enumerate(get_subcategory_list(parameters)))
+    lines = []
+    has_derived_types = False
+    for group_name, parent_var, group_vars in get_table_groups(parameters, cat_name):
+        cnt_name = "%s_table_len" % group_name
+        lines.append("integer, parameter :: %s = %d" % (cnt_name, len(group_vars)))
+        lines = lines + string_table("%s_snames" % group_name, cnt_name, group_vars.keys())
+        lines = lines + string_table("%s_lnames" % group_name, cnt_name,
+                                     [var_dict["longname"] for var_dict in group_vars.values()])
+        lines = lines + string_table("%s_units" % group_name, cnt_name,
+                                     [var_dict["units"] for var_dict in group_vars.values()])
+        lines = lines + string_table("%s_datatypes" % group_name, cnt_name,
+                                     [var_dict["datatype"] for var_dict in group_vars.values()])
+        lines = lines + integer_table("%s_subcat_inds" % group_name, cnt_name,
+                                      [subcat_inds[var_dict["subcategory"]]
+                                       for var_dict in group_vars.values()])
+        if parent_var is None:
+            # Derived types are categorized by element, not subcategory
+            lines = lines + string_table("%s_categories" % group_name, cnt_name,
+                                         [var_dict["subcategory"].split('. ', 1)[-1]
+                                          for var_dict in group_vars.values()])
+        else:
+            has_derived_types = True
+        lines.append("")
+
+    lines.append("real(r8),                pointer :: rptr => NULL()")
+    lines.append("integer(int_kind),       pointer :: iptr => NULL()")
+    lines.append("logical(log_kind),       pointer :: lptr => NULL()")
+    lines.append("character(len=char_len), pointer :: sptr => NULL()")
+    lines.append("real(r8),                pointer :: r1ptr(:) => NULL()")
+    lines.append("integer(int_kind),       pointer :: i1ptr(:) => NULL()")
+    lines.append("character(len=char_len), pointer :: s1ptr(:) => NULL()")
+    lines.append("logical                          :: nondefault_allowed, nondefault_required")
+    lines.append("logical                          :: labort_marbl_loc")
+    lines.append("integer                          :: var_ind")
+    if has_derived_types:
+        lines.append("integer                          :: m, n")
+        lines.append("character(len=char_len)          :: sname, category, prefix")
+    return lines
+
+def nondefault_lines(flag_dict, allowed_default=None, required_default=None):
+    """ Return the lines that set nondefault_allowed and nondefault_required from the
+        "cannot change" and "must set" conditions in flag_dict (if flag_dict does not
+        provide a condition, use the default line if one is given)
+    """
+    lines = []
+    if flag_dict is not None and "cannot change" in flag_dict.keys():
+        lines.append("nondefault_allowed = .not. (%s)" % fortran_condition(flag_dict["cannot change"]))
+    elif allowed_default is not None:
+        lines.append(allowed_default)
+    if flag_dict is not None and "must set" in flag_dict.keys():
+        lines.append("nondefault_required = (%s)" % fortran_condition(flag_dict["must set"]))
+    elif required_default is not None:
+        lines.append(required_default)
+    return lines
+
+def pointer_lines(var_name, var_dict, element):
+    """ Return the lines in the select case block that point to var_name and set the
+        nondefault flags for it (element is "autotrophs(n)%" for derived types)
+    """
+    scalar_ptr, array_ptr = pointer_names[var_dict["datatype"]]
+    target = element + var_name
+    if "_array_size" in var_dict.keys():
+        if "_array_len_to_print" in var_dict.keys():
+            target = "%s(1:%s%s)" % (target, element, var_dict["_array_len_to_print"])
+        lines = ["%s => %s" % (array_ptr, target)]
+    else:
+        lines = ["%s => %s" % (scalar_ptr, target)]
+    return lines + nondefault_lines(var_dict)
+
+def registration_loop(group_name, group_vars, parent_dict, element, sname, category):
+    """ Return the loop over group_vars that registers each setting
+    """
+    lines = ["do var_ind = 1, %s_table_len" % group_name,
+             "  nullify(rptr, iptr, lptr, sptr, r1ptr, i1ptr, s1ptr)"]
+    lines = lines + ["  " + line for line in nondefault_lines(parent_dict, "nondefault_allowed = .true.",
+                                                                 "nondefault_required = .false.")]
+    lines.append("  select case (var_ind)")
+    for n, (var_name, var_dict) in enumerate(group_vars.items()):
+        lines.append("    case (%d)" % (n+1))
+        lines = lines + ["      " + line for line in pointer_lines(var_name, var_dict, element)]
+    lines.append("  end select")
+    if element:
+        lines.append('  write(sname, "(2A)") trim(prefix), trim(%s_snames(var_ind))' % group_name)
+    lines.append("  call this%%add_var_from_table(%s, &" % sname)
+    lines.append("                               %s_lnames(var_ind), &" % group_name)
+    lines.append("                               %s_units(var_ind), &" % group_name)
+    lines.append("                               %s_datatypes(var_ind), &" % group_name)
+    lines.append("                               %s, marbl_status_log, &" % category)
+    lines.append("                               rptr, iptr, lptr, sptr, r1ptr, i1ptr, s1ptr, &")
+    lines.append("                               nondefault_allowed, nondefault_required, &")
+    lines.append("                               %s_subcat_inds(var_ind))" % group_name)
+    lines.append("  call check_and_log_add_var_error(marbl_status_log, %s, subname, labort_marbl_loc)" % sname)
+    lines.append("end do")
+    return lines
+
+def define_lines(parameters, cat_name):
+    """ Executable statements for marbl_settings_define_<cat_name>: register every
+        setting in the category by looping over the tables from metadata_lines()
+    """
+    lines = ["labort_marbl_loc = .false."]
+    for group_name, parent_var, group_vars in get_table_groups(parameters, cat_name):
+        if parent_var is None:
+            lines = lines + registration_loop(group_name, group_vars, None, "",
+                                              "%s_snames(var_ind)" % group_name,
+                                              "%s_categories(var_ind)" % group_name)
+            continue
+
+        # Derived types: loop over every element, e.g. grazing(m,n) (last index outermost)
+        parent_dict = parameters[cat_name][parent_var]
+        dims = parent_dict["_array_size"]
+        if not isinstance(dims, list):
+            dims = [dims]
+        indices = ["m", "n"][-len(dims):]
+        # "autotrophs" -> category "autotroph 1", "grazing" -> "grazing 1 1"
+        category_name = element_name(parent_var)
+        index_list = ", ".join(indices)
+        loop_lines = []
+        for index, dim in reversed(list(zip(indices, dims))):
+            loop_lines.append("  "*len(loop_lines) + "do %s=1,%s" % (index, dim))
+        lines = lines + loop_lines
+        indent = "  "*len(dims)
+        lines.append(indent + 'write(prefix, "(A%s)") \'%s(\', %s, \')%%\'' %
+                     (",I0,A"*len(dims), parent_var, ", ',', ".join(indices)))
+        lines.append(indent + 'write(category, "(A%s)") \'%s\', %s' %
+                     (",1X,I0"*len(dims), category_name, index_list))
+        element = "%s(%s)%%" % (parent_var, ",".join(indices))
+        lines = lines + [indent + line for line in registration_loop(group_name, group_vars, parent_dict,
+                                                                     element, "sname", "category")]
+        for n in reversed(range(len(dims))):
+            lines.append("  "*n + "end do")
+
+    lines.append("marbl_status_log%labort_marbl = labort_marbl_loc")
+    lines.append("if (marbl_status_log%labort_marbl) return")
+    return lines
+
+# set_to_default() id of the PFT whose defaults are the "default" entries in the YAML
+unset_pft_id = "unset"
+
+def element_name(parent_var):
+    """ Name of one element of a derived type array ("autotrophs" -> "autotroph"); it
+        names the element's category, Fortran type, and set_to_default() routine
+    """
+    return parent_var[:-1] if parent_var.endswith('s') else parent_var
+
+def get_pft_defaults(parameters, cat_name):
+    """ Return a list of (derived type, {name : component dictionary}, PFT ids,
+        {name : default values}) for every derived type in the category; ids[0] is
+        unset_pft_id and the rest are the type's _CESM2_PFT_keys, and values[n] is the
+        default for ids[n]
+    """
+    from collections import OrderedDict
+    from sys import exit
+    logger = logging.getLogger("gen_code")
+    all_pft_keys = parameters["general_parms"]["PFT_defaults"].get("_CESM2_PFT_keys", dict())
+    pft_defaults = []
+    for group_name, parent_var, group_vars in get_table_groups(parameters, cat_name):
+        if parent_var is None:
+            continue
+        pft_ids = [unset_pft_id] + list(all_pft_keys.get(parent_var, []))
+        defaults = OrderedDict()
+        for var_name, var_dict in group_vars.items():
+            default_value = var_dict["default_value"]
+            if not isinstance(default_value, dict):
+                defaults[var_name] = [default_value] * len(pft_ids)
+                continue
+            values = [default_value["default"]] * len(pft_ids)
+            for key in default_value.keys():
+                if key == "default":
+                    continue
+                # Only defaults that depend on the PFT itself can go in a table
+                config_var, config_value = [x.strip() for x in key.split('=', 1)]
+                config_value = config_value.strip('"').strip("'")
+                if config_var != parent_var or config_value not in pft_ids[1:]:
+                    logger.error("%s%%%s: '%s' is not a PFT in %s _CESM2_PFT_keys" %
+                                 (parent_var, var_name, key, parent_var))
+                    exit(1)
+                values[pft_ids.index(config_value)] = default_value[key]
+            defaults[var_name] = values
+        pft_defaults.append((parent_var, group_vars, pft_ids, defaults))
+    return pft_defaults
+
+def pft_table(datatype, table_name, cnt_name, values):
+    """ Return the lines declaring a parameter array of default values, indexed from 0
+        (strings are as long as the longest value, as in string_table())
+    """
+    if datatype == "string":
+        str_len = max([1] + [len(str(value)) for value in values])
+        declaration = "character(len=%d)" % str_len
+        constructor = "(/ %s :: &" % declaration
+        values = [fortran_string(value) for value in values]
+    else:
+        declaration = types[datatype]
+        constructor = "(/ &"
+        values = [fortran_value(datatype, value) for value in values]
+    lines = ["%s, parameter :: %s(0:%s) = %s" % (declaration, table_name, cnt_name, constructor)]
+
+    # Several values per line, so tables stay well under the continuation line limit
+    rows = [[]]
+    for value in values:
+        if rows[-1] and len(", ".join(rows[-1] + [value])) > 90:
+            rows.append([])
+        rows[-1].append(value)
+    for n, row in enumerate(rows):
+        lines.append("    %s%s" % (", ".join(row), ", &" if n < len(rows)-1 else " /)"))
+    return lines
+
+def pft_default_lines(parameters, cat_name):
+    """ Declarations for marbl_pft_mod: for every derived type, the list of PFT ids
+        and one table of default values per component
+    """
+    lines = []
+    for parent_var, group_vars, pft_ids, defaults in get_pft_defaults(parameters, cat_name):
+        element = element_name(parent_var)
+        cnt_name = "%s_default_cnt" % element
+        lines.append("integer, parameter :: %s = %d" % (cnt_name, len(pft_ids)-1))
+        lines = lines + pft_table("string", "%s_default_ids" % element, cnt_name, pft_ids)
+        for var_name, values in defaults.items():
+            lines = lines + pft_table(group_vars[var_name]["datatype"],
+                                      "%s_%s_defaults" % (element, var_name), cnt_name, values)
+        lines.append("")
+    return lines[:-1]
+
+def set_to_default_lines(parameters, cat_name):
+    """ <element>_set_to_default() for every derived type: look up the PFT id once,
+        then copy element n of each table from pft_default_lines()
+    """
+    lines = []
+    for parent_var, group_vars, pft_ids, defaults in get_pft_defaults(parameters, cat_name):
+        element = element_name(parent_var)
+        subname = "%s_set_to_default" % element
+        id_name = "%s_id" % element
+        # self keeps its allocatable components (allocated by the constructor)
+        if any(["_is_allocatable" in var_dict.keys() for var_dict in group_vars.values()]):
+            self_intent = "intent(inout)"
+        else:
+            self_intent = "intent(out)"
+        dummy_args = [("class(%s_type)" % element, self_intent, "self"),
+                      ("character(len=*)", "intent(in)", id_name),
+                      ("type(marbl_log_type)", "intent(inout)", "marbl_status_log")]
+        type_len = max([len(arg[0]) for arg in dummy_args]) + 1
+        intent_len = max([len(arg[1]) for arg in dummy_args])
+
+        if lines:
+            lines = lines + ["", "!" + "*"*77, ""]
+        lines.append("subroutine %s(self, %s, marbl_status_log)" % (subname, id_name))
+        lines.append("")
+        for arg_type, arg_intent, arg_name in dummy_args:
+            lines.append("  %s %s :: %s" % ((arg_type + ",").ljust(type_len), arg_intent.ljust(intent_len), arg_name))
+        lines.append("")
+        lines.append("  character(len=*), parameter :: subname = 'marbl_pft_mod:%s'" % subname)
+        lines.append("  character(len=char_len)     :: log_message")
+        lines.append("  integer                     :: n")
+        lines.append("")
+        lines.append("  n = pft_default_index(%s_default_ids, %s)" % (element, id_name))
+        lines.append("  if (n .lt. 0) then")
+        lines.append("    write(log_message, \"(3A)\") \"'\", %s, \"' is not a valid %s ID\"" % (id_name, element))
+        lines.append("    call marbl_status_log%log_error(log_message, subname)")
+        lines.append("    return")
+        lines.append("  end if")
+        lines.append("")
+        targets = []
+        for var_name, var_dict in group_vars.items():
+            targets.append(("self%%%s%s" % (var_name, "(:)" if "_array_size" in var_dict.keys() else ""),
+                            "%s_%s_defaults(n)" % (element, var_name)))
+        target_len = max([len(target) for target, table in targets])
+        for target, table in targets:
+            lines.append("  %s = %s" % (target.ljust(target_len), table))
+        lines.append("")
+        lines.append("end subroutine %s" % subname)
+    return lines
+
+def generated_lines(parameters, action, cat_name, leading_spaces):
+    """ Return the lines that replace a "!## <action> <cat_name>" line of the template
+    """
+    output = []
+    if action == "declare":
+        for var_name in parameters[cat_name]:
+            var_dict = parameters[cat_name][var_name]
+            comment = "! %s" % var_dict["longname"]
+            if var_dict["datatype"] in ("real", "integer"):
+                comment = comment + " [units: %s]" % var_dict["units"]
+            output.append("%s%s%s, target :: %s   %s" % (leading_spaces,
+                                                      types[var_dict["datatype"]],
+                                                      fortran_array_dims(var_dict),
+                                                      var_name,
+                                                      comment))
+    if action == "metadata":
+        for line in metadata_lines(parameters, cat_name):
+            output.append((leading_spaces + line).rstrip())
+    if action == "define":
+        for line in define_lines(parameters, cat_name):
+            output.append(leading_spaces + line)
+    if action == "pft_defaults":
+        for line in pft_default_lines(parameters, cat_name):
+            output.append((leading_spaces + line).rstrip())
+    if action == "set_to_default":
+        for line in set_to_default_lines(parameters, cat_name):
+            output.append((leading_spaces + line).rstrip())
+    if action == "default":
+        for var_name in parameters[cat_name]:
+            for line in default_lines(var_name, parameters[cat_name][var_name], parameters):
+                output.append(leading_spaces + line)
+    return output
+
+def render(parameters, lines):
+    """ Return generated Fortran code as a string: template lines with !!! lines
+        removed and !## lines replaced by code generated from parameters
+    """
+    from MARBL_profiling import profile_phase
+    output = []
     for single_line in lines:
         # 1. ignore !!!
         if single_line.lstrip().startswith('!!!'):
@@ -41,35 +628,67 @@ with open(out_file, 'w') as fout:
             cat_name = line_array[2]
 
             # iii. act based on action
-            if action == "declare":
-                for var_name in parameters[cat_name]:
-                    comment = "! %s" % parameters[cat_name][var_name]["longname"]
-                    if parameters[cat_name][var_name]["datatype"] in ("real", "integer"):
-                        comment = comment + " [units: %s]" % parameters[cat_name][var_name]["units"]
-                    fout.write("%s%s, target :: %s   %s\n" % (leading_spaces,
-                                                              types[parameters[cat_name][var_name]["datatype"]],
-                                                              var_name,
-                                                              comment))
-            if action == "default":
-                for var_name in parameters[cat_name]:
-                    if parameters[cat_name][var_name]["datatype"] == "string":
-                        fout.write("%s%s = '%s'\n" % (leading_spaces,
-                                                    var_name,
-                                                    parameters[cat_name][var_name]["default_value"]))
-                    if parameters[cat_name][var_name]["datatype"] == "real":
-                        fout.write("%s%s = '%s'\n" % (leading_spaces,
-                                                    var_name,
-                                                    parameters[cat_name][var_name]["default_value"]))
-                    if parameters[cat_name][var_name]["datatype"] == "integer":
-                        fout.write("%s%s = %d\n" % (leading_spaces,
-                                                    var_name,
-                                                    parameters[cat_name][var_name]["default_value"]))
-                    if parameters[cat_name][var_name]["datatype"] == "logical":
-                        strval = ".true." if parameters[cat_name][var_name]["default_value"] else ".false."
-                        fout.write("%s%s = %s\n" % (leading_spaces,
-                                                    var_name,
-                                                    strval))
+            with profile_phase("codegen: %s" % action):
+                output.extend(generated_lines(parameters, action, cat_name, leading_spaces))
             continue
 
         # 3. copy all other lines
-        fout.write("%s\n" % single_line)
+        output.append(single_line)
+    return "\n".join(output) + "\n"
+
+################
+# MAIN PROGRAM #
+################
+
+from sys import exit
+
+in_file  = args.template
+out_file = args.output
+stamp_file = get_stamp_file(out_file)
+logger = logging.getLogger("gen_code")
+
+if args.profile is not None:
+    import atexit
+    from MARBL_profiling import enable_profiling, write_profile
+    enable_profiling()
+    atexit.register(write_profile, args.profile)
+from MARBL_profiling import profile_phase
+
+with profile_phase("stamp check"):
+    input_stamp = get_input_stamp(args.yaml_file, in_file)
+    output_current = output_is_current(out_file, stamp_file, input_stamp)
+if output_current and not args.force:
+    logger.info("%s is up to date" % out_file)
+    exit(0)
+if args.check:
+    logger.info("%s needs to be regenerated" % out_file)
+    exit(1)
+
+from MARBL_defaults import read_parms_file
+
+# Read YAML file to get variables / values
+# (read_parms_file() validates the file and caches the result)
+parameters = read_parms_file(args.yaml_file)
+
+# Read template file line by line
+with open(in_file) as fin:
+    lines = [x.strip('\n') for x in fin.readlines()]
+
+with profile_phase("render"):
+    contents = render(parameters, lines)
+
+# Only write output if it changed (avoid touching it, which would trigger a recompile)
+try:
+    with open(out_file) as fin:
+        old_contents = fin.read()
+except (IOError, OSError):
+    old_contents = None
+if contents == old_contents:
+    logger.info("%s is unchanged" % out_file)
+else:
+    with profile_phase("write output"):
+        atomic_write(out_file, contents)
+    logger.info("Wrote %s" % out_file)
+
+input_stamp["output"] = file_hash(out_file)
+write_stamp(stamp_file, input_stamp)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# This script generates the input files for a perturbed-parameter ensemble: it samples
+# the parameters listed in a perturbation spec (and / or on the command line) and
+# writes one input file per member, or every member to a single input file. Either
+# can be passed to print_defaults.py --ensemble. Members are checked against the YAML
+# file as they are generated, so every file written is one MARBL accepts.
+
+################################
+# Parse command line arguments #
+################################
+
+import argparse
+
+parser = argparse.ArgumentParser(description="Generate perturbed-parameter ensemble input files")
+
+# Command line argument to point to YAML file (default is parameters.yaml)
+parser.add_argument('-y', '--yaml_file', action='store', dest='yaml_file', default='parameters.yaml',
+                    help='Location of YAML-formatted MARBL configuration file')
+
+# Command line argument to where we will run MARBL
+parser.add_argument('-g', '--grid', action='store', dest='grid', default='CESM_x1',
+                    help='Some default values are grid-dependent')
+
+# Command line argument to point to input file applied to every member
+parser.add_argument('-i', '--input_file', action='store', dest='input_file', default=None,
+                    help='A file that overrides values in YAML for every member')
+
+# Command line arguments describing what to perturb
+parser.add_argument('-s', '--spec', action='store', dest='spec', default=None,
+                    help='Perturbation spec: "varname = min : max" or "varname = val1, val2, ..." per line')
+parser.add_argument('-p', '--perturb', action='append', dest='perturb', default=None, metavar='VAR=MIN:MAX',
+                    help='Perturb VAR (VAR=MIN:MAX or VAR=VAL1,VAL2); repeat for more variables')
+
+# Command line arguments describing how to sample
+parser.add_argument('-n', '--member_cnt', action='store', dest='member_cnt', type=int, required=True,
+                    help='Number of ensemble members')
+parser.add_argument('--design', action='store', dest='design', default='lhs', choices=['uniform', 'lhs', 'halton'],
+                    help='Sampling design')
+parser.add_argument('--seed', action='store', dest='seed', default=None, type=int,
+                    help='Seed for the random number generator')
+
+# Command line arguments for output (one file per member, or a single file)
+parser.add_argument('-o', '--output_dir', action='store', dest='output_dir', default=None,
+                    help='Write <member>.input to this directory for each member')
+parser.add_argument('-f', '--output_file', action='store', dest='output_file', default=None,
+                    help='Write every member to this file ("-" for stdout)')
+
+# Command line argument to skip validation of each member
+parser.add_argument('--no_validate', action='store_false', dest='validate',
+                    help='Do not check members against the datatype, valid_values, valid_range and constraints in YAML')
+
+# Path to directory containing MARBL_perturbation.py
+parser.add_argument('-l', '--lib_dir', action='store', dest='lib_dir', default='./',
+                    help='Directory that contains MARBL_perturbation.py')
+args = parser.parse_args()
+
+if (args.output_dir is None) == (args.output_file is None):
+    parser.error("Specify exactly one of --output_dir and --output_file")
+if args.spec is None and args.perturb is None:
+    parser.error("Specify --spec and / or --perturb")
+
+##################
+# Set up logging #
+##################
+
+import logging
+logging.basicConfig(format='%(levelname)s (%(funcName)s): %(message)s', level=logging.DEBUG)
+
+################
+# BEGIN SCRIPT #
+################
+
+from sys import path as sys_path, stdout, exit
+sys_path.insert(0, args.lib_dir)
+from MARBL_perturbation import MARBL_perturbation_class, read_perturbation_spec
+from MARBL_defaults import _tokenize_input_line
+
+# Spec file first, then --perturb (which may add variables or replace them)
+if args.spec is not None:
+    spec, spec_sources = read_perturbation_spec(args.spec)
+else:
+    from collections import OrderedDict
+    spec, spec_sources = OrderedDict(), dict()
+for perturbation in args.perturb or []:
+    try:
+        varname, values = _tokenize_input_line(perturbation)
+    except (TypeError, ValueError):
+        logging.error("--perturb %s: expecting VAR=MIN:MAX or VAR=VAL1,VAL2" % perturbation)
+        exit(1)
+    spec[varname] = values
+    spec_sources[varname] = "--perturb"
+
+Perturbation = MARBL_perturbation_class(args.yaml_file, args.grid, spec, args.member_cnt, design=args.design,
+                                        seed=args.seed, input_file=args.input_file, spec_sources=spec_sources,
+                                        validate=args.validate)
+if args.output_dir is not None:
+    Perturbation.write_input_files(args.output_dir)
+elif args.output_file == '-':
+    Perturbation.write_input_file(stdout)
+else:
+    Perturbation.save_input_file(args.output_file)
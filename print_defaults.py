@@ -23,8 +23,116 @@ parser.add_argument('-i', '--input_file', action='store', dest='input_file', def
 # Path to directory containing MARBL_defaults.py
 parser.add_argument('-l', '--lib_dir', action='store', dest='lib_dir', default='./',
                     help='Directory that contains MARBL_defaults.py')
+
+# Command line argument to specify a directory or glob of input files (ensemble mode)
+parser.add_argument('-e', '--ensemble', action='store', dest='ensemble', default=None,
+                    help='Directory or glob pattern of input files; print defaults for each ensemble member')
+
+# Command line argument to write one file per ensemble member (default is a combined table)
+parser.add_argument('-o', '--output_dir', action='store', dest='output_dir', default=None,
+                    help='In ensemble mode, write <input file>.defaults to this directory for each member')
+
+# Command line argument to specify number of processes to use in ensemble mode
+parser.add_argument('-n', '--nprocs', action='store', dest='nprocs', default=None, type=int,
+                    help='In ensemble mode, number of processes to use (default is one per CPU)')
+
+# Command line arguments to control the cached copy of the YAML file
+parser.add_argument('--no_cache', action='store_false', dest='use_cache',
+                    help='Do not read or write the cached copy of the YAML file')
+parser.add_argument('--clear_cache', action='store_true', dest='clear_cache',
+                    help='Remove the cached copy of the YAML file before reading it')
+
+# Command line argument to skip checking values against valid_values, valid_range, etc.
+parser.add_argument('--no_validate', action='store_false', dest='validate',
+                    help='Do not check values against the datatype, valid_values, valid_range and constraints in YAML')
+
+# Command line argument to resolve every combination of grids (-g grid1,grid2) and settings
+parser.add_argument('-m', '--matrix', action='append', dest='matrix', default=None, metavar='VAR=VAL1,VAL2',
+                    help='Print only the values that differ between configurations; repeat for more variables')
+
+# Command line arguments to compare every member with a baseline (default: no input file)
+parser.add_argument('-d', '--diff', action='store_true', dest='diff',
+                    help='In ensemble / matrix mode, report the values that differ from the baseline')
+parser.add_argument('--baseline', action='store', dest='baseline', default=None,
+                    help='Input file for the baseline that --diff compares members with')
+
+# Command line argument to write the resolved values to a binary settings file (see MARBL_settings_file.py)
+parser.add_argument('-b', '--binary_file', action='store', dest='binary_file', default=None,
+                    help='Write the values (every member in ensemble / matrix mode) to this binary file instead of stdout')
+
+# Command line arguments for the cache of resolved settings (see MARBL_result_cache.py)
+parser.add_argument('--result_cache', action='store', dest='result_cache', default=None,
+                    help='Directory that caches resolved settings (default is $MARBL_RESULT_CACHE, if set); ' +
+                         'not used with --ensemble or --matrix')
+parser.add_argument('--result_cache_size', action='store', dest='result_cache_size', default=None, type=int,
+                    help='Largest size of the result cache in MB (default is 64)')
+parser.add_argument('--result_cache_stats', action='store_true', dest='result_cache_stats',
+                    help='Print result cache statistics to stderr')
+
+# Command line argument to report where the time goes
+parser.add_argument('--profile', action='store', dest='profile', default=None, nargs='?', const='-',
+                    help='Print time spent in each phase to stderr (or write it to PROFILE; JSON if it ends in .json)')
+
+# Command line arguments for the resolver server (see MARBL_server.py)
+parser.add_argument('--server', action='store_true', dest='server',
+                    help='Run a server that keeps schemas in memory and answers --client requests')
+parser.add_argument('--stop_server', action='store_true', dest='stop_server',
+                    help='Stop the server listening on the socket')
+parser.add_argument('--client', action='store_true', dest='client',
+                    help='Ask the server for the defaults (resolve them here if no server is running)')
+parser.add_argument('--socket', action='store', dest='socket', default=None,
+                    help='Socket for --server / --client (default is $MARBL_DEFAULTS_SOCKET or a per-user socket)')
 args = parser.parse_args()
 
+if args.ensemble is not None and args.input_file is not None:
+    parser.error("Can not specify both --input_file and --ensemble")
+if args.output_dir is not None and args.ensemble is None:
+    parser.error("--output_dir requires --ensemble")
+if args.matrix is not None and args.ensemble is not None:
+    parser.error("Can not specify both --matrix and --ensemble")
+if args.client and (args.ensemble is not None or args.matrix is not None or args.profile is not None or
+                    args.binary_file is not None):
+    parser.error("--client can not be used with --ensemble, --matrix, --profile or --binary_file")
+if args.binary_file is not None and args.output_dir is not None:
+    parser.error("Can not specify both --binary_file and --output_dir")
+if args.diff and args.ensemble is None and args.matrix is None:
+    parser.error("--diff requires --ensemble or --matrix")
+if args.diff and (args.binary_file is not None or args.output_dir is not None):
+    parser.error("--diff can not be used with --binary_file or --output_dir")
+if args.baseline is not None and not args.diff:
+    parser.error("--baseline requires --diff")
+if int(args.server) + int(args.stop_server) + int(args.client) > 1:
+    parser.error("Only one of --server, --stop_server and --client can be specified")
+if args.result_cache is not None and (args.ensemble is not None or args.matrix is not None):
+    parser.error("--result_cache can not be used with --ensemble or --matrix")
+if args.result_cache is None and args.ensemble is None and args.matrix is None:
+    from os import environ
+    args.result_cache = environ.get("MARBL_RESULT_CACHE") or None
+if (args.result_cache_size is not None or args.result_cache_stats) and args.result_cache is None:
+    parser.error("--result_cache_size and --result_cache_stats require --result_cache")
+
+###########################################
+# Client mode: let the server do the work #
+###########################################
+
+from sys import path as sys_path, stdout, stderr, exit
+sys_path.insert(0, args.lib_dir)
+
+if args.client or args.stop_server:
+    from MARBL_server import get_default_socket_path, request_defaults, shutdown_server
+    if args.socket is None:
+        args.socket = get_default_socket_path()
+    if args.stop_server:
+        if not shutdown_server(args.socket):
+            stderr.write("No server is listening on %s\n" % args.socket)
+            exit(1)
+        exit(0)
+    status = request_defaults(args.socket, args.yaml_file, args.grid, args.input_file, stdout, stderr,
+                              args.validate)
+    if status is not None:
+        exit(status)
+    # No server is running: fall back to resolving the defaults in this process
+
 ##################
 # Set up logging #
 ##################
@@ -32,23 +140,210 @@ args = parser.parse_args()
 import logging
 logging.basicConfig(format='%(levelname)s (%(funcName)s): %(message)s', level=logging.DEBUG)
 
-###################################
-# Initialize class from YAML file #
-###################################
+#############
+# FUNCTIONS #
+#############
+
+def print_ensemble_table(fout, Ensemble):
+    """ Write a single tab-separated table: one row per variable, one column per member
+        (blank entries for variables that only exist in some members, e.g. autotrophs(3)%...)
+    """
+    from MARBL_defaults import _sort, _natural_sort_key
+    members = Ensemble.get_member_names()
+    fout.write("\t".join(["subcategory", "varname"] + [path.basename(member) for member in members]) + "\n")
+    for subcat_name in Ensemble.get_subcategory_names():
+        varnames = set()
+        for member in members:
+            varnames.update(Ensemble.get_parm_dict_variable_names(member, subcat_name))
+        for varname in _sort(varnames, sort_key=_natural_sort_key):
+            row = [subcat_name, varname]
+            for member in members:
+                parm_dict = Ensemble.get_parm_dict(member)
+                row.append(str(parm_dict[varname]) if varname in parm_dict else "")
+            fout.write("\t".join(row) + "\n")
+
+def print_matrix_table(fout, Matrix):
+    """ Write a single tab-separated table of the values that are not the same in every
+        configuration: one row per variable, one column per configuration
+    """
+    configs = Matrix.get_member_names()
+    fout.write("\t".join(["subcategory", "varname"] + configs) + "\n")
+    for subcat_name in Matrix.get_subcategory_names():
+        for varname in Matrix.get_differing_variable_names(subcat_name):
+            row = [subcat_name, varname]
+            for config in configs:
+                parm_dict = Matrix.get_parm_dict(config)
+                row.append(str(parm_dict[varname]) if varname in parm_dict else "")
+            fout.write("\t".join(row) + "\n")
+
+def print_diff_report(fout, Diff):
+    """ Write two tab-separated tables:
+        1. one row per variable that differs from the baseline in any member, sorted by
+           subcategory: baseline value (values separated by " / " if members have
+           different baselines), number of members that differ, and the spread of the
+           members' values (blank for non-numeric variables)
+        2. one row per member: number of changed variables and their names
+    """
+    stats = ["min", "max", "mean", "std", "max_abs_diff"]
+    fout.write("\t".join(["subcategory", "varname", "baseline", "changed", "distinct"] + stats) + "\n")
+    for subcat_name in Diff.get_subcategory_names():
+        for varname in Diff.get_differing_variable_names(subcat_name):
+            spread = Diff.get_spread(varname)
+            baseline_values = ["" if value is None else str(value).strip()
+                               for value in Diff.get_baseline_values(varname)]
+            row = [subcat_name, varname, " / ".join(baseline_values),
+                   str(spread["changed"]), str(spread["distinct"])]
+            row.extend(["" if spread[stat] is None else "%.15g" % spread[stat] for stat in stats])
+            fout.write("\t".join(row) + "\n")
+    fout.write("\n")
+    fout.write("\t".join(["member", "changed", "varnames"]) + "\n")
+    for member in Diff.get_member_names():
+        varnames = Diff.get_changed_variable_names(member)
+        fout.write("\t".join([member, str(len(varnames)), ",".join(varnames)]) + "\n")
+
+def diff_against_baseline(Members, get_member_grid=None):
+    """ Compare every member with the values from args.baseline (or the defaults) for
+        args.grid; if get_member_grid is provided, each member is compared with the
+        baseline for its own grid, get_member_grid(member)
+    """
+    from MARBL_defaults import MARBL_defaults_class
+    from MARBL_ensemble_diff import MARBL_ensemble_diff_class
+    if get_member_grid is None:
+        return MARBL_ensemble_diff_class(Members, MARBL_defaults_class(args.yaml_file, args.grid, args.baseline,
+                                                                       parms=parms))
+    grid_baselines = dict()
+    Baselines = dict()
+    for member in Members.get_member_names():
+        grid = get_member_grid(member)
+        if grid not in grid_baselines:
+            grid_baselines[grid] = MARBL_defaults_class(args.yaml_file, grid, args.baseline, parms=parms)
+        Baselines[member] = grid_baselines[grid]
+    return MARBL_ensemble_diff_class(Members, Baselines)
+
+def write_members_binary(binary_file, Members):
+    """ Write every member of an ensemble (or configuration matrix) to a binary settings file
+    """
+    from MARBL_settings_file import write_settings_file
+    members = [(member, lambda subcat_name, member=member: Members.get_parm_dict_variable_names(member, subcat_name),
+                Members.get_parm_dict(member)) for member in Members.get_member_names()]
+    write_settings_file(binary_file, Members.get_subcategory_names(), members, parms)
 
-from sys import path
-path.insert(0, args.lib_dir)
-from MARBL_defaults import MARBL_defaults_class
-DefaultParms = MARBL_defaults_class(args.yaml_file, args.grid, args.input_file)#, logger)
+def parse_matrix_settings(matrix_args):
+    """ Convert ["var1=val1,val2", "var2=val3,val4"] to an ordered dictionary
+        {var1 : [val1, val2], var2 : [val3, val4]}
+    """
+    from collections import OrderedDict
+    settings = OrderedDict()
+    for matrix_arg in matrix_args:
+        if '=' not in matrix_arg:
+            parser.error("--matrix arguments must look like VAR=VAL1,VAL2 (not '%s')" % matrix_arg)
+        var_name, values = matrix_arg.split('=', 1)
+        settings[var_name.strip()] = [value.strip() for value in values.split(',')]
+    return settings
 
 ################
 # BEGIN SCRIPT #
 ################
 
-# Sort variables by subcategory
-for subcat_name in DefaultParms.get_subcategory_names():
-    print("! %s" % subcat_name.split('. ')[1])
-    for varname in DefaultParms.get_parm_dict_variable_names(subcat_name):
-        print("%s = %s" % (varname, DefaultParms.parm_dict[varname]))
-    if subcat_name != DefaultParms.get_subcategory_names()[-1]:
-        print("")
+from os import path
+
+if args.server:
+    from MARBL_server import get_default_socket_path, serve
+    serve(args.socket or get_default_socket_path(), args.use_cache)
+    exit(0)
+
+if args.profile is not None:
+    import atexit
+    from MARBL_profiling import enable_profiling, write_profile
+    enable_profiling()
+    atexit.register(write_profile, args.profile)
+
+from MARBL_defaults import read_parms_file, clear_schema_cache, print_parm_dict
+if args.clear_cache:
+    clear_schema_cache(args.yaml_file)
+if args.result_cache is None or not args.use_cache:
+    parms = read_parms_file(args.yaml_file, args.use_cache)
+else:
+    # The YAML file is only read if the settings are not in the result cache
+    parms = None
+
+if args.matrix is not None:
+    # Resolve every combination of grids and settings
+    from MARBL_config_matrix import MARBL_config_matrix_class
+    Matrix = MARBL_config_matrix_class(args.yaml_file, args.grid.split(','), parse_matrix_settings(args.matrix),
+                                       args.input_file, parms)
+    if args.validate:
+        from collections import OrderedDict
+        from MARBL_validator import MARBL_validator_class
+        validator = MARBL_validator_class(parms)
+        parm_dicts = OrderedDict([(config, Matrix.get_parm_dict(config)) for config in Matrix.get_member_names()])
+        if validator.log_violations(validator.validate_ensemble(parm_dicts)):
+            exit(1)
+    if args.binary_file is not None:
+        write_members_binary(args.binary_file, Matrix)
+    elif args.diff:
+        # Each configuration is compared with the baseline for its own grid
+        get_member_grid = lambda config: Matrix.get_config_settings(config)["grid"]
+        print_diff_report(stdout, diff_against_baseline(Matrix, get_member_grid))
+    else:
+        print_matrix_table(stdout, Matrix)
+elif args.ensemble is None:
+    if args.result_cache is not None:
+        # Look the settings up in the cache (resolving and storing them on a miss)
+        from MARBL_result_cache import MARBL_result_cache_class
+        from MARBL_validator import log_violations
+        max_size = None if args.result_cache_size is None else args.result_cache_size * 1024 * 1024
+        Cache = MARBL_result_cache_class(args.result_cache, max_size)
+        if args.result_cache_stats:
+            import atexit
+            atexit.register(lambda: stderr.write("Result cache %s: %s\n" % (args.result_cache, Cache.get_stats())))
+        DefaultParms = Cache.get_defaults(args.yaml_file, args.grid, args.input_file, parms=parms,
+                                          validate=args.validate)
+        if args.validate and log_violations(DefaultParms.get_violations()):
+            exit(1)
+    else:
+        # Initialize class from YAML file
+        from MARBL_defaults import MARBL_defaults_class
+        DefaultParms = MARBL_defaults_class(args.yaml_file, args.grid, args.input_file, parms=parms)#, logger)
+        if args.validate:
+            from MARBL_validator import MARBL_validator_class
+            validator = MARBL_validator_class(parms)
+            if validator.log_violations(DefaultParms.validate(validator)):
+                exit(1)
+
+    # Sort variables by subcategory
+    from MARBL_profiling import profile_phase
+    if args.binary_file is not None:
+        from MARBL_settings_file import write_settings_file
+        member = args.input_file if args.input_file is not None else "default"
+        with profile_phase("write binary file"):
+            write_settings_file(args.binary_file, DefaultParms.get_subcategory_names(),
+                                [(member, DefaultParms.get_parm_dict_variable_names, DefaultParms.parm_dict)],
+                                parms if parms is not None else read_parms_file(args.yaml_file, args.use_cache))
+    else:
+        with profile_phase("print"):
+            print_parm_dict(stdout, DefaultParms.get_subcategory_names(),
+                            DefaultParms.get_parm_dict_variable_names, DefaultParms.parm_dict)
+else:
+    # Read YAML file once, resolve every member
+    from MARBL_ensemble import MARBL_ensemble_class
+    Ensemble = MARBL_ensemble_class(args.yaml_file, args.grid, args.ensemble, args.nprocs, parms)
+    if args.validate:
+        from MARBL_validator import MARBL_validator_class
+        validator = MARBL_validator_class(parms)
+        if validator.log_violations(Ensemble.validate(validator)):
+            exit(1)
+
+    if args.binary_file is not None:
+        write_members_binary(args.binary_file, Ensemble)
+    elif args.diff:
+        print_diff_report(stdout, diff_against_baseline(Ensemble))
+    elif args.output_dir is None:
+        print_ensemble_table(stdout, Ensemble)
+    else:
+        for member in Ensemble.get_member_names():
+            out_file = path.join(args.output_dir, path.basename(member) + ".defaults")
+            with open(out_file, "w") as fout:
+                print_parm_dict(fout, Ensemble.get_subcategory_names(),
+                                lambda subcat_name: Ensemble.get_parm_dict_variable_names(member, subcat_name),
+                                Ensemble.get_parm_dict(member))
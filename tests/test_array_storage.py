@@ -0,0 +1,57 @@
+""" MARBL_defaults_class(array_storage=True): arrays are stored one column per
+    component, and parm_dict still behaves exactly like the key-per-element dictionary.
+"""
+
+import os
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+_TWO_GRAZERS = {"PFT_defaults" : '"user-specified"', "autotroph_cnt" : "2", "max_grazer_prey_cnt" : "2",
+                "zooplankton_cnt" : "2", "grazing(1,2)%auto_ind_cnt" : "2", "grazing(1,2)%auto_ind(1)" : "1",
+                "grazing(1,2)%auto_ind(2)" : "2"}
+
+_CASES = [("CESM_x1", {}),
+          ("CESM_x1", {"parm_scalelen_z(1)" : "1.0e4", "parm_scalelen_z(2)" : "2.0e4",
+                       "autotrophs(2)%PCref_per_day" : "3.3", "grazing(2,1)%z_grz" : "1.5"}),
+          ("CESM_x1", _TWO_GRAZERS),
+          ("CESM_x3", {"ciso_on" : ".true.", "tracer_restore_vars(1)" : "'PO4'",
+                       "tracer_restore_vars(2)" : "'NO3'"})]
+
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize("grid, input_dict", _CASES)
+def test_array_storage_matches_parm_dict(grid, input_dict, lazy):
+    expected = MARBL_defaults_class(None, grid, dict(input_dict), parms=_PARMS)
+    stored = MARBL_defaults_class(None, grid, dict(input_dict), parms=_PARMS, array_storage=True, lazy=lazy)
+    assert stored.parm_dict["grazing(1,1)%z_grz"] == expected.parm_dict["grazing(1,1)%z_grz"]
+    assert list(stored.parm_dict.items()) == list(expected.parm_dict.items())
+    assert len(stored.parm_dict) == len(expected.parm_dict)
+    assert stored.get_subcategory_index() == expected.get_subcategory_index()
+    assert stored.get_tracer_cnt() == expected.get_tracer_cnt()
+
+def test_columns_and_keys():
+    stored = MARBL_defaults_class(None, "CESM_x1", dict(_TWO_GRAZERS), parms=_PARMS, array_storage=True)
+    grazing = stored.parm_dict.get_parm_array("grazing")
+    assert grazing.get_size() == 4
+    assert list(grazing.get_column("auto_ind_cnt"))[1] == 2
+    assert grazing.get_column("auto_ind")[1] == [1, 2]
+    assert "grazing(1,2)%auto_ind(2)" in stored.parm_dict
+    for key in ["grazing(3,1)%z_grz", "grazing(1,2)%auto_ind(3)", "grazing(1,2)%auto_ind",
+                "autotrophs(1)%kFe(1)", "parm_scalelen_z(5)", "not_a_key"]:
+        assert key not in stored.parm_dict
+
+    # Typed columns fall back to lists for values they can not hold
+    stored.parm_dict["grazing(1,2)%auto_ind_cnt"] = "x"
+    assert stored.parm_dict["grazing(1,2)%auto_ind_cnt"] == "x"
+    assert stored.parm_dict["grazing(2,2)%auto_ind_cnt"] == grazing.get_column("auto_ind_cnt")[3]
+
+def test_unknown_variables_abort():
+    with pytest.raises(SystemExit):
+        MARBL_defaults_class(None, "CESM_x1", {"not_a_var" : "3"}, parms=_PARMS, array_storage=True)
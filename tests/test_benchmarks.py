@@ -0,0 +1,53 @@
+""" benchmarks/: synthetic parameter and input files are valid MARBL files of the
+    requested size, and run_benchmarks.py reports every phase it times.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.join(PACKAGE_DIR, "benchmarks")
+sys.path.insert(0, PACKAGE_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+from synthetic_parms import get_synthetic_var_name, write_synthetic_files
+
+_YAML_FILE = os.path.join(PACKAGE_DIR, "parameters.yaml")
+
+def test_synthetic_files_resolve(tmp_path):
+    yaml_file = str(tmp_path / "synthetic.yaml")
+    input_file = str(tmp_path / "synthetic_input.txt")
+    write_synthetic_files(_YAML_FILE, yaml_file, input_file, 30, nvars=24, array_size=5, autotroph_cnt=4,
+                          zooplankton_cnt=2, default_keys=3)
+    parms = read_parms_file(yaml_file, use_cache=False)
+    assert len([var_name for var_name in parms["general_parms"] if var_name.startswith("synthetic_")]) == 24
+
+    DefaultParms = MARBL_defaults_class(None, "CESM_x3", input_file, parms=parms)
+    parm_dict = DefaultParms.parm_dict
+    assert parm_dict["autotroph_cnt"] == 4 and parm_dict["zooplankton_cnt"] == 2
+    assert "grazing(4,2)%z_grz" in parm_dict
+    # Every fourth synthetic variable is an array
+    assert "%s(5)" % get_synthetic_var_name(3) in parm_dict
+    assert "%s(6)" % get_synthetic_var_name(3) not in parm_dict
+    # Every input file line was used
+    with open(input_file) as fin:
+        assert len(fin.readlines()) == 30
+    assert len(set([source.rsplit(":", 1)[1] for source in DefaultParms.get_parm_dict_sources().values()])) == 30
+
+def test_run_benchmarks(tmp_path):
+    out_file = str(tmp_path / "results.json")
+    proc = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS_DIR, "run_benchmarks.py"), "-s", "1,2",
+                             "-r", "1", "--nvars", "8", "--input_lines", "8", "--no_codegen", "-o", out_file],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    messages = proc.communicate()[0]
+    assert proc.returncode == 0, messages
+    with open(out_file) as fin:
+        results = json.load(fin)
+    assert [scenario["name"] for scenario in results["scenarios"]] == ["x1", "x2"]
+    assert results["scenarios"][1]["parm_dict_keys"] > results["scenarios"][0]["parm_dict_keys"]
+    for scenario in results["scenarios"]:
+        assert sorted(scenario["timings"].keys()) == sorted(["load", "validate", "parse", "resolve", "print"])
+    assert sorted(results["slopes"].keys()) == sorted(["load", "validate", "parse", "resolve", "print"])
@@ -0,0 +1,45 @@
+""" MARBL_config_matrix: every configuration resolves to the same settings as a fresh
+    MARBL_defaults_class object, even though values are shared between configurations.
+"""
+
+import os
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from collections import OrderedDict
+from MARBL_config_matrix import MARBL_config_matrix_class
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+_GRIDS = ["CESM_x1", "CESM_x3"]
+_SETTINGS = OrderedDict([("ciso_on", [".true.", ".false."])])
+
+def test_configurations_match_fresh_resolves():
+    Matrix = MARBL_config_matrix_class(None, _GRIDS, settings=_SETTINGS, parms=_PARMS)
+    configs = Matrix.get_member_names()
+    assert len(configs) == 4
+    for config in configs:
+        config_settings = Matrix.get_config_settings(config)
+        fresh = MARBL_defaults_class(None, config_settings["grid"], {"ciso_on" : config_settings["ciso_on"]},
+                                     parms=_PARMS)
+        assert list(Matrix.get_parm_dict(config).items()) == list(fresh.parm_dict.items())
+    computed, resolved = Matrix.get_cache_stats()
+    assert computed < resolved
+
+def test_differing_variable_names():
+    Matrix = MARBL_config_matrix_class(None, ["CESM_x1"], settings=_SETTINGS, parms=_PARMS)
+    assert Matrix.get_differing_variable_names("2. config flags") == ["ciso_on"]
+    assert Matrix.get_differing_variable_names("1. config PFTs") == []
+    Matrix = MARBL_config_matrix_class(None, ["CESM_x1"], parms=_PARMS)
+    assert Matrix.get_differing_variable_names("2. config flags") == []
+
+@pytest.mark.parametrize("grids, settings", [([], None),
+                                             (_GRIDS, OrderedDict([("ciso_on", [])]))])
+def test_empty_matrix_is_refused(grids, settings):
+    with pytest.raises(SystemExit):
+        MARBL_config_matrix_class(None, grids, settings=settings, parms=_PARMS)
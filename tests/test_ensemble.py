@@ -0,0 +1,63 @@
+""" MARBL_ensemble: every member resolves to the same settings as a MARBL_defaults_class
+    object built from its input file, with or without a process pool.
+"""
+
+import os
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+from MARBL_ensemble import MARBL_ensemble_class, get_ensemble_input_files
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+_INPUTS = [("member2.input", [u"parm_Fe_bioavail = 0.5"]),
+           ("member10.input", [u"ciso_on = .true."]),
+           ("multi.input", [u"!! member low", u"parm_Fe_bioavail = 0.25",
+                            u"!! member high", u"parm_Fe_bioavail = 0.75"])]
+
+_EXPECTED = [("member2.input", {"parm_Fe_bioavail" : "0.5"}),
+             ("member10.input", {"ciso_on" : ".true."}),
+             ("multi.input:low", {"parm_Fe_bioavail" : "0.25"}),
+             ("multi.input:high", {"parm_Fe_bioavail" : "0.75"})]
+
+def _write_inputs(tmp_path, inputs=_INPUTS):
+    input_dir = tmp_path / "inputs"
+    input_dir.mkdir()
+    for name, lines in inputs:
+        (input_dir / name).write_text(u"".join([line + u"\n" for line in lines]))
+    return str(input_dir)
+
+@pytest.mark.parametrize("nprocs", [1, 2])
+def test_members_match_fresh_resolves(tmp_path, nprocs):
+    input_dir = _write_inputs(tmp_path)
+    Ensemble = MARBL_ensemble_class(None, "CESM_x1", input_dir, nprocs=nprocs, parms=_PARMS)
+    assert Ensemble.get_member_names() == [os.path.join(input_dir, name) for name, input_dict in _EXPECTED]
+    for member, (name, input_dict) in zip(Ensemble.get_member_names(), _EXPECTED):
+        fresh = MARBL_defaults_class(None, "CESM_x1", dict(input_dict), parms=_PARMS)
+        assert list(Ensemble.get_parm_dict(member).items()) == list(fresh.parm_dict.items())
+        assert Ensemble.get_tracer_cnt(member) == fresh.get_tracer_cnt()
+        for subcategory in Ensemble.get_subcategory_names():
+            assert Ensemble.get_parm_dict_variable_names(member, subcategory) == \
+                   fresh.get_parm_dict_variable_names(subcategory)
+    assert Ensemble.validate() == []
+
+def test_input_file_patterns(tmp_path):
+    input_dir = _write_inputs(tmp_path)
+    names = [name for name, lines in _INPUTS]
+    assert get_ensemble_input_files(os.path.join(input_dir, "member*.input")) == \
+           [os.path.join(input_dir, name) for name in names[:2]]
+    assert get_ensemble_input_files(["run10", "run2"]) == ["run2", "run10"]
+    with pytest.raises(SystemExit):
+        get_ensemble_input_files(os.path.join(input_dir, "*.missing"))
+
+@pytest.mark.parametrize("nprocs", [1, 2])
+def test_bad_members_abort(tmp_path, nprocs):
+    input_dir = _write_inputs(tmp_path, _INPUTS + [("bad.input", [u"parm_Fe_bioavail = '0.5"]),
+                                                   ("unknown.input", [u"not_a_parameter = 1"])])
+    with pytest.raises(SystemExit):
+        MARBL_ensemble_class(None, "CESM_x1", input_dir, nprocs=nprocs, parms=_PARMS)
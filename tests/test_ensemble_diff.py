@@ -0,0 +1,75 @@
+""" MARBL_ensemble_diff: members are compared with the baseline value by value
+    (numbers as numbers), and each member can have a baseline of its own.
+"""
+
+import os
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from collections import OrderedDict
+from MARBL_config_matrix import MARBL_config_matrix_class
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+from MARBL_ensemble_diff import MARBL_ensemble_diff_class
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+class _Members(object):
+    """ The parts of the MARBL_ensemble_class interface the diff uses, for a few
+        input dictionaries resolved on CESM_x1
+    """
+
+    def __init__(self, input_dicts):
+        self._resolved = OrderedDict([(member, MARBL_defaults_class(None, "CESM_x1", dict(input_dict), parms=_PARMS))
+                                      for member, input_dict in input_dicts.items()])
+
+    def get_member_names(self):
+        return list(self._resolved.keys())
+
+    def get_parm_dict(self, member):
+        return self._resolved[member].parm_dict
+
+    def get_parm_dict_variable_names(self, member, subcategory):
+        return self._resolved[member].get_parm_dict_variable_names(subcategory)
+
+def _defaults(grid="CESM_x1"):
+    return MARBL_defaults_class(None, grid, None, parms=_PARMS)
+
+def test_numbers_are_compared_as_numbers():
+    # Overrides are formatted as 1.000000000000000e+00, the YAML default is the float 1.0
+    Members = _Members(OrderedDict([("same", {"parm_Fe_bioavail" : "1.0"}),
+                                    ("changed", {"parm_Fe_bioavail" : "0.75"}),
+                                    ("default", {})]))
+    Diff = MARBL_ensemble_diff_class(Members, _defaults())
+    assert Diff.get_changed_member_names("parm_Fe_bioavail") == ["changed"]
+    assert Diff.get_changed_variable_names("same") == []
+    spread = Diff.get_spread("parm_Fe_bioavail")
+    assert spread["changed"] == 1 and spread["distinct"] == 3
+    assert spread["min"] == 0.75 and spread["max"] == 1.0
+    assert spread["max_abs_diff"] == 0.25
+
+def test_missing_keys_count_as_changes():
+    Members = _Members(OrderedDict([("two", {"PFT_defaults" : '"user-specified"', "autotroph_cnt" : "2",
+                                             "zooplankton_cnt" : "1", "max_grazer_prey_cnt" : "2"})]))
+    Diff = MARBL_ensemble_diff_class(Members, _defaults())
+    changed = Diff.get_changed_variable_names("two")
+    assert "autotrophs(3)%sname" in changed
+    assert Diff.get_baseline_value("autotrophs(3)%sname") is not None
+    assert Diff.get_spread("autotrophs(3)%sname")["max_abs_diff"] is None
+
+def test_matrix_members_are_compared_with_their_own_grid():
+    Matrix = MARBL_config_matrix_class(None, ["CESM_x1", "CESM_x3"], parms=_PARMS)
+    configs = Matrix.get_member_names()
+
+    # One baseline: grid-dependent values show up as changes of the CESM_x3 configuration
+    Diff = MARBL_ensemble_diff_class(Matrix, _defaults("CESM_x1"))
+    grid_keys = Diff.get_changed_variable_names(configs[1])
+    assert grid_keys and Diff.get_changed_variable_names(configs[0]) == []
+
+    # A baseline per grid: no changes at all
+    Baselines = dict([(config, _defaults(Matrix.get_config_settings(config)["grid"])) for config in configs])
+    Diff = MARBL_ensemble_diff_class(Matrix, Baselines)
+    assert [Diff.get_changed_variable_names(config) for config in configs] == [[], []]
+    assert len(Diff.get_baseline_values(grid_keys[0])) == 2
+    assert Diff.get_baseline_value(grid_keys[0], configs[1]) == Matrix.get_parm_dict(configs[1])[grid_keys[0]]
@@ -0,0 +1,60 @@
+""" MARBL_expression: arithmetic on numbers and named constants is evaluated, anything
+    else is refused before it reaches eval().
+"""
+
+import os
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import MARBL_expression
+from MARBL_expression import evaluate_real_expression, evaluate_real_expression_array, clear_expression_cache
+
+@pytest.mark.parametrize("expr, value", [("1.0/117", 1.0/117),
+                                         ("c1 / spd", 1.0/86400.0),
+                                         ("-2 ** 2", -4.0),
+                                         ("1.0d-3", 1.0e-3),
+                                         ("2.5_r8 * (c2 + 1)", 7.5)])
+def test_valid_expressions(expr, value):
+    assert evaluate_real_expression(expr) == pytest.approx(value)
+
+@pytest.mark.parametrize("expr", ["__import__('os')",
+                                  "().__class__",
+                                  "unknown_constant * 2",
+                                  "[1, 2][0]",
+                                  "True + 1",
+                                  "'abc'",
+                                  "1 +",
+                                  "1.0 / 0",
+                                  "10 ** 10 ** 10",
+                                  "(-8) ** 0.5"])
+def test_invalid_expressions_are_refused(expr):
+    with pytest.raises(SystemExit):
+        evaluate_real_expression(expr, "parm_test")
+
+def test_array_evaluation():
+    result = evaluate_real_expression_array("c1 / (x * spd)", ["1.0", "2.0"])
+    assert list(result) == [1.0/86400.0, 1.0/(2*86400.0)]
+    assert list(evaluate_real_expression_array("c2", [1, 2, 3])) == [2.0, 2.0, 2.0]
+    with pytest.raises(SystemExit):
+        evaluate_real_expression_array("c1 / x", ["1.0", "0.0"])
+
+def test_expressions_are_compiled_once(monkeypatch):
+    compiled = []
+    compile_expression = MARBL_expression._compile_expression
+    def counting_compile(expr, var_names):
+        compiled.append(expr)
+        return compile_expression(expr, var_names)
+    monkeypatch.setattr(MARBL_expression, "_compile_expression", counting_compile)
+    clear_expression_cache()
+    for n in range(3):
+        evaluate_real_expression("c1 / 117")
+    assert compiled == ["c1 / 117"]
+
+    monkeypatch.setattr(MARBL_expression, "_EXPRESSION_CACHE_SIZE", 1)
+    evaluate_real_expression("c2 / 117")
+    evaluate_real_expression("c1 / 117")
+    assert compiled == ["c1 / 117", "c2 / 117", "c1 / 117"]
@@ -0,0 +1,178 @@
+""" gen_code.py: generated files are only rewritten when the code changes, and the
+    generated tables hold the values and metadata from the YAML file.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from collections import OrderedDict
+from MARBL_defaults import MARBL_defaults_class, read_parms_file, get_subcategory_list
+from MARBL_expression import evaluate_real_expression
+
+_YAML_FILE = os.path.join(PACKAGE_DIR, "parameters.yaml")
+_PARMS = read_parms_file(_YAML_FILE)
+
+def _gen_code(tmp_path, template="marbl_settings_mod.template", *flags):
+    """ Run gen_code.py on a copy of template in tmp_path; returns (exit status, output
+        file, log messages)
+    """
+    template_copy = str(tmp_path / template)
+    if not os.path.isfile(template_copy):
+        shutil.copy(os.path.join(PACKAGE_DIR, template), template_copy)
+    out_file = str(tmp_path / template.replace(".template", ".F90"))
+    proc = subprocess.Popen([sys.executable, os.path.join(PACKAGE_DIR, "gen_code.py"), "-y", _YAML_FILE,
+                             "-t", template_copy, "-o", out_file] + list(flags),
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    messages = proc.communicate()[0]
+    return proc.returncode, out_file, messages
+
+def _read_output(tmp_path, template="marbl_settings_mod.template"):
+    status, out_file, messages = _gen_code(tmp_path, template)
+    assert status == 0, messages
+    with open(out_file) as fin:
+        return fin.read()
+
+def _get_table(code, table_name):
+    """ Values of a "<type>, parameter :: table_name(...) = (/ ... /)" declaration in the
+        generated code (strings without quotes, everything else as written)
+    """
+    match = re.search(r"parameter :: %s\([\w:]+\) = \(/ (?:character\(len=\d+\) :: )?&\n(.*?) /\)" % table_name,
+                      code, re.DOTALL)
+    assert match is not None, table_name
+    return [string.replace("''", "'") if other == "" else other
+            for string, other in re.findall(r"'((?:[^']|'')*)'|([^,\s&]+)", match.group(1))]
+
+def _get_pointers(code, group_name):
+    """ The pointer assigned in each case of the registration loop over a table group
+    """
+    loop = code.split("do var_ind = 1, %s_table_len" % group_name, 1)[1].split("end select", 1)[0]
+    return [target for case, target in re.findall(r"case \((\d+)\)\n\s+\w+ => (\S+)", loop)]
+
+def _get_table_groups(cat_name):
+    """ (group name, {variable name : variable dictionary}) for every table in a category:
+        one per derived type, and one named after the category for everything else
+    """
+    plain_vars = OrderedDict()
+    groups = []
+    for var_name, var_dict in _PARMS[cat_name].items():
+        if isinstance(var_dict["datatype"], dict):
+            groups.append((var_name, OrderedDict([(comp_name, comp_dict) for comp_name, comp_dict in
+                                           var_dict["datatype"].items() if comp_name[0] != "_"])))
+        else:
+            plain_vars[var_name] = var_dict
+    if plain_vars:
+        groups.insert(0, (cat_name, plain_vars))
+    return groups
+
+def _age(file_name):
+    """ Move the modification time of file_name an hour into the past, so rewriting it
+        can be detected
+    """
+    mtime = os.path.getmtime(file_name) - 3600
+    os.utime(file_name, (mtime, mtime))
+    return mtime
+
+def test_unchanged_output_is_not_rewritten(tmp_path):
+    status, out_file, messages = _gen_code(tmp_path)
+    assert status == 0 and "Wrote" in messages
+    mtime = _age(out_file)
+
+    status, out_file, messages = _gen_code(tmp_path)
+    assert status == 0 and "is up to date" in messages
+    status, out_file, messages = _gen_code(tmp_path, "marbl_settings_mod.template", "--force")
+    assert status == 0 and "is unchanged" in messages
+    assert os.path.getmtime(out_file) == mtime
+    assert _gen_code(tmp_path, "marbl_settings_mod.template", "--check")[0] == 0
+
+def test_changed_inputs_are_regenerated(tmp_path):
+    status, out_file, messages = _gen_code(tmp_path)
+    with open(out_file) as fin:
+        contents = fin.read()
+
+    # A change to the template is a change to the output
+    with open(str(tmp_path / "marbl_settings_mod.template"), "a") as fout:
+        fout.write("! one more line\n")
+    assert _gen_code(tmp_path, "marbl_settings_mod.template", "--check")[0] == 1
+    status, out_file, messages = _gen_code(tmp_path)
+    assert "Wrote" in messages
+    with open(out_file) as fin:
+        assert fin.read() == contents + "! one more line\n"
+
+    # So is an edited output file
+    with open(out_file, "a") as fout:
+        fout.write("! edited by hand\n")
+    assert _gen_code(tmp_path, "marbl_settings_mod.template", "--check")[0] == 1
+    status, out_file, messages = _gen_code(tmp_path)
+    with open(out_file) as fin:
+        assert fin.read() == contents + "! one more line\n"
+
+def test_check_and_force_are_exclusive(tmp_path):
+    assert _gen_code(tmp_path, "marbl_settings_mod.template", "--check", "--force")[0] == 2
+
+def test_every_setting_is_registered_from_the_tables(tmp_path):
+    code = _read_output(tmp_path)
+    for cat_name in _PARMS["_order"]:
+        for group_name, group_vars in _get_table_groups(cat_name):
+            snames = _get_table(code, "%s_snames" % group_name)
+            assert snames == list(group_vars.keys())
+            for column, key in [("lnames", "longname"), ("units", "units"), ("datatypes", "datatype")]:
+                assert _get_table(code, "%s_%s" % (group_name, column)) == \
+                       [str(group_vars[var_name][key]) for var_name in snames]
+            pointers = _get_pointers(code, group_name)
+            assert len(pointers) == len(snames)
+            for sname, pointer in zip(snames, pointers):
+                assert re.match(r"^(\w+\([m,n]+\)%%)?%s(\(1:.*\))?$" % sname, pointer), (sname, pointer)
+
+def test_settings_are_logged_in_subcategory_order(tmp_path):
+    code = _read_output(tmp_path)
+    subcat_list = get_subcategory_list(_PARMS)
+    assert subcat_list == MARBL_defaults_class(None, "CESM_x1", None, parms=_PARMS).get_subcategory_names()
+    for cat_name in _PARMS["_order"]:
+        for group_name, group_vars in _get_table_groups(cat_name):
+            subcats = [var_dict["subcategory"] for var_dict in group_vars.values()]
+            assert _get_table(code, "%s_subcat_inds" % group_name) == \
+                   [str(subcat_list.index(subcat)+1) for subcat in subcats]
+            if group_name == cat_name:
+                assert _get_table(code, "%s_categories" % group_name) == \
+                       [subcat.split(". ", 1)[-1] for subcat in subcats]
+
+def _same_value(datatype, table_value, parm_value):
+    """ Compare a value from a generated table with a parm_dict (or YAML) value
+    """
+    if datatype == "real":
+        return evaluate_real_expression(table_value) == evaluate_real_expression(str(parm_value))
+    if datatype == "string":
+        return table_value == str(parm_value).strip('"').strip("'")
+    if datatype == "integer":
+        return int(table_value) == int(parm_value)
+    return table_value.lower() == str(parm_value).lower()
+
+def test_pft_defaults_match_resolved_values(tmp_path):
+    code = _read_output(tmp_path, "marbl_pft_mod.template")
+    parm_dict = MARBL_defaults_class(None, "CESM_x1", None, parms=_PARMS).parm_dict
+    pft_keys = _PARMS["general_parms"]["PFT_defaults"]["_CESM2_PFT_keys"]
+    for parent_var, components in _get_table_groups("PFT_derived_types"):
+        element = parent_var[:-1] if parent_var.endswith("s") else parent_var
+        assert _get_table(code, "%s_default_ids" % element) == ["unset"] + pft_keys[parent_var]
+        # The CESM2 PFTs fill the array in C order (last index fastest)
+        elements = sorted(set([key.split("%")[0] for key in parm_dict.keys() if key.startswith(parent_var + "(")]),
+                          key=lambda name: [int(ind) for ind in name[len(parent_var)+1:-1].split(",")])
+        assert len(elements) == len(pft_keys[parent_var])
+        for comp_name, comp_dict in components.items():
+            if "_array_size" in comp_dict:
+                continue
+            datatype = comp_dict["datatype"]
+            table = _get_table(code, "%s_%s_defaults" % (element, comp_name))
+            default_value = comp_dict["default_value"]
+            if isinstance(default_value, dict):
+                default_value = default_value["default"]
+            assert _same_value(datatype, table[0], default_value), (comp_name, table[0])
+            for table_value, element_name in zip(table[1:], elements):
+                parm_key = "%s%%%s" % (element_name, comp_name)
+                assert _same_value(datatype, table_value, parm_dict[parm_key]), (parm_key, table_value)
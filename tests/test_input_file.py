@@ -0,0 +1,68 @@
+""" Input file parsing: quoted separators, members in one file, and errors reported with
+    the file and line they are on.
+"""
+
+import logging
+import os
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from MARBL_defaults import MARBL_defaults_class, read_parms_file, iter_input_file_members
+from MARBL_defaults import _tokenize_input_line
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+def _write_input(tmp_path, lines):
+    input_file = tmp_path / "input"
+    input_file.write_text(u"".join([line + u"\n" for line in lines]))
+    return str(input_file)
+
+@pytest.mark.parametrize("line, tokens", [("foo = 10, 20", ("foo", ["10", "20"])),
+                                          ("x = 'a, b' ! comment", ("x", ["'a, b'"])),
+                                          ('x = "it\'s"', ("x", ['"it\'s"'])),
+                                          ("  ! only a comment", None),
+                                          ("", None)])
+def test_tokenize_line(line, tokens):
+    assert _tokenize_input_line(line) == tokens
+
+@pytest.mark.parametrize("line, message", [("= 3", "missing variable name"),
+                                           ("a =", "missing value for a"),
+                                           ("a = 1,,2", "missing value for a"),
+                                           ("a = 'x", "missing closing '")])
+def test_tokenize_errors(line, message):
+    with pytest.raises(ValueError) as err:
+        _tokenize_input_line(line)
+    assert str(err.value) == message
+
+def test_arrays_and_quoted_strings(tmp_path):
+    input_file = _write_input(tmp_path, [u"! comment line",
+                                         u"parm_scalelen_z = 1.0e4, 2.0e4 ! trailing comment",
+                                         u"autotrophs(1)%lname = 'Small, phyto! guy'"])
+    members = list(iter_input_file_members(input_file))
+    assert members == [(None, {"parm_scalelen_z(1)" : "1.0e4", "parm_scalelen_z(2)" : "2.0e4",
+                               "autotrophs(1)%lname" : "'Small, phyto! guy'"},
+                        {"parm_scalelen_z(1)" : input_file + ":2", "parm_scalelen_z(2)" : input_file + ":2",
+                         "autotrophs(1)%lname" : input_file + ":3"})]
+    DefaultParms = MARBL_defaults_class(None, "CESM_x1", input_file, parms=_PARMS)
+    assert DefaultParms.parm_dict["autotrophs(1)%lname"] == '"Small, phyto! guy"'
+    assert DefaultParms.get_parm_dict_sources()["parm_scalelen_z(2)"] == input_file + ":2"
+
+def test_errors_name_their_line(tmp_path, caplog):
+    input_file = _write_input(tmp_path, [u"parm_o2_min = 4.5", u"foo", u'bar = "x',
+                                         u"!! member a", u"ciso_on = .true.",
+                                         u"!! member b", u"ciso_on = .false."])
+    with caplog.at_level(logging.ERROR):
+        members = list(iter_input_file_members(input_file, yield_errors=True))
+    assert members[0] == (None, None, None)
+    assert [member[:2] for member in members[1:]] == [("a", {"ciso_on" : ".true."}), ("b", {"ciso_on" : ".false."})]
+    assert "%s:2: expecting 'variable = value'" % input_file in caplog.text
+    assert '%s:3: missing closing "' % input_file in caplog.text
+
+    with pytest.raises(SystemExit):
+        list(iter_input_file_members(input_file))
+    with pytest.raises(SystemExit):
+        MARBL_defaults_class(None, "CESM_x1", input_file, parms=_PARMS)
@@ -0,0 +1,56 @@
+""" MARBL_defaults_class(lazy=True): values are only resolved when they are read, and
+    they are the same values an eager object computes.
+"""
+
+import os
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+_CASES = [("CESM_x1", {}),
+          ("CESM_x1", {"parm_o2_min" : "4.5", "autotrophs(2)%PCref_per_day" : "3.3",
+                       "grazing(2,1)%z_grz" : "1.5", "parm_Fe_scavenge_rate0" : "3.0/2"}),
+          ("CESM_x1", {"PFT_defaults" : '"user-specified"', "autotroph_cnt" : "2", "max_grazer_prey_cnt" : "2",
+                       "zooplankton_cnt" : "2", "grazing(1,2)%auto_ind_cnt" : "2", "grazing(1,2)%auto_ind(1)" : "1",
+                       "grazing(1,2)%auto_ind(2)" : "2"}),
+          ("CESM_x3", {"ciso_on" : ".true.", "tracer_restore_vars(1)" : "'PO4'",
+                       "tracer_restore_vars(2)" : "'NO3'"})]
+
+@pytest.mark.parametrize("grid, input_dict", _CASES)
+def test_lazy_matches_eager(grid, input_dict):
+    eager = MARBL_defaults_class(None, grid, dict(input_dict), parms=_PARMS)
+    lazy = MARBL_defaults_class(None, grid, dict(input_dict), parms=_PARMS, lazy=True)
+    assert lazy.parm_dict["autotrophs(2)%PCref_per_day"] == eager.parm_dict["autotrophs(2)%PCref_per_day"]
+    assert lazy.get_tracer_cnt() == eager.get_tracer_cnt()
+    assert lazy.get_parm_dict_variable_names("12. grazing") == eager.get_parm_dict_variable_names("12. grazing")
+    assert list(lazy.parm_dict.items()) == list(eager.parm_dict.items())
+    assert lazy.get_subcategory_index() == eager.get_subcategory_index()
+    lazy.finalize()
+
+def test_only_dependencies_are_resolved():
+    lazy = MARBL_defaults_class(None, "CESM_x1", None, parms=_PARMS, lazy=True)
+    lazy.parm_dict["autotrophs(2)%PCref_per_day"]
+    resolved = set(lazy._resolved_vars)
+    assert "autotrophs" in resolved and "autotroph_cnt" in resolved
+    assert "grazing" not in resolved and "parm_Fe_bioavail" not in resolved
+
+def test_lazy_update():
+    lazy = MARBL_defaults_class(None, "CESM_x1", None, parms=_PARMS, lazy=True)
+    assert lazy.parm_dict["autotroph_cnt"] == 3
+    lazy.update({"PFT_defaults" : '"user-specified"'})
+    eager = MARBL_defaults_class(None, "CESM_x1", {"PFT_defaults" : '"user-specified"'}, parms=_PARMS)
+    assert lazy.parm_dict["autotroph_cnt"] == eager.parm_dict["autotroph_cnt"]
+    assert list(lazy.parm_dict.items()) == list(eager.parm_dict.items())
+
+def test_unknown_variables_are_found_by_finalize():
+    lazy = MARBL_defaults_class(None, "CESM_x1", {"not_a_var" : "3", "parm_o2_min" : "1"}, parms=_PARMS, lazy=True)
+    assert float(lazy.parm_dict["parm_o2_min"]) == 1.0
+    with pytest.raises(SystemExit):
+        lazy.finalize()
@@ -0,0 +1,95 @@
+""" MARBL_perturbation: spec checks, sampling, and output files that are only written
+    once every member has been generated.
+"""
+
+import os
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import MARBL_perturbation
+from collections import OrderedDict
+from MARBL_defaults import MARBL_defaults_class, read_parms_file, iter_input_file_members
+from MARBL_perturbation import MARBL_perturbation_class
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+_SPEC = OrderedDict([("parm_Fe_bioavail", ["0.5 : 1.0"]),
+                     ("autotrophs(2)%PCref_per_day", ["4.0 : 6.0"]),
+                     ("caco3_bury_thres_opt", ["'fixed_depth'", "'omega_calc'"])])
+
+def _perturbation(spec=_SPEC, member_cnt=8, design="lhs", seed=1, input_file=None):
+    return MARBL_perturbation_class(None, "CESM_x1", spec, member_cnt, design=design, seed=seed,
+                                    input_file=input_file, parms=_PARMS)
+
+def test_samples_stay_in_range_and_are_reproducible():
+    for design in ["uniform", "lhs", "halton"]:
+        Perturbation = _perturbation(design=design)
+        samples = [float(value) for value in Perturbation.get_samples("parm_Fe_bioavail")]
+        assert all([0.5 <= value <= 1.0 for value in samples])
+        assert set(Perturbation.get_samples("caco3_bury_thres_opt")) <= set(["'fixed_depth'", "'omega_calc'"])
+        assert Perturbation.get_samples("parm_Fe_bioavail") == _perturbation(design=design).get_samples("parm_Fe_bioavail")
+
+def test_lhs_samples_every_stratum_once():
+    Perturbation = _perturbation(member_cnt=10)
+    strata = sorted([int((float(value) - 0.5) / 0.05) for value in Perturbation.get_samples("parm_Fe_bioavail")])
+    assert strata == list(range(10))
+
+@pytest.mark.parametrize("spec", [{"not_a_parameter" : ["1 : 2"]},
+                                  {"parm_Fe_bioavail" : ["1.0 : 0.5"]},
+                                  {"parm_Fe_bioavail" : ["0.5 : 2.0"]},
+                                  {"ciso_on" : ["1 : 2"]},
+                                  {"autotroph_cnt" : ["2", "3"]}])
+def test_invalid_specs_are_refused(spec):
+    with pytest.raises(SystemExit):
+        _perturbation(spec=OrderedDict(spec))
+
+def test_must_set_keys_must_be_provided(tmp_path):
+    input_file = tmp_path / "user_specified.input"
+    input_file.write_text(u"PFT_defaults = 'user-specified'\n")
+    with pytest.raises(SystemExit):
+        _perturbation(spec=OrderedDict([("parm_Fe_bioavail", ["0.5 : 1.0"])]), input_file=str(input_file))
+
+def test_members_resolve_to_their_samples(tmp_path):
+    Perturbation = _perturbation(member_cnt=4)
+    file_name = str(tmp_path / "ensemble.input")
+    Perturbation.save_input_file(file_name)
+    members = list(iter_input_file_members(file_name))
+    assert [member for member, input_dict, input_sources in members] == Perturbation.get_member_names()
+    for m, (member, input_dict, input_sources) in enumerate(members):
+        DefaultParms = MARBL_defaults_class(None, "CESM_x1", input_dict, parms=_PARMS)
+        sample = float(Perturbation.get_samples("autotrophs(2)%PCref_per_day")[m])
+        assert float(DefaultParms.parm_dict["autotrophs(2)%PCref_per_day"]) == sample
+
+def _reject_second_member(Perturbation):
+    iter_members = Perturbation.iter_members
+    def failing_iter_members():
+        for m, (member, input_dict) in enumerate(iter_members()):
+            if m == 1:
+                MARBL_perturbation._abort(1)
+            yield member, input_dict
+    Perturbation.iter_members = failing_iter_members
+
+def test_rejected_member_leaves_no_partial_file(tmp_path):
+    file_name = tmp_path / "ensemble.input"
+    file_name.write_text(u"! previous ensemble\n")
+    Perturbation = _perturbation()
+    _reject_second_member(Perturbation)
+    with pytest.raises(SystemExit):
+        Perturbation.save_input_file(str(file_name))
+    assert file_name.read_text() == u"! previous ensemble\n"
+    assert os.listdir(str(tmp_path)) == ["ensemble.input"]
+
+def test_rejected_member_leaves_no_member_files(tmp_path):
+    output_dir = tmp_path / "members"
+    Perturbation = _perturbation()
+    _reject_second_member(Perturbation)
+    with pytest.raises(SystemExit):
+        Perturbation.write_input_files(str(output_dir))
+    assert os.listdir(str(output_dir)) == []
+
+    file_names = _perturbation(member_cnt=3).write_input_files(str(output_dir))
+    assert sorted(os.listdir(str(output_dir))) == sorted([os.path.basename(name) for name in file_names])
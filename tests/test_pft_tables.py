@@ -0,0 +1,63 @@
+""" MARBL_pft_tables: columns hold the same values as parm_dict, one per element, and
+    stacked tables pad members with fewer PFTs with missing values.
+"""
+
+import math
+import os
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from collections import OrderedDict
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+from MARBL_pft_tables import get_pft_tables, stack_pft_tables
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+_TWO_AUTOTROPHS = {"PFT_defaults" : '"user-specified"', "autotroph_cnt" : "2",
+                   "zooplankton_cnt" : "1", "max_grazer_prey_cnt" : "2"}
+
+class _Members(object):
+    """ The parts of the MARBL_ensemble_class interface stack_pft_tables() uses
+    """
+
+    def __init__(self, input_dicts):
+        self._resolved = OrderedDict([(member, MARBL_defaults_class(None, "CESM_x1", dict(input_dict), parms=_PARMS))
+                                      for member, input_dict in input_dicts.items()])
+
+    def get_member_names(self):
+        return list(self._resolved.keys())
+
+    def get_parm_dict(self, member):
+        return self._resolved[member].parm_dict
+
+def test_columns_match_parm_dict():
+    DefaultParms = MARBL_defaults_class(None, "CESM_x1", None, parms=_PARMS)
+    parm_dict = DefaultParms.parm_dict
+    tables = get_pft_tables(DefaultParms)
+    assert set(["autotrophs", "zooplankton", "grazing"]) <= set(tables.keys())
+
+    autotrophs = tables["autotrophs"]
+    assert autotrophs.get_shape() == (int(parm_dict["autotroph_cnt"]),)
+    assert autotrophs.get_member_names() is None
+    for n, record in enumerate(autotrophs.get_records()):
+        assert '"%s"' % record["sname"] == parm_dict["autotrophs(%d)%%sname" % (n+1)]
+        assert record["PCref_per_day"] == float(parm_dict["autotrophs(%d)%%PCref_per_day" % (n+1)])
+
+    grazing = tables["grazing"]
+    assert grazing.get_shape() == (int(parm_dict["max_grazer_prey_cnt"]), int(parm_dict["zooplankton_cnt"]))
+    assert grazing.get_record((1, 1))["z_grz"] == float(parm_dict["grazing(1,1)%z_grz"])
+
+def test_stacked_tables_pad_smaller_members():
+    Members = _Members(OrderedDict([("default", {}), ("two", _TWO_AUTOTROPHS)]))
+    autotrophs = stack_pft_tables(_PARMS, Members)["autotrophs"]
+    autotroph_cnt = int(Members.get_parm_dict("default")["autotroph_cnt"])
+    assert autotrophs.get_shape() == (2, autotroph_cnt)
+    assert autotrophs.get_member_names() == ["default", "two"]
+    assert autotrophs.get_record((2, 1))["sname"] == Members.get_parm_dict("two")["autotrophs(1)%sname"].strip('"')
+    padded = autotrophs.get_record((2, autotroph_cnt))
+    assert padded["sname"] == "" and math.isnan(padded["PCref_per_day"])
+
+    only_two = stack_pft_tables(_PARMS, Members, members=["two"])["autotrophs"]
+    assert only_two.get_shape() == (1, 2)
@@ -0,0 +1,92 @@
+""" MARBL_profiling: phases and counters are recorded while profiling is on, the
+    wrapped functions give the same results, and turning it off restores them.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import MARBL_defaults
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+from MARBL_profiling import enable_profiling, disable_profiling, profiling_enabled, reset_profile
+from MARBL_profiling import profile_phase, add_count, get_profile, write_profile
+
+_YAML_FILE = os.path.join(PACKAGE_DIR, "parameters.yaml")
+_PARMS = read_parms_file(_YAML_FILE)
+
+@pytest.fixture
+def profiling():
+    enable_profiling()
+    try:
+        yield
+    finally:
+        disable_profiling()
+
+def test_nothing_is_recorded_while_off():
+    assert not profiling_enabled()
+    get_var_value = MARBL_defaults._get_var_value
+    with profile_phase("render"):
+        add_count("lines")
+    assert get_profile() is None
+    assert MARBL_defaults._get_var_value is get_var_value
+
+def test_phases_and_counters(profiling):
+    with profile_phase("render"):
+        add_count("lines", 3)
+    with profile_phase("render"):
+        add_count("lines")
+    profile = get_profile()
+    assert profile["phases"]["render"]["calls"] == 2
+    assert profile["counters"] == {"lines" : 4}
+    assert profile["total_time"] >= profile["phases"]["render"]["time"]
+    reset_profile()
+    assert get_profile()["phases"] == dict()
+
+def test_profiled_resolve_matches_unprofiled():
+    expected = MARBL_defaults_class(None, "CESM_x1", {"ciso_on" : ".true."}, parms=_PARMS)
+    get_var_value = MARBL_defaults._get_var_value
+    enable_profiling()
+    try:
+        assert MARBL_defaults._get_var_value is not get_var_value
+        profiled = MARBL_defaults_class(None, "CESM_x1", {"ciso_on" : ".true."}, parms=_PARMS)
+        profile = get_profile()
+    finally:
+        disable_profiling()
+    assert MARBL_defaults._get_var_value is get_var_value
+    assert list(profiled.parm_dict.items()) == list(expected.parm_dict.items())
+    # _resolve_all() is re-entered while resolving; only the outermost call is timed
+    assert profile["phases"]["resolve"]["calls"] == 1
+    assert profile["phases"]["config-keyword matching (_get_var_value)"]["calls"] > 0
+    assert profile["counters"]["_natural_sort_key"] > 0
+
+def test_write_profile(profiling, tmp_path):
+    with profile_phase("render"):
+        pass
+    json_file = str(tmp_path / "profile.json")
+    write_profile(json_file)
+    with open(json_file) as fin:
+        assert json.load(fin)["phases"]["render"]["calls"] == 1
+    table_file = str(tmp_path / "profile.txt")
+    write_profile(table_file)
+    with open(table_file) as fin:
+        lines = fin.readlines()
+    assert lines[0].split() == ["phase", "calls", "time", "(s)", "%"]
+    assert lines[1].split()[:2] == ["render", "1"]
+
+def test_print_defaults_profile_flag(tmp_path):
+    json_file = str(tmp_path / "profile.json")
+    outputs = []
+    for flags in [[], ["--profile", json_file]]:
+        proc = subprocess.Popen([sys.executable, os.path.join(PACKAGE_DIR, "print_defaults.py"), "-y", _YAML_FILE]
+                                + flags, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        outputs.append(proc.communicate()[0])
+        assert proc.returncode == 0
+    assert outputs[0] == outputs[1]
+    with open(json_file) as fin:
+        assert "print" in json.load(fin)["phases"]
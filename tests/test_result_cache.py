@@ -0,0 +1,80 @@
+""" MARBL_result_cache: hits must give the same settings as resolving them, and the
+    key must change whenever the YAML file, the input or the resolver code changes.
+"""
+
+import os
+import pickle
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import MARBL_result_cache
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+from MARBL_result_cache import MARBL_result_cache_class
+
+_YAML_FILE = os.path.join(PACKAGE_DIR, "parameters.yaml")
+_PARMS = read_parms_file(_YAML_FILE)
+
+def _write_input(tmp_path, name, lines):
+    input_file = tmp_path / name
+    input_file.write_text(u"".join([line + u"\n" for line in lines]))
+    return str(input_file)
+
+def test_hit_matches_fresh_resolve(tmp_path):
+    input_file = _write_input(tmp_path, "input", [u"parm_Fe_bioavail = 0.5", u"ciso_on = .true."])
+    Cache = MARBL_result_cache_class(str(tmp_path / "cache"))
+    miss = Cache.get_defaults(_YAML_FILE, "CESM_x1", input_file, parms=_PARMS)
+    hit = Cache.get_defaults(_YAML_FILE, "CESM_x1", input_file, parms=_PARMS)
+    fresh = MARBL_defaults_class(_YAML_FILE, "CESM_x1", input_file, parms=_PARMS)
+    assert Cache.get_session_stats() == dict(hits=1, misses=1, stores=1, evictions=0)
+    for result in [miss, hit]:
+        assert list(result.parm_dict.items()) == list(fresh.parm_dict.items())
+        assert result.get_subcategory_names() == fresh.get_subcategory_names()
+        assert result.get_tracer_cnt() == fresh.get_tracer_cnt()
+
+def test_key_ignores_input_file_layout(tmp_path):
+    Cache = MARBL_result_cache_class(str(tmp_path / "cache"))
+    first = _write_input(tmp_path, "first", [u"parm_Fe_bioavail = 0.5", u"ciso_on = .true."])
+    second = _write_input(tmp_path, "second", [u"! comment", u"ciso_on=.true.", u"", u"parm_Fe_bioavail =   0.5"])
+    Cache.get_defaults(_YAML_FILE, "CESM_x1", first, parms=_PARMS)
+    Cache.get_defaults(_YAML_FILE, "CESM_x1", second, parms=_PARMS)
+    assert Cache.get_session_stats()["hits"] == 1
+    Cache.get_defaults(_YAML_FILE, "CESM_x3", second, parms=_PARMS)
+    assert Cache.get_session_stats()["misses"] == 2
+
+def test_key_changes_with_resolver_code(tmp_path, monkeypatch):
+    module = tmp_path / "MARBL_defaults.py"
+    module.write_text(u"# version 1\n")
+    monkeypatch.setattr(MARBL_result_cache, "_RESOLVER_MODULES", [str(module)])
+    monkeypatch.setattr(MARBL_result_cache, "_resolver_hash", None)
+    Cache = MARBL_result_cache_class(str(tmp_path / "cache"))
+    old_key = Cache.get_key(_YAML_FILE, "CESM_x1", dict())
+
+    module.write_text(u"# version 2\n")
+    monkeypatch.setattr(MARBL_result_cache, "_resolver_hash", None)
+    assert Cache.get_key(_YAML_FILE, "CESM_x1", dict()) != old_key
+
+def test_entries_are_never_unpickled(tmp_path):
+    class _Exploit(object):
+        def __reduce__(self):
+            return (open, (str(tmp_path / "pwned"), "w"))
+
+    Cache = MARBL_result_cache_class(str(tmp_path / "cache"))
+    key = Cache.get_key(_YAML_FILE, "CESM_x1", dict())
+    with open(Cache._get_entry_file(key), "wb") as fout:
+        pickle.dump({"key" : key, "payload" : _Exploit()}, fout)
+    assert Cache.lookup(key) is None
+    assert not os.path.exists(str(tmp_path / "pwned"))
+
+    # The miss is replaced by a valid entry
+    Cache.get_defaults(_YAML_FILE, "CESM_x1", None, parms=_PARMS)
+    assert Cache.lookup(key) is not None
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    Cache = MARBL_result_cache_class(str(tmp_path / "cache"), max_size=1)
+    for grid in ["CESM_x1", "CESM_x3"]:
+        Cache.get_defaults(_YAML_FILE, grid, None, parms=_PARMS)
+    stats = Cache.get_stats()
+    assert stats["entries"] == 1 and stats["evictions"] == 1
+    assert Cache.lookup(Cache.get_key(_YAML_FILE, "CESM_x3", dict())) is not None
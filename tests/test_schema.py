@@ -0,0 +1,63 @@
+""" MARBL_schema: the compiled schema can not be changed, so one schema can be shared
+    by MARBL_defaults_class objects (in any number of threads).
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+from MARBL_schema import MARBL_schema_class, get_schema
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+_INPUT_DICTS = [{}, {"ciso_on" : ".true."}, {"parm_Fe_bioavail" : "0.5"},
+                {"PFT_defaults" : '"user-specified"', "autotroph_cnt" : "2",
+                 "zooplankton_cnt" : "1", "max_grazer_prey_cnt" : "2"}]
+
+def test_schema_is_read_only():
+    schema = get_schema(_PARMS)
+    assert get_schema(schema) is schema
+    with pytest.raises(AttributeError):
+        schema.categories = ()
+    spec = schema.variables["PFT_defaults"]
+    with pytest.raises(AttributeError):
+        spec.default_value = "user-specified"
+    with pytest.raises(TypeError):
+        schema.variables["new_variable"] = spec
+    derived_type = schema.variables["autotrophs"].derived_type
+    assert isinstance(derived_type.components, tuple)
+    with pytest.raises(AttributeError):
+        derived_type.components[0].datatype = "integer"
+
+def test_resolving_does_not_change_the_schema():
+    schema = MARBL_schema_class(_PARMS)
+    before = [repr(spec) for spec in schema.variables.values()]
+    for input_dict in _INPUT_DICTS:
+        DefaultParms = MARBL_defaults_class(None, "CESM_x3", dict(input_dict), parms=schema)
+        assert DefaultParms.get_schema() is schema
+    assert [repr(spec) for spec in schema.variables.values()] == before
+
+def test_threads_sharing_a_schema():
+    schema = get_schema(_PARMS)
+    expected = [list(MARBL_defaults_class(None, "CESM_x1", dict(input_dict), parms=_PARMS).parm_dict.items())
+                for input_dict in _INPUT_DICTS]
+    results = dict()
+    def resolve(n):
+        for repeat in range(3):
+            input_dict = _INPUT_DICTS[(n + repeat) % len(_INPUT_DICTS)]
+            DefaultParms = MARBL_defaults_class(None, "CESM_x1", dict(input_dict), parms=schema)
+            results[(n, repeat)] = list(DefaultParms.parm_dict.items())
+    threads = [threading.Thread(target=resolve, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for (n, repeat), parm_dict_items in results.items():
+        assert parm_dict_items == expected[(n + repeat) % len(_INPUT_DICTS)]
+    assert len(results) == 24
@@ -0,0 +1,71 @@
+""" read_parms_file(): the validated dictionary is cached next to the YAML file, and
+    the cache is only used while the YAML file (and the cache version) are unchanged.
+"""
+
+import os
+import shutil
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import MARBL_defaults
+from MARBL_defaults import read_parms_file, _get_schema_cache_file
+
+def _copy_yaml(tmp_path):
+    yaml_file = str(tmp_path / "parameters.yaml")
+    shutil.copy(os.path.join(PACKAGE_DIR, "parameters.yaml"), yaml_file)
+    return yaml_file
+
+def _count_yaml_parses(monkeypatch):
+    import yaml
+    parses = []
+    safe_load = yaml.safe_load
+    def counting_safe_load(contents):
+        parses.append(len(contents))
+        return safe_load(contents)
+    monkeypatch.setattr(yaml, "safe_load", counting_safe_load)
+    return parses
+
+def test_cache_hit_skips_parsing(tmp_path, monkeypatch):
+    yaml_file = _copy_yaml(tmp_path)
+    parms = read_parms_file(yaml_file)
+    assert os.path.isfile(_get_schema_cache_file(yaml_file))
+    parses = _count_yaml_parses(monkeypatch)
+    assert read_parms_file(yaml_file) == parms
+    assert len(parses) == 0
+    assert read_parms_file(yaml_file, use_cache=False) == parms
+    assert len(parses) == 1
+
+def test_changed_yaml_file_is_reparsed(tmp_path):
+    yaml_file = _copy_yaml(tmp_path)
+    read_parms_file(yaml_file)
+    with open(yaml_file) as fin:
+        contents = fin.read()
+    with open(yaml_file, "w") as fout:
+        fout.write(contents.replace("longname : Fraction of Fe flux that is bioavailable",
+                                    "longname : Bioavailable fraction of Fe flux", 1))
+    parms = read_parms_file(yaml_file)
+    assert parms["general_parms"]["parm_Fe_bioavail"]["longname"] == "Bioavailable fraction of Fe flux"
+
+def test_stale_or_corrupt_cache_is_ignored(tmp_path, monkeypatch):
+    yaml_file = _copy_yaml(tmp_path)
+    parms = read_parms_file(yaml_file)
+    cache_file = _get_schema_cache_file(yaml_file)
+
+    monkeypatch.setattr(MARBL_defaults, "_SCHEMA_CACHE_VERSION", MARBL_defaults._SCHEMA_CACHE_VERSION + 1)
+    assert MARBL_defaults._read_schema_cache(cache_file, "any hash") is None
+    assert read_parms_file(yaml_file) == parms
+
+    with open(cache_file, "wb") as fout:
+        fout.write(b"not a cache")
+    assert read_parms_file(yaml_file) == parms
+
+def test_unwritable_cache_directory(tmp_path):
+    yaml_file = _copy_yaml(tmp_path)
+    os.chmod(str(tmp_path), 0o500)
+    try:
+        parms = read_parms_file(yaml_file)
+    finally:
+        os.chmod(str(tmp_path), 0o700)
+    assert "_order" in parms
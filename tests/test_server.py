@@ -0,0 +1,89 @@
+""" MARBL_server: the client / server round trip, and the checks that keep the server
+    from replacing anything but its own stale socket.
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import MARBL_server
+
+_YAML_FILE = os.path.join(PACKAGE_DIR, "parameters.yaml")
+
+def _start_server(socket_path):
+    thread = threading.Thread(target=MARBL_server.serve, args=(socket_path,))
+    thread.daemon = True
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            return thread
+        time.sleep(0.05)
+    raise AssertionError("server did not start")
+
+def test_round_trip_matches_local_output(tmp_path):
+    try:
+        from StringIO import StringIO
+    except ImportError:
+        from io import StringIO
+    from MARBL_defaults import MARBL_defaults_class, print_parm_dict
+
+    socket_path = str(tmp_path / "s.sock")
+    thread = _start_server(socket_path)
+    fout, ferr = StringIO(), StringIO()
+    assert MARBL_server.request_defaults(socket_path, _YAML_FILE, "CESM_x1", None, fout, ferr) == 0
+    assert MARBL_server.shutdown_server(socket_path)
+    thread.join(10)
+    assert not os.path.exists(socket_path)
+
+    DefaultParms = MARBL_defaults_class(_YAML_FILE, "CESM_x1", None)
+    expected = StringIO()
+    print_parm_dict(expected, DefaultParms.get_subcategory_names(),
+                    DefaultParms.get_parm_dict_variable_names, DefaultParms.parm_dict)
+    assert fout.getvalue() == expected.getvalue()
+
+def test_serve_refuses_to_replace_regular_file(tmp_path):
+    socket_path = tmp_path / "not_a_socket"
+    socket_path.write_text(u"keep me\n")
+    with pytest.raises(SystemExit):
+        MARBL_server.serve(str(socket_path))
+    assert socket_path.read_text() == u"keep me\n"
+
+def test_serve_replaces_stale_socket(tmp_path):
+    socket_path = str(tmp_path / "stale.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+    thread = _start_server(socket_path)
+    for _ in range(100):
+        if MARBL_server.shutdown_server(socket_path):
+            break
+        time.sleep(0.05)
+    thread.join(10)
+    assert not thread.is_alive()
+
+def test_client_ignores_non_socket(tmp_path):
+    socket_path = tmp_path / "not_a_socket"
+    socket_path.write_text(u"")
+    assert MARBL_server.request_defaults(str(socket_path), _YAML_FILE, "CESM_x1", None, None, None) is None
+
+def test_default_socket_path(monkeypatch, tmp_path):
+    monkeypatch.delenv("MARBL_DEFAULTS_SOCKET", raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert MARBL_server.get_default_socket_path() == str(tmp_path / "marbl_defaults.sock")
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    socket_dir = os.path.dirname(MARBL_server.get_default_socket_path())
+    assert socket_dir.endswith("marbl_defaults_%d" % os.getuid())
+
+def test_private_dir_must_not_be_shared(tmp_path):
+    private_dir = str(tmp_path / "private")
+    assert MARBL_server._make_private_dir(private_dir) is None
+    assert os.stat(private_dir).st_mode & 0o777 == 0o700
+    os.chmod(private_dir, 0o777)
+    assert MARBL_server._make_private_dir(private_dir) is not None
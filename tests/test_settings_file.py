@@ -0,0 +1,71 @@
+""" MARBL_settings_file: values are stored in the column their schema datatype calls
+    for, and converting a file back to text reproduces print_defaults.py exactly.
+"""
+
+import os
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from MARBL_defaults import MARBL_defaults_class, read_parms_file, print_parm_dict
+from MARBL_schema import get_schema
+from MARBL_settings_file import MARBL_settings_file_class, write_settings_file, write_settings_text
+from MARBL_settings_file import _get_datatype
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+# Reals written three ways: from the YAML (repr), computed (%20.15e), and as typed by a user
+_MEMBERS = [("default", {}),
+            ("overrides", {"parm_Fe_bioavail" : "0.5d0", "caco3_bury_thres_depth" : "300.0e3",
+                           "autotrophs(1)%kFe" : "1.0e-5"}),
+            ("two_autotrophs", {"PFT_defaults" : '"user-specified"', "autotroph_cnt" : "2",
+                                "zooplankton_cnt" : "1", "max_grazer_prey_cnt" : "2"})]
+
+def _write(tmp_path):
+    file_name = str(tmp_path / "settings.bin")
+    members = []
+    resolved = dict()
+    for member, input_dict in _MEMBERS:
+        DefaultParms = MARBL_defaults_class(None, "CESM_x1", dict(input_dict), parms=_PARMS)
+        resolved[member] = DefaultParms
+        members.append((member, DefaultParms.get_parm_dict_variable_names, DefaultParms.parm_dict))
+    write_settings_file(file_name, resolved["default"].get_subcategory_names(), members, _PARMS)
+    return MARBL_settings_file_class(file_name), resolved
+
+def test_text_round_trip(tmp_path):
+    Settings, resolved = _write(tmp_path)
+    for member, DefaultParms in resolved.items():
+        expected = StringIO()
+        print_parm_dict(expected, DefaultParms.get_subcategory_names(),
+                        DefaultParms.get_parm_dict_variable_names, DefaultParms.parm_dict)
+        converted = StringIO()
+        write_settings_text(converted, Settings, member)
+        assert converted.getvalue() == expected.getvalue()
+    Settings.close()
+
+def test_typed_values_follow_schema_datatype(tmp_path):
+    Settings, resolved = _write(tmp_path)
+    schema = get_schema(_PARMS)
+    python_types = {"real" : float, "integer" : int, "logical" : bool, "string" : str}
+    for member in Settings.get_member_names():
+        for key, value in Settings.get_parm_dict(member, typed=True).items():
+            assert type(value) is python_types[_get_datatype(schema, key)], (member, key, value)
+    assert Settings.get_value("default", "parm_f_prod_sp_CaCO3", typed=True) == 0.07
+    assert Settings.get_value("overrides", "parm_Fe_bioavail", typed=True) == 0.5
+    assert Settings.get_value("overrides", "autotrophs(1)%kFe", typed=True) == 1.0e-5
+    assert Settings.get_value("overrides", "autotrophs(1)%kFe") == resolved["overrides"].parm_dict["autotrophs(1)%kFe"]
+    Settings.close()
+
+def test_missing_keys_and_columns(tmp_path):
+    Settings, resolved = _write(tmp_path)
+    key = "autotrophs(3)%sname"
+    column = Settings.get_column(key)
+    assert list(column.keys()) == ["default", "overrides"]
+    assert key not in Settings.get_parm_dict("two_autotrophs")
+    Settings.close()
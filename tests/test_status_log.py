@@ -0,0 +1,78 @@
+""" MARBL_status_log: Tunable Parameters blocks are read from plain and compressed
+    logs, and audited against the expected settings (serially and in a pool).
+"""
+
+import gzip
+import os
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from collections import OrderedDict
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+from MARBL_status_log import MARBL_log_audit_class, read_status_log
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+_EXPECTED = MARBL_defaults_class(None, "CESM_x1", None, parms=_PARMS).parm_dict
+
+_PREFIX = "(marbl_instance 1) "
+
+def _fortran_value(value):
+    """ Format a parm_dict value the way finalize_vars() writes it
+    """
+    value = str(value)
+    if value[:1] == '"':
+        return "'%s'" % value[1:-1]
+    if value in [".true.", ".false."]:
+        return value
+    try:
+        return "%d" % int(value)
+    except ValueError:
+        return "%24.16E" % float(value)
+
+def _log_lines(parm_dict, changes=None):
+    """ Lines of a status log with one Tunable Parameters block (and output from other
+        components around and inside it)
+    """
+    settings = OrderedDict(parm_dict)
+    settings.update(changes or dict())
+    lines = ["ocean model starting", _PREFIX + "-" * 18, _PREFIX + "Tunable Parameters", _PREFIX + "-" * 18,
+             _PREFIX]
+    for n, (key, value) in enumerate(settings.items()):
+        lines.append(_PREFIX + "%s = %s" % (key, _fortran_value(value)))
+        if n == 3:
+            lines.append("atmosphere: interleaved message")
+    lines.extend([_PREFIX + "-" * 18, _PREFIX + "Tracer Initialization", "ocean model done"])
+    return [line + "\n" for line in lines]
+
+def _write_log(file_name, lines):
+    if file_name.endswith(".gz"):
+        with gzip.open(file_name, "wb") as fout:
+            fout.write("".join(lines).encode("utf-8"))
+    else:
+        with open(file_name, "w") as fout:
+            fout.writelines(lines)
+    return file_name
+
+def test_read_status_log_plain_and_gzip(tmp_path):
+    for name in ["run.log", "run.log.gz"]:
+        blocks = read_status_log(_write_log(str(tmp_path / name), _log_lines(_EXPECTED)))
+        assert len(blocks) == 1
+        assert list(blocks[0].keys()) == list(_EXPECTED.keys())
+        assert blocks[0]["PFT_defaults"] == '"CESM2"'
+
+def test_audit_reports_only_differences(tmp_path):
+    good = _write_log(str(tmp_path / "good.log"), _log_lines(_EXPECTED))
+    good_gz = _write_log(str(tmp_path / "good.log.gz"), _log_lines(_EXPECTED))
+    bad = _write_log(str(tmp_path / "bad.log"), _log_lines(_EXPECTED, {"parm_Fe_bioavail" : "0.5"}))
+    empty = _write_log(str(tmp_path / "empty.log"), ["nothing from MARBL here\n"])
+    missing = str(tmp_path / "missing.log")
+    log_files = [good, good_gz, bad, empty, missing]
+    for nprocs in [1, 2]:
+        Audit = MARBL_log_audit_class(log_files, {None : _EXPECTED}, nprocs=nprocs)
+        assert [Audit.get_status(log_file) for log_file in log_files] == \
+               ["ok", "ok", "mismatch", "no settings", "unreadable"]
+        assert Audit.get_mismatches(bad) == [(1, "parm_Fe_bioavail", _EXPECTED["parm_Fe_bioavail"], "5.0000000000000000E-01")]
+        assert Audit.get_setting_cnt(good) == len(_EXPECTED)
+        assert Audit.get_failed_log_files() == [bad, empty, missing]
@@ -0,0 +1,50 @@
+""" get_subcategory_index(): the parm_dict keys of every subcategory, as a full scan of
+    parm_dict and the YAML subcategories would list them (also after update()).
+"""
+
+import os
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+from MARBL_defaults import _parse_parm_key, _sort, _natural_sort_key
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+_TWO_AUTOTROPHS = {"PFT_defaults" : '"user-specified"', "autotroph_cnt" : "2",
+                   "zooplankton_cnt" : "1", "max_grazer_prey_cnt" : "2"}
+
+def _scan(DefaultParms):
+    """ Subcategory -> sorted parm_dict keys, from the subcategory of each key's YAML
+        variable (or derived type component)
+    """
+    schema = DefaultParms.get_schema()
+    index = dict([(subcategory, []) for subcategory in DefaultParms.get_subcategory_names()])
+    for parm_key in DefaultParms.parm_dict.keys():
+        var_name, array_index, component, sub_index = _parse_parm_key(parm_key)
+        spec = schema.variables[var_name]
+        if component is not None:
+            spec = spec.derived_type.component_index[component]
+        index[spec.subcategory].append(parm_key)
+    return dict([(subcategory, _sort(keys, sort_key=_natural_sort_key)) for subcategory, keys in index.items()])
+
+@pytest.mark.parametrize("grid, input_dict", [("CESM_x1", {}), ("CESM_x3", {"ciso_on" : ".true."}),
+                                              ("CESM_x1", _TWO_AUTOTROPHS)])
+def test_index_matches_scan(grid, input_dict):
+    DefaultParms = MARBL_defaults_class(None, grid, dict(input_dict), parms=_PARMS)
+    index = DefaultParms.get_subcategory_index()
+    assert list(index.keys()) == DefaultParms.get_subcategory_names()
+    assert dict(index) == _scan(DefaultParms)
+    for subcategory in DefaultParms.get_subcategory_names():
+        assert DefaultParms.get_parm_dict_variable_names(subcategory) == index[subcategory]
+    assert DefaultParms.get_parm_dict_variable_names("not a subcategory") == []
+
+def test_index_follows_update():
+    DefaultParms = MARBL_defaults_class(None, "CESM_x1", None, parms=_PARMS)
+    DefaultParms.update(_TWO_AUTOTROPHS)
+    assert dict(DefaultParms.get_subcategory_index()) == _scan(DefaultParms)
+    assert "autotrophs(3)%sname" not in DefaultParms.get_parm_dict_variable_names("10. autotrophs")
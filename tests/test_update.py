@@ -0,0 +1,62 @@
+""" MARBL_defaults_class.update() must give the same parm_dict as building a new
+    object from the final set of overrides.
+"""
+
+import os
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+
+def _fresh(input_dict):
+    return MARBL_defaults_class(None, "CESM_x1", dict(input_dict), parms=_PARMS)
+
+def _assert_same(updated, fresh):
+    assert list(updated.parm_dict.items()) == list(fresh.parm_dict.items())
+
+def test_shorter_array_override():
+    DefaultParms = _fresh({})
+    DefaultParms.update({"parm_scalelen_z" : "1.0, 2.0, 3.0, 4.0"})
+    DefaultParms.update({"parm_scalelen_z" : "9.0, 8.0"})
+    _assert_same(DefaultParms, _fresh({"parm_scalelen_z(1)" : "9.0", "parm_scalelen_z(2)" : "8.0"}))
+
+def test_removed_array_override():
+    DefaultParms = _fresh({"parm_scalelen_z(3)" : "3.0"})
+    DefaultParms.update({"parm_scalelen_z" : "9.0, 8.0"})
+    DefaultParms.update({"parm_scalelen_z" : None})
+    _assert_same(DefaultParms, _fresh({}))
+
+def test_element_override_keeps_other_elements():
+    DefaultParms = _fresh({})
+    DefaultParms.update({"parm_scalelen_z" : "1.0, 2.0, 3.0"})
+    DefaultParms.update({"parm_scalelen_z(2)" : "5.0"})
+    _assert_same(DefaultParms, _fresh({"parm_scalelen_z(1)" : "1.0", "parm_scalelen_z(2)" : "5.0",
+                                       "parm_scalelen_z(3)" : "3.0"}))
+
+def test_derived_type_array_component():
+    overrides = {"PFT_defaults" : '"user-specified"', "autotroph_cnt" : "3", "zooplankton_cnt" : "1",
+                 "grazing(1,1)%auto_ind_cnt" : "3"}
+    DefaultParms = _fresh(overrides)
+    DefaultParms.update({"grazing(1,1)%auto_ind" : "1, 2, 3"})
+    DefaultParms.update({"grazing(1,1)%auto_ind_cnt" : "1", "grazing(1,1)%auto_ind" : "2"})
+    overrides.update({"grazing(1,1)%auto_ind_cnt" : "1", "grazing(1,1)%auto_ind" : "2"})
+    _assert_same(DefaultParms, _fresh(overrides))
+
+def test_dependents_follow_their_dependencies():
+    DefaultParms = _fresh({})
+    dependency_graph = DefaultParms.get_dependency_graph()
+    assert set(["autotrophs", "grazing"]) <= set(dependency_graph["autotroph_cnt"])
+    assert "tracer_restore_vars" in dependency_graph["ciso_on"]
+    assert dependency_graph["parm_Fe_bioavail"] == []
+
+    DefaultParms.update({"ciso_on" : ".true."})
+    _assert_same(DefaultParms, _fresh({"ciso_on" : ".true."}))
+    DefaultParms.update({"PFT_defaults" : '"user-specified"', "autotroph_cnt" : "2"})
+    _assert_same(DefaultParms, _fresh({"ciso_on" : ".true.", "PFT_defaults" : '"user-specified"',
+                                       "autotroph_cnt" : "2"}))
+    DefaultParms.update({"PFT_defaults" : None, "autotroph_cnt" : None, "ciso_on" : None})
+    _assert_same(DefaultParms, _fresh({}))
@@ -0,0 +1,57 @@
+""" MARBL_validator: every value that breaks a datatype, valid_values, valid_range or
+    constraints entry is reported (with the input file line it came from).
+"""
+
+import copy
+import os
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from collections import OrderedDict
+from MARBL_defaults import MARBL_defaults_class, read_parms_file
+from MARBL_validator import MARBL_validator_class, log_violations
+
+_PARMS = read_parms_file(os.path.join(PACKAGE_DIR, "parameters.yaml"))
+_VALIDATOR = MARBL_validator_class(_PARMS)
+
+def _parm_dict(input_dict):
+    return MARBL_defaults_class(None, "CESM_x1", dict(input_dict), parms=_PARMS).parm_dict
+
+def test_default_settings_are_valid():
+    for grid in ["CESM_x1", "CESM_x3"]:
+        assert _VALIDATOR.validate_parm_dict(MARBL_defaults_class(None, grid, None, parms=_PARMS).parm_dict) == []
+
+def test_every_violation_is_reported():
+    parm_dict = _parm_dict({"parm_Fe_bioavail" : "1.5", "PON_bury_coeff" : "-0.5",
+                            "caco3_bury_thres_opt" : "'omega'", "ciso_on" : "1"})
+    sources = {"parm_Fe_bioavail" : "user_nl_marbl:3"}
+    violations = _VALIDATOR.validate_parm_dict(parm_dict, sources)
+    messages = dict([(parm_key, (message, source)) for parm_key, value, message, source in violations])
+    assert sorted(messages.keys()) == sorted(["parm_Fe_bioavail", "PON_bury_coeff", "caco3_bury_thres_opt", "ciso_on"])
+    assert messages["parm_Fe_bioavail"] == ("greater than the maximum value (1.0)", "user_nl_marbl:3")
+    assert messages["PON_bury_coeff"] == ("must be non-negative", None)
+    assert messages["caco3_bury_thres_opt"][0].startswith("not one of the valid values")
+    assert messages["ciso_on"][0] == "not a valid logical"
+
+def test_ensemble_violations_follow_member_order():
+    parm_dicts = OrderedDict([("a", _parm_dict({"parm_Fe_bioavail" : "1.5"})),
+                              ("b", _parm_dict({})),
+                              ("c", _parm_dict({"parm_Fe_bioavail" : "1.5", "PON_bury_coeff" : "-0.5"}))])
+    violations = _VALIDATOR.validate_ensemble(parm_dicts)
+    assert [(member, parm_key) for member, parm_key, value, message, source in violations] == \
+           [("a", "parm_Fe_bioavail"), ("c", "parm_Fe_bioavail"), ("c", "PON_bury_coeff")]
+    assert log_violations(violations)
+    assert not log_violations([])
+
+@pytest.mark.parametrize("var_name, key, value", [("parm_Fe_bioavail", "valid_range", [0]),
+                                                  ("parm_Fe_bioavail", "constraints", ["even"]),
+                                                  ("PFT_defaults", "valid_range", [0, 1])])
+def test_invalid_schema_entries_abort(var_name, key, value):
+    parms = copy.deepcopy(_PARMS)
+    parms["general_parms"][var_name][key] = value
+    with pytest.raises(SystemExit):
+        MARBL_validator_class(parms)